@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-request cost of the HTTP middleware in front of /mcp
+Compares the old stack (CORSMiddleware plus two @app.middleware("http")
+layers) with the fused GatewayMiddleware. Requests are driven straight
+through ASGI, without sockets, and both stacks share the same token check,
+logging stub and endpoint, so the difference is the middleware itself.
+
+    python bench_middleware.py [requests]
+"""
+
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount
+
+from http_gateway import BEARER, PUBLIC, CorsPolicy, GatewayMiddleware, RoutePolicy, RouteTable
+
+TOKEN = "benchmark-token"
+TOKENS = {TOKEN: {"client_id": "bench", "scope": "mcp:read mcp:write"}}
+ORIGINS = ["https://claude.ai", "https://www.claude.ai"]
+METHODS = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+STREAM_CHUNKS = 16
+
+
+def log_stub(*args, **kwargs):
+    pass
+
+
+async def mcp_endpoint(scope, receive, send):
+    """Stands in for the mounted MCP app: a small JSON reply, or an SSE stream"""
+    body = b'{"jsonrpc":"2.0","id":1,"result":{}}'
+    if scope["path"].endswith("/stream"):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream")]})
+        for _ in range(STREAM_CHUNKS):
+            await send({"type": "http.response.body", "body": b"data: " + body + b"\n\n", "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def stacked_app() -> Starlette:
+    """The middleware layout clodforest.py used before the gateway
+
+    FastAPI's @app.middleware("http") is BaseHTTPMiddleware with a dispatch function.
+    """
+    app = Starlette(routes=[Mount("/mcp", app=mcp_endpoint)])
+    app.add_middleware(CORSMiddleware, allow_origins=ORIGINS, allow_credentials=True,
+                       allow_methods=METHODS, allow_headers=["*"])
+
+    async def access_logging_middleware(request: Request, call_next):
+        start_time = time.time()
+        response = await call_next(request)
+        log_stub(request, response.status_code, process_time=time.time() - start_time,
+                 content_length=response.headers.get("content-length"))
+        return response
+
+    async def oauth_protection_middleware(request: Request, call_next):
+        if request.url.path.startswith(("/.well-known", "/oauth", "/register", "/health", "/api/health", "/debug")):
+            return await call_next(request)
+        if request.url.path.startswith("/mcp"):
+            auth_header = request.headers.get("authorization")
+            if not auth_header or not auth_header.startswith("Bearer "):
+                return JSONResponse(status_code=401, content={"error": "Authorization header required"})
+            token_data = TOKENS.get(auth_header.split(" ")[1])
+            if not token_data:
+                return JSONResponse(status_code=401, content={"error": "Invalid or expired token"})
+            log_stub("authentication_success", client_id=token_data["client_id"])
+        return await call_next(request)
+
+    # Added last runs first, as with the decorators
+    app.add_middleware(BaseHTTPMiddleware, dispatch=access_logging_middleware)
+    app.add_middleware(BaseHTTPMiddleware, dispatch=oauth_protection_middleware)
+    return app
+
+
+def fused_app() -> Starlette:
+    app = Starlette(routes=[Mount("/mcp", app=mcp_endpoint)])
+
+    async def authenticate(token, info):
+        token_data = TOKENS.get(token)
+        if token_data:
+            log_stub("authentication_success", client_id=token_data["client_id"])
+        return token_data
+
+    app.add_middleware(
+        GatewayMiddleware,
+        cors=CorsPolicy(ORIGINS, METHODS, ["*"], allow_credentials=True),
+        classify=RouteTable({
+            "/.well-known": RoutePolicy(PUBLIC), "/oauth": RoutePolicy(PUBLIC), "/register": RoutePolicy(PUBLIC),
+            "/health": RoutePolicy(PUBLIC), "/api/health": RoutePolicy(PUBLIC), "/debug": RoutePolicy(PUBLIC),
+            "/mcp": RoutePolicy(BEARER),
+        }).classify,
+        authenticate=authenticate,
+        reject=log_stub,
+        on_complete=log_stub,
+    )
+    return app
+
+
+def make_scope(path: str):
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "server": ("127.0.0.1", 8080), "client": ("127.0.0.1", 50000),
+        "headers": [
+            (b"host", b"127.0.0.1:8080"),
+            (b"authorization", f"Bearer {TOKEN}".encode()),
+            (b"origin", b"https://claude.ai"),
+            (b"content-type", b"application/json"),
+            (b"accept", b"application/json, text/event-stream"),
+            (b"user-agent", b"bench"),
+        ],
+    }
+
+
+async def drive(app, path: str, requests: int) -> list:
+    """Per-request latencies in microseconds"""
+    body = {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def receive():
+        return body
+
+    async def send(message):
+        if message["type"] == "http.response.start" and message["status"] != 200:
+            raise RuntimeError(f"unexpected status {message['status']}")
+
+    # Starlette builds its middleware stack on the first call; keep that out of the numbers
+    await app(make_scope(path), receive, send)
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await app(make_scope(path), receive, send)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return latencies
+
+
+def summarize(latencies: list) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "mean_us": round(statistics.fmean(ordered), 1),
+        "p50_us": round(ordered[len(ordered) // 2], 1),
+        "p99_us": round(ordered[int(len(ordered) * 0.99)], 1),
+    }
+
+
+async def main(requests: int):
+    results = {}
+    for path, label in (("/mcp/", "json"), ("/mcp/stream", "sse")):
+        for name, factory in (("stacked", stacked_app), ("fused", fused_app)):
+            results[f"{label}.{name}"] = summarize(await drive(factory(), path, requests))
+        stacked, fused = results[f"{label}.stacked"]["mean_us"], results[f"{label}.fused"]["mean_us"]
+        results[f"{label}.speedup"] = round(stacked / fused, 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
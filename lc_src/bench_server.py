@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+"""
+Benchmark: the whole server under concurrent MCP and OAuth load
+Seeds a synthetic context tree in a scratch directory and prebuilds its
+indexes. It then serves clodforest.app in this process (over ASGI, without
+sockets) or as a separate server on a local port. Two scenarios run against it:
+
+- mcp: virtual users, each with its own token and MCP session, make a weighted
+  mix of tool calls
+- oauth: complete DCR flows (discovery, register, authorize, token, refresh)
+
+The results are written as JSON: p50/p99 latency per tool and per OAuth step,
+throughput and server RSS. With --baseline the run is compared with an earlier
+result, and the exit status is 1 on a regression.
+
+    python bench_server.py --files 2000 --users 32 --output result.json
+    python bench_server.py --mode port --workers 4 --baseline result.json
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import platform
+import random
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+RESULT_VERSION = 1
+REDIRECT_URI = "https://bench.invalid/callback"
+MCP_HEADERS = {"Accept": "application/json, text/event-stream", "Content-Type": "application/json"}
+PROTOCOL_VERSION = "2025-03-26"
+DEFAULT_MIX = "read_context=40,search_contexts=20,stat_context=15,list_contexts=10,write_context=10,append_context=5"
+# Relative slowdown of a latency, or drop in throughput, reported as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+# Synthetic context tree
+
+def make_vocabulary(rng: random.Random, size: int = 4000) -> List[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+def seed_contexts(root: Path, files: int, file_kb: float, seed: int) -> Dict[str, Any]:
+    """Write files of markdown-like prose; the same seed always gives the same tree
+
+    Word frequencies follow a rough Zipf curve like real text. Each file also
+    holds a few "needle" words from a small set, which give searches a
+    predictable number of hits.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    needles = [f"needle{index:03d}" for index in range(100)]
+    target = int(file_kb * 1024)
+    paths = []
+    total = 0
+    for index in range(files):
+        rel_path = f"projects/p{index % 50:02d}/notes/n{index:06d}.md"
+        lines = [f"# Note {index}", ""]
+        size = 0
+        while size < target:
+            line = " ".join(rng.choices(vocabulary, weights, k=rng.randint(6, 16)))
+            if rng.random() < 0.05:
+                line += " " + rng.choice(needles)
+            lines.append(line)
+            size += len(line) + 1
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        text = "\n".join(lines) + "\n"
+        path.write_text(text, encoding="utf-8")
+        paths.append(rel_path)
+        total += len(text)
+    return {"paths": paths, "needles": needles, "vocabulary": vocabulary[:200], "bytes": total}
+
+
+def build_indexes(context_dir: Path, cache_dir: Path) -> Dict[str, float]:
+    """Index the tree up front, so the server starts with fresh indexes and no background rebuild"""
+    from context_index import ContextIndex
+
+    timings = {}
+    start = time.perf_counter()
+    index = ContextIndex(context_dir, cache_dir / "context_index.db", scan_workers=1)
+    index.refresh()
+    index.close()
+    timings["search_index_s"] = round(time.perf_counter() - start, 3)
+    try:
+        from context_vectors import VectorIndex, make_embedder
+    except ImportError:  # Without numpy the server has no vector index either
+        return timings
+    start = time.perf_counter()
+    vectors = VectorIndex(context_dir, cache_dir / "vectors", make_embedder(os.getenv("CLODFOREST_EMBED_MODEL")))
+    vectors.refresh()
+    vectors.close()
+    timings["vector_index_s"] = round(time.perf_counter() - start, 3)
+    return timings
+
+
+# Memory
+
+def _proc_status_kb(pid: int, field: str) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _process_tree(pid: int) -> List[int]:
+    pids = [pid]
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as children:
+                for child in children.read().split():
+                    pids.extend(_process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+def rss_mb(pid: int) -> Dict[str, Optional[float]]:
+    """Current and peak resident memory of pid and its children (the workers), from /proc"""
+    current = peak = 0
+    found = False
+    for member in _process_tree(pid):
+        rss = _proc_status_kb(member, "VmRSS")
+        if rss is None:
+            continue
+        found = True
+        current += rss
+        peak += _proc_status_kb(member, "VmHWM") or rss
+    if not found:
+        return {"current": None, "peak": None}
+    return {"current": round(current / 1024, 1), "peak": round(peak / 1024, 1)}
+
+
+# Statistics
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(latencies: List[float], errors: int = 0) -> Dict[str, Any]:
+    """Latencies in seconds -> milliseconds summary"""
+    summary: Dict[str, Any] = {"count": len(latencies), "errors": errors}
+    if latencies:
+        ordered = sorted(latencies)
+        summary.update({
+            "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3),
+        })
+    return summary
+
+
+class Recorder:
+    """Latencies and error counts, keyed by operation"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.samples: Dict[str, str] = {}  # First error message per operation
+
+    def record(self, name: str, elapsed: float, error: Optional[str] = None):
+        self.latencies.setdefault(name, []).append(elapsed)
+        if error is not None:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            self.samples.setdefault(name, error[:300])
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        return {name: summarize(values, self.errors.get(name, 0))
+                for name, values in sorted(self.latencies.items())}
+
+    def combined(self) -> Dict[str, Any]:
+        return summarize([value for values in self.latencies.values() for value in values],
+                         sum(self.errors.values()))
+
+
+# OAuth
+
+def pkce_pair() -> Tuple[str, str]:
+    verifier = secrets.token_urlsafe(48)
+    challenge = base64.urlsafe_b64encode(hashlib.sha256(verifier.encode()).digest()).decode().rstrip("=")
+    return verifier, challenge
+
+
+class StepFailed(Exception):
+    pass
+
+
+async def timed(recorder: Optional[Recorder], name: str, request, expect: Tuple[int, ...]) -> httpx.Response:
+    start = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError as e:
+        if recorder is not None:
+            recorder.record(name, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+        raise StepFailed(name) from e
+    elapsed = time.perf_counter() - start
+    error = None if response.status_code in expect else f"HTTP {response.status_code}: {response.text}"
+    if recorder is not None:
+        recorder.record(name, elapsed, error)
+    if error is not None:
+        raise StepFailed(name)
+    return response
+
+
+async def oauth_flow(client: httpx.AsyncClient, recorder: Optional[Recorder] = None,
+                     scope: str = "mcp:read mcp:write") -> Dict[str, Any]:
+    """One full DCR flow; returns the refreshed token response"""
+    await timed(recorder, "discovery", client.get("/.well-known/oauth-authorization-server"), (200,))
+    response = await timed(recorder, "register", client.post("/register", json={
+        "client_name": "bench", "redirect_uris": [REDIRECT_URI], "scope": scope}), (201,))
+    client_id, client_secret = response.json()["client_id"], response.json()["client_secret"]
+    verifier, challenge = pkce_pair()
+    response = await timed(recorder, "authorize", client.get("/oauth/authorize", params={
+        "response_type": "code", "client_id": client_id, "redirect_uri": REDIRECT_URI, "state": "bench",
+        "scope": scope, "code_challenge": challenge, "code_challenge_method": "S256"}), (302, 307))
+    code = parse_qs(urlparse(response.headers["location"]).query)["code"][0]
+    response = await timed(recorder, "token", client.post("/oauth/token", data={
+        "grant_type": "authorization_code", "code": code, "redirect_uri": REDIRECT_URI,
+        "client_id": client_id, "client_secret": client_secret, "code_verifier": verifier}), (200,))
+    response = await timed(recorder, "refresh", client.post("/oauth/token", data={
+        "grant_type": "refresh_token", "refresh_token": response.json()["refresh_token"],
+        "client_id": client_id, "client_secret": client_secret}), (200,))
+    return response.json()
+
+
+async def run_oauth(client: httpx.AsyncClient, flows: int, concurrency: int) -> Dict[str, Any]:
+    recorder = Recorder()
+    flow_times: List[float] = []
+    failed = 0
+    pending = iter(range(flows))
+
+    async def worker():
+        nonlocal failed
+        for _ in pending:
+            start = time.perf_counter()
+            try:
+                await oauth_flow(client, recorder)
+            except StepFailed:
+                failed += 1
+                continue
+            flow_times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "flows": flows,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "flows_per_s": round(len(flow_times) / elapsed, 2) if elapsed else None,
+        "flow": summarize(flow_times, failed),
+        "steps": recorder.summary(),
+        "error_samples": recorder.samples,
+    }
+
+
+# MCP
+
+def parse_rpc(response: httpx.Response) -> Dict[str, Any]:
+    """The JSON-RPC reply, sent either as JSON or as one SSE event"""
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        for line in response.text.splitlines():
+            if line.startswith("data:"):
+                message = json.loads(line[5:])
+                if "id" in message:
+                    return message
+        raise ValueError("no JSON-RPC reply in event stream")
+    return response.json()
+
+
+class McpSession:
+    def __init__(self, client: httpx.AsyncClient, access_token: str):
+        self.client = client
+        self.headers = {**MCP_HEADERS, "Authorization": f"Bearer {access_token}"}
+        self.next_id = 0
+
+    async def _post(self, payload: Dict[str, Any]) -> httpx.Response:
+        response = await self.client.post("/mcp/", headers=self.headers, json=payload)
+        if response.status_code >= 400:
+            raise StepFailed(f"HTTP {response.status_code}: {response.text}")
+        return response
+
+    async def initialize(self):
+        self.next_id += 1
+        response = await self._post({"jsonrpc": "2.0", "id": self.next_id, "method": "initialize", "params": {
+            "protocolVersion": PROTOCOL_VERSION, "capabilities": {},
+            "clientInfo": {"name": "bench_server", "version": "1"}}})
+        session_id = response.headers.get("mcp-session-id")
+        if session_id:
+            self.headers["mcp-session-id"] = session_id
+        parse_rpc(response)
+        await self._post({"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+    async def call(self, tool: str, arguments: Dict[str, Any]) -> Optional[str]:
+        """Call a tool; returns None on success, else what went wrong"""
+        self.next_id += 1
+        try:
+            reply = parse_rpc(await self._post({"jsonrpc": "2.0", "id": self.next_id, "method": "tools/call",
+                                                "params": {"name": tool, "arguments": arguments}}))
+        except (StepFailed, httpx.HTTPError, ValueError) as e:
+            return str(e) or type(e).__name__
+        if "error" in reply:
+            return json.dumps(reply["error"])
+        if reply.get("result", {}).get("isError"):
+            return json.dumps(reply["result"].get("content"))
+        return None
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse e.g. "read_context=40,search_contexts=20" into {tool: weight}"""
+    mix = {}
+    for setting in filter(None, spec.split(",")):
+        tool, _, weight = setting.partition("=")
+        mix[tool.strip()] = float(weight or 1)
+    return mix
+
+
+class ToolArguments:
+    """Deterministic arguments for each tool, drawn from the seeded tree"""
+
+    def __init__(self, corpus: Dict[str, Any], user: int, seed: int, write_kb: float):
+        self.rng = random.Random(seed * 1000003 + user)
+        self.corpus = corpus
+        self.user = user
+        self.write_bytes = int(write_kb * 1024)
+        self.writes = 0
+
+    def _text(self, size: int) -> str:
+        words = self.corpus["vocabulary"]
+        parts, length = [], 0
+        while length < size:
+            word = self.rng.choice(words)
+            parts.append(word)
+            length += len(word) + 1
+        return " ".join(parts) + "\n"
+
+    def __call__(self, tool: str) -> Dict[str, Any]:
+        rng = self.rng
+        if tool == "read_context":
+            return {"file_path": rng.choice(self.corpus["paths"])}
+        if tool == "stat_context":
+            return {"file_path": rng.choice(self.corpus["paths"])}
+        if tool == "read_contexts":
+            return {"file_paths": rng.sample(self.corpus["paths"], min(10, len(self.corpus["paths"])))}
+        if tool == "list_contexts":
+            return {"prefix": f"projects/p{rng.randrange(50):02d}"}
+        if tool == "search_contexts":
+            query = rng.choice(self.corpus["needles"] if rng.random() < 0.5 else self.corpus["vocabulary"])
+            return {"query": query, "mode": "word" if rng.random() < 0.3 else "substring"}
+        if tool == "semantic_search_contexts":
+            return {"query": " ".join(rng.sample(self.corpus["vocabulary"], 5))}
+        if tool == "write_context":
+            self.writes += 1
+            return {"file_path": f"bench/u{self.user:03d}/w{self.writes % 50:03d}.md",
+                    "content": self._text(self.write_bytes)}
+        if tool == "append_context":
+            return {"file_path": f"bench/u{self.user:03d}/log.md", "content": self._text(256)}
+        if tool == "hello":
+            return {"name": "bench"}
+        raise ValueError(f"No arguments defined for tool {tool}")
+
+
+async def run_mcp(connect: Callable[[int], httpx.AsyncClient], corpus: Dict[str, Any], users: int,
+                  calls: int, mix: Dict[str, float], seed: int, write_kb: float, warmup: int) -> Dict[str, Any]:
+    # Each user keeps one connection, as MCP clients do: a session exists only
+    # in the worker that created it. Sessions are set up before the clock
+    # starts, so only tool calls are measured
+    clients = [connect(1) for _ in range(users)]
+    sessions = []
+    for user, client in enumerate(clients):
+        token = await oauth_flow(client)
+        session = McpSession(client, token["access_token"])
+        await session.initialize()
+        sessions.append((session, ToolArguments(corpus, user, seed, write_kb),
+                         random.Random(seed * 7919 + user)))
+    tools, weights = list(mix), list(mix.values())
+
+    for session, arguments, _ in sessions[:1]:
+        for tool in tools:
+            for _ in range(warmup):
+                await session.call(tool, arguments(tool))
+
+    recorder = Recorder()
+
+    async def user_loop(session: McpSession, arguments: ToolArguments, rng: random.Random):
+        for _ in range(calls):
+            tool = rng.choices(tools, weights)[0]
+            call_arguments = arguments(tool)
+            start = time.perf_counter()
+            error = await session.call(tool, call_arguments)
+            recorder.record(tool, time.perf_counter() - start, error)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user_loop(*session) for session in sessions))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.aclose()
+    total = users * calls
+    return {
+        "users": users,
+        "calls_per_user": calls,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "all": recorder.combined(),
+        "tools": recorder.summary(),
+        "error_samples": recorder.samples,
+    }
+
+
+# Serving
+
+def scratch_environment(workdir: Path, token_format: str) -> Dict[str, str]:
+    """Settings that keep the server's state, logs and caches inside workdir"""
+    return {
+        "CLODFOREST_CONTEXT_DIR": str(workdir / "contexts"),
+        "CLODFOREST_CACHE_DIR": str(workdir / "cache"),
+        "CLODFOREST_LOG_DIR": str(workdir / "logs"),
+        "CLODFOREST_OAUTH_STORE": os.getenv("CLODFOREST_OAUTH_STORE", f"sqlite://{workdir / 'oauth2'}"),
+        "CLODFOREST_TOKEN_FORMAT": token_format,
+        "CLODFOREST_TOKEN_SECRET": "bench-secret-" + "x" * 32,
+        "CLODFOREST_BASE_URL": "http://bench.invalid",
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_healthy(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            if (await client.get("/api/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"server not healthy after {timeout}s")
+
+
+async def run_scenarios(connect: Callable[[int], httpx.AsyncClient], args, corpus: Dict[str, Any],
+                        server_pid: int) -> Dict[str, Any]:
+    """connect(connections) returns a client holding at most that many connections to the server"""
+    results: Dict[str, Any] = {"rss_mb": {"start": rss_mb(server_pid)["current"]}}
+    if args.users and args.calls:
+        results["mcp"] = await run_mcp(connect, corpus, args.users, args.calls, parse_mix(args.mix),
+                                       args.seed, args.write_kb, args.warmup)
+        results["rss_mb"]["after_mcp"] = rss_mb(server_pid)["current"]
+    if args.oauth_flows:
+        async with connect(args.oauth_concurrency) as client:
+            results["oauth"] = await run_oauth(client, args.oauth_flows, args.oauth_concurrency)
+        results["rss_mb"]["after_oauth"] = rss_mb(server_pid)["current"]
+    results["rss_mb"]["peak"] = rss_mb(server_pid)["peak"]
+    return results
+
+
+async def bench_in_process(args, corpus: Dict[str, Any]) -> Dict[str, Any]:
+    """Serve clodforest.app over ASGI; the server's RSS here includes the load generator"""
+    import clodforest
+
+    transport = httpx.ASGITransport(app=clodforest.app)
+
+    def connect(connections: int) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=transport, base_url="http://bench.invalid", timeout=args.timeout)
+
+    async with clodforest.app.router.lifespan_context(clodforest.app):
+        return await run_scenarios(connect, args, corpus, os.getpid())
+
+
+async def bench_on_port(args, corpus: Dict[str, Any], environment: Dict[str, str]) -> Dict[str, Any]:
+    """Start `python clodforest.py` on a local port and drive it over real sockets"""
+    port = args.port or free_port()
+    server_environment = {**os.environ, **environment, "CLODFOREST_HOST": "127.0.0.1",
+                          "CLODFOREST_PORT": str(port), "CLODFOREST_WORKERS": str(args.workers)}
+    log_path = Path(environment["CLODFOREST_LOG_DIR"]) / "server.out"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "wb") as output:
+        process = subprocess.Popen([sys.executable, str(Path(__file__).parent / "clodforest.py")],
+                                   cwd=Path(__file__).parent, env=server_environment,
+                                   stdout=output, stderr=subprocess.STDOUT)
+
+    def connect(connections: int) -> httpx.AsyncClient:
+        return httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout,
+                                 limits=httpx.Limits(max_connections=connections))
+
+    try:
+        async with connect(1) as client:
+            await wait_until_healthy(client, process, args.startup_timeout)
+        return await run_scenarios(connect, args, corpus, process.pid)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+# Comparison
+
+def comparable_metrics(result: Dict[str, Any]) -> Dict[str, Tuple[float, bool]]:
+    """Flattened name -> (value, higher_is_better) for everything worth comparing"""
+    values: Dict[str, Tuple[float, bool]] = {}
+    mcp = result.get("mcp")
+    if mcp:
+        values["mcp.throughput_rps"] = (mcp["throughput_rps"], True)
+        for tool, summary in mcp["tools"].items():
+            for key in ("p50_ms", "p99_ms"):
+                if key in summary:
+                    values[f"mcp.tools.{tool}.{key}"] = (summary[key], False)
+    oauth = result.get("oauth")
+    if oauth:
+        values["oauth.flows_per_s"] = (oauth["flows_per_s"], True)
+        for step, summary in oauth["steps"].items():
+            for key in ("p50_ms", "p99_ms"):
+                if key in summary:
+                    values[f"oauth.steps.{step}.{key}"] = (summary[key], False)
+    peak = result.get("rss_mb", {}).get("peak")
+    if peak:
+        values["rss_mb.peak"] = (peak, False)
+    return values
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Metrics that got worse than the baseline by more than tolerance"""
+    regressions = []
+    before = comparable_metrics(baseline)
+    for name, (value, higher_is_better) in comparable_metrics(current).items():
+        if name not in before or not before[name][0] or value is None:
+            continue
+        old = before[name][0]
+        change = (value - old) / old
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append({"metric": name, "baseline": old, "current": value,
+                                "change": round(change, 3)})
+    return regressions
+
+
+def error_count(result: Dict[str, Any]) -> int:
+    count = 0
+    if "mcp" in result:
+        count += result["mcp"]["all"]["errors"]
+    if "oauth" in result:
+        count += result["oauth"]["flow"]["errors"]
+    return count
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--mode", choices=("inprocess", "port"), default="inprocess")
+    parser.add_argument("--port", type=int, default=0, help="port mode: port to serve on (default: any free one)")
+    parser.add_argument("--workers", type=int, default=1, help="port mode: CLODFOREST_WORKERS")
+    parser.add_argument("--files", type=int, default=500, help="context files to seed")
+    parser.add_argument("--file-kb", type=float, default=8, help="approximate size of each seeded file")
+    parser.add_argument("--users", type=int, default=16, help="concurrent MCP sessions")
+    parser.add_argument("--calls", type=int, default=100, help="tool calls per MCP session")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted tool mix, tool=weight,...")
+    parser.add_argument("--write-kb", type=float, default=4, help="size of write_context payloads")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed calls per tool before measuring")
+    parser.add_argument("--oauth-flows", type=int, default=100, help="complete DCR flows to run")
+    parser.add_argument("--oauth-concurrency", type=int, default=8)
+    parser.add_argument("--token-format", choices=("opaque", "jwt"), default="opaque")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--workdir", help="scratch directory to use and keep (default: a temporary one)")
+    parser.add_argument("--output", help="write the JSON result here as well as to stdout")
+    parser.add_argument("--baseline", help="earlier result to compare with; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    temporary = None
+    if args.workdir:
+        workdir = Path(args.workdir)
+    else:
+        temporary = tempfile.TemporaryDirectory(prefix="clodforest-bench-")
+        workdir = Path(temporary.name)
+    environment = scratch_environment(workdir, args.token_format)
+    # Set before clodforest is imported, which reads its configuration once
+    os.environ.update(environment)
+
+    try:
+        start = time.perf_counter()
+        corpus = seed_contexts(workdir / "contexts", args.files, args.file_kb, args.seed)
+        setup = {"seed_s": round(time.perf_counter() - start, 3), "bytes": corpus["bytes"]}
+        setup.update(build_indexes(workdir / "contexts", workdir / "cache"))
+
+        if args.mode == "inprocess":
+            results = asyncio.run(bench_in_process(args, corpus))
+        else:
+            results = asyncio.run(bench_on_port(args, corpus, environment))
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    config = {key: value for key, value in vars(args).items()
+              if key not in ("output", "baseline", "workdir", "timeout", "startup_timeout")}
+    result = {
+        "version": RESULT_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": config,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "setup": setup,
+        **results,
+    }
+
+    status = 0
+    if error_count(result):
+        status = 1
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("config") != config:
+            result["baseline_warning"] = "baseline was run with a different configuration"
+        result["regressions"] = compare(baseline, result, args.tolerance)
+        if result["regressions"]:
+            status = 1
+
+    rendered = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(rendered + "\n", encoding="utf-8")
+    print(rendered)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,15 +6,21 @@ Single-port solution: MCP + OAuth2 Dynamic Client Registration
 
 import sys
 import os
+import asyncio
+import functools
 import secrets
 import time
 import hashlib
 import base64
+import re
 import logging
 import json
-from datetime import datetime
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Set
 
 # Check Python version
 if sys.version_info < (3, 9):
@@ -22,12 +28,31 @@ if sys.version_info < (3, 9):
     sys.exit(1)
 
 from fastapi import FastAPI, HTTPException, Request, status
-from fastapi.responses import JSONResponse, RedirectResponse
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from pydantic import BaseModel
 import uvicorn
 
 from fastmcp import FastMCP
+from fastmcp.exceptions import ToolError
+from fastmcp.server.dependencies import get_http_request
+
+from context_cache import ContentCache, ListingCache
+from context_index import DEFAULT_SCAN_WORKERS, SEARCH_MODES, ContextIndex
+from context_io import (ContextWriter, PatchError, PreconditionFailed, current_etag,
+                        read_lines, read_window)
+from context_watcher import ContextWatcher
+from http_gateway import BEARER, PUBLIC, SCOPED, CorsPolicy, GatewayMiddleware, RequestInfo, RoutePolicy, RouteTable
+from log_pipeline import LogPipeline, LogSampler, lazy, parse_sample_rates, resolve_fields
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry, publish_snapshot, read_snapshots
+from oauth_store import CLIENTS, CODES, GRANTS, REFRESH_TOKENS, TOKENS, open_store
+from oauth_tokens import (ALL_SCOPE_BITS, RevocationList, TokenSigner, load_secret, looks_like_jwt,
+                          known_scope, normalize_scope, scope_bits)
+from server_workers import LeaderLock, serve, worker_id
+
+try:
+    from context_vectors import VectorIndex, make_embedder
+except ImportError:  # numpy missing; semantic_search_contexts reports itself unavailable
+    VectorIndex = None
 
 # Environment configuration
 def get_config():
@@ -37,10 +62,11 @@ def get_config():
         "issuer": base_url,
         "authorization_endpoint": f"{base_url}/oauth/authorize",
         "token_endpoint": f"{base_url}/oauth/token",
+        "revocation_endpoint": f"{base_url}/oauth/revoke",
         "registration_endpoint": f"{base_url}/register",
         "scopes_supported": ["mcp:read", "mcp:write"],
         "response_types_supported": ["code"],
-        "grant_types_supported": ["authorization_code"],
+        "grant_types_supported": ["authorization_code", "refresh_token"],
         "token_endpoint_auth_methods_supported": ["client_secret_basic", "client_secret_post"],
         "code_challenge_methods_supported": ["S256"],
     }
@@ -82,51 +108,45 @@ class TokenRequest(BaseModel):
     client_id: Optional[str] = None
     client_secret: Optional[str] = None
     code_verifier: Optional[str] = None
+    refresh_token: Optional[str] = None
+    scope: Optional[str] = None
 
-# Initialize MCP server and locate ClodForest state
+# Initialize MCP server and locate ClodForest state. CLODFOREST_CONTEXT_DIR,
+# CLODFOREST_CACHE_DIR and CLODFOREST_LOG_DIR move the directories kept
+# beside the repository (benchmarks point them at scratch space)
 mcp = FastMCP("ClodForest")
-CONTEXT_DIR = Path(__file__).parent.parent / "state" / "contexts"
+CONTEXT_DIR = Path(os.getenv("CLODFOREST_CONTEXT_DIR", Path(__file__).parent.parent / "state" / "contexts"))
 OAUTH_CONFIG = get_config()
 DEBUG_MODE = os.getenv("CLODFOREST_DEBUG", "false").lower() == "true"
 
 # Configure structured logging
-log_dir = Path(__file__).parent.parent / "logs"
-log_dir.mkdir(exist_ok=True)
-
-class JSONFormatter(logging.Formatter):
-    def format(self, record):
-        log_entry = {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "level": record.levelname,
-            "logger": record.name,
-            "message": record.getMessage(),
-            "module": record.module,
-            "function": record.funcName,
-            "line": record.lineno
-        }
-        
-        # Add extra fields if present
-        if hasattr(record, 'extra_fields'):
-            log_entry.update(record.extra_fields)
-            
-        return json.dumps(log_entry)
+log_dir = Path(os.getenv("CLODFOREST_LOG_DIR", Path(__file__).parent.parent / "logs"))
+log_dir.mkdir(parents=True, exist_ok=True)
+
+# Log calls only enqueue; a writer thread batches JSON lines into the files and
+# rotates each at CLODFOREST_LOG_MAX_BYTES, keeping CLODFOREST_LOG_BACKUPS old ones
+log_pipeline = LogPipeline(
+    max_bytes=int(os.getenv("CLODFOREST_LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+    backups=int(os.getenv("CLODFOREST_LOG_BACKUPS", "5")),
+    queue_size=int(os.getenv("CLODFOREST_LOG_QUEUE_SIZE", "10000")),
+)
+atexit.register(log_pipeline.close)
 
-# Setup multiple loggers
+# Setup multiple loggers; CLODFOREST_LOG_LEVEL=WARNING silences every INFO event
 loggers = {}
+LOG_LEVEL = os.getenv("CLODFOREST_LOG_LEVEL", "INFO").upper()
 
 def setup_logger(name: str, filename: str) -> logging.Logger:
     """Setup a JSON logger for specific log types"""
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(LOG_LEVEL)
     
     # Remove existing handlers
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
     
-    # File handler with JSON formatter
-    file_handler = logging.FileHandler(log_dir / filename)
-    file_handler.setFormatter(JSONFormatter())
-    logger.addHandler(file_handler)
+    # Queued JSON file handler
+    logger.addHandler(log_pipeline.handler(log_dir / filename))
     
     # Console handler for development
     if DEBUG_MODE:
@@ -146,73 +166,359 @@ loggers['mcp'] = setup_logger('clodforest.mcp', 'mcp.log')
 loggers['error'] = setup_logger('clodforest.error', 'error.log')
 loggers['app'] = setup_logger('clodforest.app', 'app.log')
 
-def log_access(request: Any, response_code: int, **extra):
-    """Log access requests in structured format"""
-    loggers['access'].info("HTTP request", extra={
-        'extra_fields': {
-            'method': request.method,
-            'path': str(request.url.path),
-            'query': str(request.url.query) if request.url.query else None,
-            'status_code': response_code,
-            'client_ip': request.client.host if hasattr(request, 'client') else None,
-            'user_agent': request.headers.get('user-agent'),
-            **extra
-        }
+# Per-event sampling, e.g. CLODFOREST_LOG_SAMPLE="authentication_success=0.01,http_request=0.1".
+# Events default to CLODFOREST_LOG_SAMPLE_DEFAULT (1, every occurrence); sampled
+# records carry their sample_rate. Fields wrapped in lazy(...) are only computed
+# for records that are written, so a disabled event costs one dict lookup
+log_sampler = LogSampler(parse_sample_rates(os.getenv("CLODFOREST_LOG_SAMPLE", "")),
+                         default=float(os.getenv("CLODFOREST_LOG_SAMPLE_DEFAULT", "1")))
+
+def emit_log(logger: logging.Logger, level: int, event: str, message: str, fields: Dict[str, Any]):
+    """Write one structured record if its level is enabled and the event is sampled"""
+    if not logger.isEnabledFor(level):
+        return
+    rate = log_sampler.sample(event)
+    if rate is None:
+        return
+    fields = resolve_fields(fields)
+    if rate < 1.0:
+        fields['sample_rate'] = rate
+    # stacklevel=3 skips this function and the log_* helper, so records name their caller
+    logger.log(level, message, extra={'extra_fields': fields}, stacklevel=3)
+
+def log_access(scope: Dict[str, Any], response_code: int, user_agent: Optional[str] = None, **extra):
+    """Log access requests in structured format, from the ASGI scope"""
+    emit_log(loggers['access'], logging.INFO, "http_request", "HTTP request", {
+        'method': scope['method'],
+        'path': scope['path'],
+        'query': lazy(lambda: scope['query_string'].decode('latin-1') or None),
+        'status_code': response_code,
+        'client_ip': lazy(lambda: scope['client'][0] if scope.get('client') else None),
+        'user_agent': user_agent,
+        **extra
     })
 
 def log_oauth(event: str, **data):
     """Log OAuth-specific events"""
-    loggers['oauth'].info(event, extra={
-        'extra_fields': {
-            'event': event,
-            **data
-        }
-    })
+    emit_log(loggers['oauth'], logging.INFO, event, event, {'event': event, **data})
 
 def log_mcp(event: str, **data):
     """Log MCP-specific events"""
-    loggers['mcp'].info(event, extra={
-        'extra_fields': {
-            'event': event,
-            **data
-        }
-    })
+    emit_log(loggers['mcp'], logging.INFO, event, event, {'event': event, **data})
 
 def log_error(error: str, **data):
     """Log errors with context"""
-    loggers['error'].error(error, extra={
-        'extra_fields': {
-            'error': error,
-            **data
-        }
-    })
+    emit_log(loggers['error'], logging.ERROR, error, error, {'error': error, **data})
 
 def log_app(message: str, **data):
     """Log general application events"""
-    loggers['app'].info(message, extra={
-        'extra_fields': {
-            **data
-        }
-    })
+    emit_log(loggers['app'], logging.INFO, message, message, data)
+
+# Search index over CONTEXT_DIR, persisted between restarts
+cache_dir = Path(os.getenv("CLODFOREST_CACHE_DIR", Path(__file__).parent.parent / "cache"))
+context_index = ContextIndex(
+    CONTEXT_DIR,
+    cache_dir / "context_index.db",
+    max_age=float(os.getenv("CLODFOREST_INDEX_MAX_AGE", "300")),
+    max_scan_bytes=int(os.getenv("CLODFOREST_SEARCH_MAX_FILE_BYTES", str(64 * 1024 * 1024))),
+    scan_workers=int(os.getenv("CLODFOREST_SCAN_WORKERS", str(DEFAULT_SCAN_WORKERS))),
+)
+
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 200
+
+# Watch CONTEXT_DIR so edits made outside this process reach the caches
+context_watcher = ContextWatcher(
+    CONTEXT_DIR,
+    backend=os.getenv("CLODFOREST_WATCH", "auto"),  # auto, inotify, poll or off
+    debounce=float(os.getenv("CLODFOREST_WATCH_DEBOUNCE", "0.5")),
+)
+context_index.follow(context_watcher)
+
+# Chunk embeddings behind semantic_search_contexts, computed locally on CPU.
+# CLODFOREST_EMBED_MODEL may name a local sentence-transformers model directory;
+# otherwise a feature-hashing embedder that needs no model files is used
+vector_index = None
+if VectorIndex is not None:
+    vector_index = VectorIndex(
+        CONTEXT_DIR,
+        cache_dir / "vectors",
+        make_embedder(os.getenv("CLODFOREST_EMBED_MODEL")),
+    )
+    vector_index.follow(context_watcher)
+
+# Under the multi-worker supervisor one worker at a time maintains the search
+# indexes from its watcher; the others read them and take over if it exits
+index_leader = None
+if worker_id() is not None:
+    index_leader = LeaderLock(cache_dir / "index.lock")
+    context_index.follow_leader(index_leader)
+    if vector_index is not None:
+        vector_index.follow_leader(index_leader)
+
+SEMANTIC_LIMIT = 10
+SEMANTIC_MAX_LIMIT = 100
+
+# Directory tree cache behind list_contexts
+listing_cache = ListingCache(CONTEXT_DIR)
+listing_cache.follow(context_watcher)
+LIST_PAGE_SIZE = 500
+LIST_MAX_PAGE_SIZE = 5000
+
+# Byte-bounded LRU of decoded files behind read_context
+content_cache = ContentCache(
+    CONTEXT_DIR,
+    max_bytes=int(os.getenv("CLODFOREST_READ_CACHE_BYTES", str(64 * 1024 * 1024))),
+    max_entry_bytes=int(os.getenv("CLODFOREST_READ_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024))),
+)
+content_cache.follow(context_watcher)
+
+# Larger files are only ever served a window at a time
+READ_MAX_BYTES = int(os.getenv("CLODFOREST_READ_MAX_BYTES", str(8 * 1024 * 1024)))
+READ_CHUNK_BYTES = int(os.getenv("CLODFOREST_READ_CHUNK_BYTES", str(1024 * 1024)))
+
+# Atomic writes; durability is none, fdatasync or dirsync
+context_writer = ContextWriter(
+    durability=os.getenv("CLODFOREST_WRITE_DURABILITY", "none"),
+    coalesce_window=float(os.getenv("CLODFOREST_WRITE_COALESCE_MS", "0")) / 1000,
+)
+
+# Blocking filesystem work runs here, never on the event loop, so a slow
+# search cannot stall OAuth exchanges or health checks
+io_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CLODFOREST_IO_WORKERS", "8")),
+    thread_name_prefix="context-io",
+)
+# Items of batch tools fan out here; separate so a batch running on
+# io_executor never waits on its own pool
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CLODFOREST_BATCH_WORKERS", "8")),
+    thread_name_prefix="context-batch",
+)
+BATCH_MAX_ITEMS = int(os.getenv("CLODFOREST_BATCH_MAX_ITEMS", "100"))
+# OAuth store calls (a Redis round trip, or a wait on a SQLite lock held by
+# another worker) run here; separate from io_executor so tool I/O can't
+# queue ahead of token checks
+oauth_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CLODFOREST_OAUTH_WORKERS", "4")),
+    thread_name_prefix="oauth-store",
+)
+
+async def run_oauth(fn, *args):
+    """Run blocking OAuth store work on oauth_executor instead of the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(oauth_executor, functools.partial(fn, *args))
+
+# In-process metrics served at /metrics in the Prometheus text format. Under
+# the multi-worker supervisor samples carry a worker label, and each worker
+# publishes a snapshot to cache/metrics so whichever one is scraped reports all.
+# Off by default; when on, a scrape needs a bearer token: any valid OAuth token,
+# or CLODFOREST_METRICS_TOKEN, a fixed secret for Prometheus that works on
+# /metrics only
+METRICS_ENABLED = os.getenv("CLODFOREST_METRICS", "false").lower() == "true"
+METRICS_TOKEN = os.getenv("CLODFOREST_METRICS_TOKEN", "")
+METRICS_PUBLISH_INTERVAL = float(os.getenv("CLODFOREST_METRICS_PUBLISH_INTERVAL", "5"))
+EVENT_LOOP_LAG_INTERVAL = 0.5
+metrics_dir = cache_dir / "metrics"
+metrics = Registry({"worker": str(worker_id())} if worker_id() is not None else None)
+tool_duration = metrics.histogram(
+    "clodforest_tool_duration_seconds",
+    "MCP tool call latency, including time waiting for a concurrency slot", ["tool"])
+tool_errors = metrics.counter("clodforest_tool_errors_total", "MCP tool calls that raised", ["tool"])
+oauth_duration = metrics.histogram(
+    "clodforest_oauth_request_duration_seconds", "OAuth endpoint latency", ["endpoint", "status"])
+event_loop_lag = metrics.histogram(
+    "clodforest_event_loop_lag_seconds", "How late the event loop ran a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+event_loop_lag_last = metrics.gauge("clodforest_event_loop_lag_last_seconds", "Most recent event loop lag")
+metrics.callback(
+    "clodforest_oauth_store_records", "Live records in the OAuth store",
+    lambda: {kind: oauth_store.count(kind) for kind in (CLIENTS, CODES, TOKENS, REFRESH_TOKENS, GRANTS)},
+    ["kind"], shared=True)
+metrics.callback("clodforest_read_cache_hits_total", "read_context cache hits",
+                 lambda: content_cache.hits, kind="counter")
+metrics.callback("clodforest_read_cache_misses_total", "read_context cache misses",
+                 lambda: content_cache.misses, kind="counter")
+metrics.callback("clodforest_read_cache_evictions_total", "read_context cache evictions",
+                 lambda: content_cache.evictions, kind="counter")
+metrics.callback("clodforest_read_cache_hit_ratio", "read_context cache hits per lookup",
+                 lambda: content_cache.stats()["hit_rate"])
+metrics.callback("clodforest_read_cache_bytes", "Bytes held by the read_context cache",
+                 lambda: content_cache.stats()["bytes"])
+
+# How many calls of each tool may run at once; the rest wait without holding
+# an executor thread. Override with e.g. CLODFOREST_TOOL_CONCURRENCY="search_contexts=1"
+TOOL_CONCURRENCY_DEFAULT = int(os.getenv("CLODFOREST_TOOL_CONCURRENCY_DEFAULT", "8"))
+TOOL_CONCURRENCY = {"search_contexts": 2, "semantic_search_contexts": 2, "read_contexts": 4,
+                    "write_contexts": 2}
+for setting in filter(None, os.getenv("CLODFOREST_TOOL_CONCURRENCY", "").split(",")):
+    tool_name, _, limit = setting.partition("=")
+    TOOL_CONCURRENCY[tool_name.strip()] = int(limit)
+
+# Scope a token needs to call each tool; tools not listed need mcp:read
+TOOL_SCOPES = {
+    "write_context": "mcp:write",
+    "write_contexts": "mcp:write",
+    "append_context": "mcp:write",
+    "replace_context_lines": "mcp:write",
+    "patch_context": "mcp:write",
+}
+
+# Created lazily so they bind to the server's running event loop
+tool_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+def granted_scope_bits() -> int:
+    """Scopes of the token behind the current MCP call, as validated by the gateway"""
+    try:
+        request = get_http_request()
+    except RuntimeError:
+        return ALL_SCOPE_BITS  # stdio: the client is a local process
+    auth = request.scope.get("state", {}).get("auth")
+    return auth["scope_bits"] if auth else 0
+
+def offloaded(fn):
+    """Make a blocking tool body async: it runs on io_executor under its tool's concurrency limit
+
+    Calls are refused unless the caller's token grants the tool's scope.
+    """
+    tool_name = fn.__name__
+    duration = tool_duration.labels(tool_name)
+    required = TOOL_SCOPES.get(tool_name, "mcp:read")
+    required_bits = scope_bits(required)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if required_bits & ~granted_scope_bits():
+            raise ToolError(f"{tool_name} requires the {required} scope")
+        semaphore = tool_semaphores.get(tool_name)
+        if semaphore is None:
+            limit = TOOL_CONCURRENCY.get(tool_name, TOOL_CONCURRENCY_DEFAULT)
+            semaphore = tool_semaphores[tool_name] = asyncio.Semaphore(limit)
+        start = time.perf_counter()
+        try:
+            async with semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(io_executor, functools.partial(fn, *args, **kwargs))
+        except Exception:
+            tool_errors.labels(tool_name).inc()
+            raise
+        finally:
+            duration.observe(time.perf_counter() - start)
+
+    return wrapper
+
+def context_key(file_path: str) -> str:
+    """Normalized path relative to CONTEXT_DIR, as used by the context caches"""
+    return Path(os.path.normpath(file_path)).as_posix()
+
+def resolve_context_path(file_path: str) -> Optional[Path]:
+    """Resolve file_path inside CONTEXT_DIR, or None if it escapes (path traversal)"""
+    target = (CONTEXT_DIR / file_path).resolve()
+    try:
+        target.relative_to(CONTEXT_DIR.resolve())
+    except ValueError:
+        return None
+    return target
+
+def context_changed(file_path: str, target: Path):
+    """Bring the caches up to date after this process modified a context file"""
+    rel_path = target.relative_to(CONTEXT_DIR.resolve()).as_posix()
+    content_cache.discard(context_key(file_path))
+    # The write may also have created directories; their parents need rescanning too
+    parts = rel_path.split("/")
+    listing_cache.invalidate({rel_path} | {"/".join(parts[:depth]) for depth in range(1, len(parts))})
+    schedule_index_update(rel_path)
+
+# Reindexing a written file (tokenizing it, and embedding it with a model) runs
+# on one background thread so write tools don't wait for it. A path written
+# again before its update starts is only reindexed once
+index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-update")
+pending_index_updates: Set[str] = set()
+pending_index_lock = threading.Lock()
+
+def schedule_index_update(rel_path: str):
+    with pending_index_lock:
+        if rel_path in pending_index_updates:
+            return
+        pending_index_updates.add(rel_path)
+    index_executor.submit(update_indexes, rel_path)
+
+def update_indexes(rel_path: str):
+    # Claimed before reading the file, so a write landing during the update schedules another
+    with pending_index_lock:
+        pending_index_updates.discard(rel_path)
+    try:
+        context_index.update_path(rel_path)
+        if vector_index is not None:
+            vector_index.update_path(rel_path)
+    except Exception as e:
+        log_error("index_update_failed", path=rel_path, error_message=str(e))
 
 # Create MCP HTTP app and mount it to FastAPI
 mcp_app = mcp.http_app(path='/')  # MCP endpoint at root of mounted app
-app = FastAPI(title="ClodForest MCP + OAuth2 DCR Server", version="1.0.0", lifespan=mcp_app.lifespan)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background services alongside the MCP session manager"""
+    context_watcher.start()
+    if index_leader is not None:
+        index_leader.start()
+    context_index.start()
+    if vector_index is not None:
+        vector_index.start()
+    background_tasks = [asyncio.create_task(purge_expired_oauth_records())]
+    if token_signer is not None:
+        revocations.sync()
+        background_tasks.append(asyncio.create_task(sync_revocations()))
+    if METRICS_ENABLED:
+        background_tasks.append(asyncio.create_task(monitor_event_loop_lag()))
+        if worker_id() is not None:
+            background_tasks.append(asyncio.create_task(publish_metrics()))
+    async with mcp_app.lifespan(app):
+        yield
+    for task in background_tasks:
+        task.cancel()
+    context_watcher.stop()
+    io_executor.shutdown(wait=True)
+    batch_executor.shutdown(wait=True)
+    oauth_executor.shutdown(wait=True)
+    index_executor.shutdown(wait=True)
+    context_index.close()
+    if vector_index is not None:
+        vector_index.close()
+    oauth_store.close()
+    log_pipeline.flush()
+
+app = FastAPI(title="ClodForest MCP + OAuth2 DCR Server", version="1.0.0", lifespan=lifespan)
 app.mount("/mcp", mcp_app)  # Available at /mcp
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["https://claude.ai", "https://www.claude.ai"],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-)
+# OAuth clients, codes and tokens, persisted so restarts and other workers keep
+# sessions alive. CLODFOREST_OAUTH_STORE is "sqlite" (default), "sqlite:///dir",
+# "redis://host:port/db" (see `python oauth_store.py --serve`) or "memory"
+oauth_data_dir = Path(__file__).parent.parent / "data" / "oauth2"
+oauth_store = open_store(os.getenv("CLODFOREST_OAUTH_STORE", "sqlite"), oauth_data_dir)
+# Bounds on how long the purge task sleeps between runs
+OAUTH_PURGE_INTERVAL = float(os.getenv("CLODFOREST_OAUTH_PURGE_INTERVAL", "60"))
+OAUTH_PURGE_MIN_DELAY = 1.0
+
+# Access token format: "opaque" (default; looked up in oauth_store per request)
+# or "jwt" (HS256-signed, verified locally by any worker holding the key).
+# The key is CLODFOREST_TOKEN_SECRET, else a random one kept in data/oauth2
+TOKEN_FORMAT = os.getenv("CLODFOREST_TOKEN_FORMAT", "opaque")
+token_signer = None
+if TOKEN_FORMAT == "jwt":
+    token_secret = os.getenv("CLODFOREST_TOKEN_SECRET")
+    token_signer = TokenSigner(
+        token_secret.encode("utf-8") if token_secret else load_secret(oauth_data_dir / "token_secret"),
+        OAUTH_CONFIG["issuer"],
+    )
+# Token lifetimes. Refresh tokens are single use: each refresh returns a new
+# one, and presenting a rotated one again revokes the whole grant
+ACCESS_TOKEN_LIFETIME = 3600
+REFRESH_TOKEN_LIFETIME = float(os.getenv("CLODFOREST_REFRESH_TOKEN_LIFETIME", str(30 * 24 * 3600)))
 
-# In-memory storage (replace with persistent storage for production)
-registered_clients: Dict[str, Dict[str, Any]] = {}
-authorization_codes: Dict[str, Dict[str, Any]] = {}
-access_tokens: Dict[str, Dict[str, Any]] = {}
+# Revoked JWT ids; each worker re-reads the shared list this often
+revocations = RevocationList(oauth_store)
+REVOCATION_SYNC_INTERVAL = float(os.getenv("CLODFOREST_REVOCATION_SYNC_INTERVAL", "5"))
 
 # MCP Tools
 @mcp.tool()
@@ -221,79 +527,304 @@ def hello(name: str = "World") -> str:
     return f"Hello {name}! ClodForest MCP server with OAuth2 DCR is running."
 
 @mcp.tool()
-def list_contexts() -> str:
-    """List all context files"""
+@offloaded
+def list_contexts(prefix: str = "", max_depth: Optional[int] = None,
+                  cursor: Optional[str] = None, limit: int = LIST_PAGE_SIZE) -> str:
+    """List context files, optionally under a path prefix, one page at a time
+
+    Pass the cursor from the end of a page to get the next one. max_depth limits
+    how many path components a listed file may have (1 = top-level files only).
+    """
     if not CONTEXT_DIR.exists():
         return f"Context directory not found: {CONTEXT_DIR}"
 
-    files = []
-    for item in CONTEXT_DIR.rglob("*"):
-        if item.is_file():
-            rel_path = item.relative_to(CONTEXT_DIR)
-            files.append(str(rel_path))
+    after = None
+    if cursor:
+        try:
+            after = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        except (ValueError, UnicodeError):
+            return f"Invalid cursor: {cursor}"
+
+    limit = max(1, min(limit, LIST_MAX_PAGE_SIZE))
+    files, last = listing_cache.page(prefix, max_depth, after, limit)
+    if not files:
+        return "No context files found"
+
+    listing = "\n".join(files)
+    if last is not None:
+        next_cursor = base64.urlsafe_b64encode(last.encode('utf-8')).decode('ascii')
+        listing += f"\n[more files available: cursor={next_cursor}]"
+    return listing
+
+@mcp.tool()
+@offloaded
+def read_context(file_path: str, offset: Optional[int] = None, length: Optional[int] = None,
+                 start_line: Optional[int] = None, end_line: Optional[int] = None) -> str:
+    """Read a context file, or a byte or line window of it
 
-    return "\n".join(sorted(files)) if files else "No context files found"
+    Give offset/length for a byte range, or start_line/end_line (1-based,
+    inclusive) for a line range. Windows are capped at READ_CHUNK_BYTES and
+    files over READ_MAX_BYTES are always windowed; a trailing
+    "[more content available: ...]" line gives the arguments that continue.
+    """
+    try:
+        return read_context_file(file_path, offset, length, start_line, end_line)
+    except ContextFileError as e:
+        return str(e)
 
 @mcp.tool()
-def read_context(file_path: str) -> str:
-    """Read a context file"""
+@offloaded
+def read_contexts(file_paths: List[str]) -> Dict[str, Dict[str, str]]:
+    """Read many context files in one call
+
+    Returns {"files": {path: content}, "errors": {path: message}}; every
+    requested path appears in exactly one of the two.
+    """
+    if len(file_paths) > BATCH_MAX_ITEMS:
+        raise ToolError(f"Too many files: {len(file_paths)} (max {BATCH_MAX_ITEMS})")
+    return run_batch(read_context_file, list(dict.fromkeys(file_paths)))
+
+class ContextFileError(Exception):
+    """A per-file failure in the *_context_file helpers; the message is for the client"""
+
+def run_batch(fn, paths: List[str], *args) -> Dict[str, Dict[str, str]]:
+    """Call fn(path, *per-path args) for each path on batch_executor, sorting results from errors"""
+    def settle(*call_args):
+        try:
+            return True, fn(*call_args)
+        except ContextFileError as e:
+            return False, str(e)
+
+    results = {"files": {}, "errors": {}}
+    for path, (ok, result) in zip(paths, batch_executor.map(settle, paths, *args)):
+        results["files" if ok else "errors"][path] = result
+    return results
+
+def read_context_file(file_path: str, offset: Optional[int] = None, length: Optional[int] = None,
+                      start_line: Optional[int] = None, end_line: Optional[int] = None) -> str:
+    """read_context, callable outside tool dispatch (batches, executors); raises ContextFileError"""
+    ranged = any(arg is not None for arg in (offset, length, start_line, end_line))
+
+    # Cached entries were path-checked when stored and are revalidated by stat
+    cache_key = context_key(file_path)
+    if not ranged:
+        cached = content_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     full_path = CONTEXT_DIR / file_path
 
     if not full_path.exists():
-        return f"File not found: {file_path}"
+        raise ContextFileError(f"File not found: {file_path}")
 
     # Path traversal protection
     try:
         full_path.resolve().relative_to(CONTEXT_DIR.resolve())
     except ValueError:
-        return "Invalid path: outside context directory"
+        raise ContextFileError("Invalid path: outside context directory")
 
     try:
-        return full_path.read_text(encoding='utf-8')
-    except (IOError, OSError, UnicodeDecodeError) as e:
-        return f"Error reading file: {str(e)}"
+        st = full_path.stat()
+        if ranged or st.st_size > READ_MAX_BYTES:
+            if start_line is not None or end_line is not None:
+                window = read_lines(full_path, max(start_line or 1, 1), end_line, READ_CHUNK_BYTES)
+            else:
+                window = read_window(full_path, max(offset or 0, 0),
+                                     min(length or READ_CHUNK_BYTES, READ_CHUNK_BYTES))
+            if window.resume:
+                return f"{window.text}\n[more content available: {window.resume}, size={window.size}]"
+            return window.text
+
+        content = full_path.read_text(encoding='utf-8')
+    except (IOError, OSError, UnicodeDecodeError, ValueError) as e:
+        raise ContextFileError(f"Error reading file: {str(e)}")
+
+    content_cache.put(cache_key, content, st)
+    return content
 
 @mcp.tool()
-def search_contexts(query: str) -> str:
-    """Search for text in context files"""
+@offloaded
+def search_contexts(query: str, mode: str = "substring", path_glob: Optional[str] = None,
+                    limit: int = SEARCH_LIMIT) -> str:
+    """Search context files, best matches first, with matching lines
+
+    mode is "substring" (case-insensitive), "word" (whole words) or "regex".
+    path_glob restricts the files searched, e.g. "projects/*.md".
+    """
     if not CONTEXT_DIR.exists():
         return "Context directory not found"
+    if mode not in SEARCH_MODES:
+        return f"Invalid mode: {mode} (expected one of {', '.join(SEARCH_MODES)})"
 
-    results = []
-    for file_path in CONTEXT_DIR.rglob("*"):
-        if not file_path.is_file():
-            continue
+    # The index answers unless it is missing or stale; then it falls back to a full scan
+    try:
+        hits, total = context_index.search(query, mode, path_glob, max(1, min(limit, SEARCH_MAX_LIMIT)))
+    except re.error as e:
+        return f"Invalid regex: {str(e)}"
+    if not hits:
+        return f"No files contain: {query}"
 
-        try:
-            content = file_path.read_text(encoding='utf-8')
-            if query.lower() in content.lower():
-                rel_path = file_path.relative_to(CONTEXT_DIR)
-                results.append(str(rel_path))
-        except (IOError, OSError, UnicodeDecodeError):
-            continue  # Skip unreadable files
+    lines = []
+    for hit in hits:
+        lines.append(f"{hit.path} (score {hit.score:.2f})")
+        lines.extend(f"  {line_no}: {excerpt}" for line_no, excerpt in hit.snippets)
+    if total > len(hits):
+        lines.append(f"[{total} files matched; showing top {len(hits)}]")
+    return "\n".join(lines)
 
-    return "\n".join(sorted(results)) if results else f"No files contain: {query}"
+@mcp.tool()
+@offloaded
+def semantic_search_contexts(query: str, path_glob: Optional[str] = None,
+                             limit: int = SEMANTIC_LIMIT) -> str:
+    """Find passages related to query even where the wording differs
+
+    Returns line ranges, most similar first; fetch one with
+    read_context(file_path, start_line=..., end_line=...).
+    path_glob restricts the files searched, e.g. "projects/*.md".
+    """
+    if vector_index is None:
+        return "Semantic search unavailable: numpy is not installed"
+    if not CONTEXT_DIR.exists():
+        return "Context directory not found"
+
+    hits = vector_index.search(query, path_glob, max(1, min(limit, SEMANTIC_MAX_LIMIT)))
+    lines = []
+    for hit in hits:
+        lines.append(f"{hit.path}:{hit.start_line}-{hit.end_line} (similarity {hit.score:.2f})")
+        lines.append(f"  {hit.preview}")
+    if vector_index.building:
+        lines.append("[embedding index still building; results may be incomplete]")
+    return "\n".join(lines) if lines else f"No passages related to: {query}"
 
 @mcp.tool()
+@offloaded
 def write_context(file_path: str, content: str) -> str:
     """Write content to a context file (for local use)"""
-    full_path = CONTEXT_DIR / file_path
+    try:
+        return write_context_file(file_path, content)
+    except ContextFileError as e:
+        return str(e)
+
+@mcp.tool()
+@offloaded
+def write_contexts(files: Dict[str, str]) -> Dict[str, Dict[str, str]]:
+    """Write many context files in one call; maps each path to its content
+
+    Returns {"files": {path: result message}, "errors": {path: message}};
+    every path appears in exactly one of the two.
+    """
+    if len(files) > BATCH_MAX_ITEMS:
+        raise ToolError(f"Too many files: {len(files)} (max {BATCH_MAX_ITEMS})")
+    return run_batch(write_context_file, list(files), files.values())
+
+def write_context_file(file_path: str, content: str) -> str:
+    """write_context, callable outside tool dispatch (batches, executors); raises ContextFileError"""
+    target = resolve_context_path(file_path)
+    if target is None:
+        raise ContextFileError("Invalid path: outside context directory")
 
-    # Path traversal protection
     try:
-        full_path.resolve().relative_to(CONTEXT_DIR.resolve())
-    except ValueError:
+        target.parent.mkdir(parents=True, exist_ok=True)  # Create parent directories if needed
+        persisted = context_writer.write(target, content.encode('utf-8'))
+    except (IOError, OSError) as e:
+        raise ContextFileError(f"Failed to write file: {str(e)}")
+
+    context_changed(file_path, target)
+    if not persisted:
+        return f"Write to {file_path} superseded by a later write in the same coalescing window"
+    return f"Successfully wrote {len(content)} characters to {file_path}"
+
+@mcp.tool()
+@offloaded
+def stat_context(file_path: str) -> str:
+    """Show a context file's size and etag, for use as if_match in edits"""
+    target = resolve_context_path(file_path)
+    if target is None:
+        return "Invalid path: outside context directory"
+
+    etag = current_etag(target)
+    if etag is None or not target.is_file():
+        return f"File not found: {file_path}"
+    return f"size={target.stat().st_size} etag={etag}"
+
+@mcp.tool()
+@offloaded
+def append_context(file_path: str, content: str, if_match: Optional[str] = None) -> str:
+    """Append content to a context file without rewriting it
+
+    If if_match is given, the append only happens while the file's etag
+    (from stat_context or a previous edit) still matches.
+    """
+    target = resolve_context_path(file_path)
+    if target is None:
         return "Invalid path: outside context directory"
 
-    # Create parent directories if needed
-    full_path.parent.mkdir(parents=True, exist_ok=True)
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        etag = context_writer.append(target, content.encode('utf-8'), if_match)
+    except PreconditionFailed as e:
+        return f"Precondition failed: {e}"
+    except (IOError, OSError) as e:
+        return f"Failed to append to file: {str(e)}"
+
+    context_changed(file_path, target)
+    return f"Appended {len(content)} characters to {file_path} (etag={etag})"
+
+@mcp.tool()
+@offloaded
+def replace_context_lines(file_path: str, start_line: int, end_line: int, content: str,
+                          if_match: Optional[str] = None) -> str:
+    """Replace lines start_line..end_line (1-based, inclusive) of a context file
+
+    Use end_line = start_line - 1 to insert before start_line. If if_match is
+    given, the edit only happens while the file's etag still matches.
+    """
+    target = resolve_context_path(file_path)
+    if target is None:
+        return "Invalid path: outside context directory"
+    if not target.is_file():
+        return f"File not found: {file_path}"
+
+    try:
+        etag = context_writer.replace_lines(target, start_line, end_line,
+                                            content.encode('utf-8'), if_match)
+    except PreconditionFailed as e:
+        return f"Precondition failed: {e}"
+    except PatchError as e:
+        return f"Failed to edit file: {str(e)}"
+    except (IOError, OSError) as e:
+        return f"Failed to write file: {str(e)}"
+
+    context_changed(file_path, target)
+    return f"Replaced lines {start_line}-{end_line} of {file_path} (etag={etag})"
+
+@mcp.tool()
+@offloaded
+def patch_context(file_path: str, diff: str, if_match: Optional[str] = None) -> str:
+    """Apply a unified diff to a context file
+
+    Hunks must apply exactly (no fuzz). If if_match is given, the patch only
+    happens while the file's etag still matches.
+    """
+    target = resolve_context_path(file_path)
+    if target is None:
+        return "Invalid path: outside context directory"
+    if not target.is_file():
+        return f"File not found: {file_path}"
 
     try:
-        full_path.write_text(content, encoding='utf-8')
-        return f"Successfully wrote {len(content)} characters to {file_path}"
+        etag = context_writer.patch(target, diff, if_match)
+    except PreconditionFailed as e:
+        return f"Precondition failed: {e}"
+    except PatchError as e:
+        return f"Failed to apply patch: {str(e)}"
     except (IOError, OSError) as e:
         return f"Failed to write file: {str(e)}"
 
+    context_changed(file_path, target)
+    return f"Patched {file_path} (etag={etag})"
+
 # OAuth2 Helper Functions
 def generate_client_credentials():
     """Generate secure client ID and secret"""
@@ -309,6 +840,10 @@ def generate_access_token():
     """Generate secure access token"""
     return secrets.token_urlsafe(32)
 
+def generate_refresh_token():
+    """Generate secure refresh token"""
+    return secrets.token_urlsafe(48)
+
 def verify_pkce_challenge(code_verifier: str, code_challenge: str, method: str = "S256") -> bool:
     """Verify PKCE code challenge"""
     if method == "S256":
@@ -319,30 +854,140 @@ def verify_pkce_challenge(code_verifier: str, code_challenge: str, method: str =
         return code_verifier == code_challenge
     return False
 
+def jwt_token_data(claims: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "client_id": claims["client_id"],
+        "scope": claims["scope"],
+        "scope_bits": claims.get("scope_bits") or scope_bits(normalize_scope(claims["scope"])),
+        "expires_at": claims["exp"],
+        "jti": claims["jti"],
+    }
+
 def validate_token(token: str) -> Optional[Dict[str, Any]]:
-    """Validate Bearer token and return token data"""
-    if token not in access_tokens:
-        return None
+    """Validate Bearer token and return token data; may query oauth_store"""
+    if token_signer is not None and looks_like_jwt(token):
+        # Signature and expiry are checked locally; only bloom filter hits touch the store
+        claims = token_signer.verify(token)
+        if claims is None or revocations.is_revoked(claims["jti"]):
+            return None
+        return jwt_token_data(claims)
+    # The store never returns expired tokens
+    token_data = oauth_store.tokens.get(token)
+    if token_data is not None and not token_data.get("scope_bits"):
+        # Issued before scopes were bits, or for unknown scopes only
+        token_data["scope_bits"] = scope_bits(normalize_scope(token_data["scope"]))
+    return token_data
 
-    token_data = access_tokens[token]
-    if time.time() > token_data["expires_at"]:
-        del access_tokens[token]
-        return None
+def issue_tokens(client_id: str, scope: str, grant_id: str) -> Dict[str, Any]:
+    """Issue an access and refresh token pair and make it the grant's current one"""
+    scope = normalize_scope(scope)  # Codes and grants from before scopes were checked
+    now = time.time()
+    expires_at = now + ACCESS_TOKEN_LIFETIME
+    jti = None
+    if token_signer is not None:
+        # Self-contained: nothing to store, any worker can verify it
+        jti = secrets.token_urlsafe(12)
+        access_token = token_signer.issue(client_id, scope, expires_at, jti)
+    else:
+        access_token = generate_access_token()
+        oauth_store.tokens.put(access_token, {
+            "client_id": client_id,
+            "scope": scope,
+            "scope_bits": scope_bits(scope),  # Parsed once here, checked on every tool call
+            "expires_at": expires_at,
+        }, expires_at)
+    
+    refresh_token = generate_refresh_token()
+    refresh_expires_at = now + REFRESH_TOKEN_LIFETIME
+    oauth_store.refresh_tokens.put(refresh_token, {
+        "client_id": client_id,
+        "scope": scope,
+        "grant_id": grant_id,
+        "expires_at": refresh_expires_at,
+    }, refresh_expires_at)
+    # The grant remembers the latest pair so reuse of an old refresh token can revoke it
+    oauth_store.grants.put(grant_id, {
+        "client_id": client_id,
+        "refresh_token": refresh_token,
+        "access_token": None if jti else access_token,
+        "jti": jti,
+        "access_expires_at": expires_at,
+    }, refresh_expires_at)
+    
+    return {
+        "access_token": access_token,
+        "token_type": "Bearer",
+        "expires_in": ACCESS_TOKEN_LIFETIME,
+        "refresh_token": refresh_token,
+        "scope": scope
+    }
 
-    return token_data
+def revoke_grant(grant_id: str) -> bool:
+    """Revoke a grant's current refresh and access tokens; False if already gone"""
+    grant = oauth_store.grants.pop(grant_id)
+    if grant is None:
+        return False
+    oauth_store.refresh_tokens.delete(grant["refresh_token"])
+    if grant.get("jti"):
+        revocations.revoke(grant["jti"], grant["access_expires_at"])
+    elif grant.get("access_token"):
+        oauth_store.tokens.delete(grant["access_token"])
+    return True
+
+async def purge_expired_oauth_records():
+    """Background task: delete expired tokens and codes as they fall due
+
+    Sleeps until the store's next expiry, but never longer than
+    OAUTH_PURGE_INTERVAL since other workers may add records expiring sooner.
+    """
+    while True:
+        try:
+            next_expiry = await run_oauth(oauth_store.next_expiry)
+            delay = OAUTH_PURGE_INTERVAL
+            if next_expiry is not None:
+                delay = min(delay, next_expiry - time.time())
+            await asyncio.sleep(max(delay, OAUTH_PURGE_MIN_DELAY))
+            removed = await run_oauth(oauth_store.purge_expired)
+            if removed:
+                live_tokens = await run_oauth(oauth_store.tokens.count)
+                log_oauth("expired_records_purged", removed=removed, live_tokens=live_tokens)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_error("oauth_purge_failed", error_message=str(e))
+            await asyncio.sleep(OAUTH_PURGE_INTERVAL)
+
+async def sync_revocations():
+    """Background task: pick up JWT revocations made by other workers"""
+    while True:
+        await asyncio.sleep(REVOCATION_SYNC_INTERVAL)
+        try:
+            await run_oauth(revocations.sync)
+        except Exception as e:
+            log_error("revocation_sync_failed", error_message=str(e))
 
-def cleanup_expired_tokens():
-    """Clean up expired tokens from memory"""
-    current_time = time.time()
-    expired_tokens = [token for token, data in access_tokens.items()
-                     if current_time > data["expires_at"]]
-    for token in expired_tokens:
-        del access_tokens[token]
+async def monitor_event_loop_lag():
+    """Background task: measure how late the event loop wakes a sleeping task"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - start - EVENT_LOOP_LAG_INTERVAL)
+        event_loop_lag.observe(lag)
+        event_loop_lag_last.set(lag)
 
-    expired_codes = [code for code, data in authorization_codes.items()
-                    if current_time > data["expires_at"]]
-    for code in expired_codes:
-        del authorization_codes[code]
+def metrics_snapshot_path() -> Path:
+    return metrics_dir / f"worker-{worker_id()}.json"
+
+async def publish_metrics():
+    """Background task: share this worker's metrics with the other workers"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(io_executor, publish_snapshot, metrics, metrics_snapshot_path())
+        except Exception as e:
+            log_error("metrics_publish_failed", error_message=str(e))
+        await asyncio.sleep(METRICS_PUBLISH_INTERVAL)
 
 # OAuth2 Discovery Endpoints
 @app.get("/.well-known/oauth-authorization-server")
@@ -373,9 +1018,6 @@ async def register_client(request_data: ClientRegistrationRequest, request: Requ
                client_uri=request_data.client_uri,
                scope=request_data.scope)
     
-    # Clean up expired tokens periodically
-    cleanup_expired_tokens()
-    
     # Generate client credentials
     client_id, client_secret = generate_client_credentials()
     issued_at = int(time.time())
@@ -392,20 +1034,20 @@ async def register_client(request_data: ClientRegistrationRequest, request: Requ
         "client_secret_expires_at": expires_at,
         "client_name": request_data.client_name or "Claude.ai Client",
         "client_uri": request_data.client_uri,
-        "grant_types": ["authorization_code"],
+        "grant_types": ["authorization_code", "refresh_token"],
         "response_types": ["code"],
-        "scope": request_data.scope or "mcp:read mcp:write",
+        "scope": normalize_scope(request_data.scope),
         "token_endpoint_auth_method": "client_secret_basic",
         "redirect_uris": redirect_uris
     }
     
-    registered_clients[client_id] = client_data
+    await run_oauth(oauth_store.clients.put, client_id, client_data, expires_at)
     
     log_oauth("client_registered", 
                client_id=client_id,
                client_name=client_data["client_name"],
                redirect_uris=redirect_uris,
-               total_clients=len(registered_clients))
+               total_clients=await run_oauth(oauth_store.clients.count))
     
     response = ClientRegistrationResponse(**client_data)
     return JSONResponse(response.model_dump(), status_code=201)
@@ -430,37 +1072,15 @@ async def authorize(
                redirect_uri=redirect_uri,
                scope=scope,
                state=state,
-               has_pkce=bool(code_challenge),
-               registered_clients=list(registered_clients.keys()))
-    
-    # Validate client - with auto-registration fallback
-    if client_id not in registered_clients:
-        # Auto-register Claude.ai clients that are missing
-        if client_id.startswith("clodforest_"):
-            log_oauth("auto_registering_client", 
-                       client_id=client_id,
-                       reason="client_missing_from_memory")
-            
-            # Create a default registration for this client
-            client_data = {
-                "client_id": client_id,
-                "client_secret": "auto_generated_secret",  # This won't work for token exchange, forcing re-registration
-                "client_name": "Auto-registered Claude.ai Client",
-                "redirect_uris": ["https://claude.ai/oauth/callback", "https://claude.ai/api/mcp/auth_callback"]
-            }
-            registered_clients[client_id] = client_data
-            
-            log_oauth("client_auto_registered", 
-                       client_id=client_id,
-                       note="temporary_registration_token_exchange_will_fail")
-        else:
-            log_oauth("authorization_failed", 
-                       reason="client_not_found",
-                       client_id=client_id,
-                       available_clients=list(registered_clients.keys()))
-            raise HTTPException(status_code=400, detail="Invalid client_id")
+               has_pkce=bool(code_challenge))
     
-    client = registered_clients[client_id]
+    # Validate client; registrations are persistent, so a missing one is invalid
+    client = await run_oauth(oauth_store.clients.get, client_id)
+    if client is None:
+        log_oauth("authorization_failed", 
+                   reason="client_not_found",
+                   client_id=client_id)
+        raise HTTPException(status_code=400, detail="Invalid client_id")
     
     # Validate response_type
     if response_type != "code":
@@ -484,13 +1104,13 @@ async def authorize(
     code_data = {
         "client_id": client_id,
         "redirect_uri": redirect_uri,
-        "scope": scope or "mcp:read mcp:write",
+        "scope": normalize_scope(scope),
         "expires_at": time.time() + 600,  # 10 minute expiration
         "code_challenge": code_challenge,
         "code_challenge_method": code_challenge_method
     }
     
-    authorization_codes[auth_code] = code_data
+    await run_oauth(oauth_store.codes.put, auth_code, code_data, code_data["expires_at"])
     
     # Redirect back to client with authorization code
     callback_url = redirect_uri or client["redirect_uris"][0]
@@ -503,7 +1123,7 @@ async def authorize(
     log_oauth("authorization_code_generated", 
                client_id=client_id,
                auth_code=auth_code[:10] + "...",
-               redirect_url=final_url,
+               redirect_uri=callback_url,
                expires_in=600)
     
     return RedirectResponse(final_url)
@@ -519,7 +1139,7 @@ async def token_endpoint(request: Request):
     log_oauth("token_request", 
                content_type=request.headers.get("content-type"),
                body_length=len(body),
-               headers=dict(request.headers))
+               user_agent=lazy(lambda: request.headers.get("user-agent")))
     
     # Parse the request
     try:
@@ -534,7 +1154,9 @@ async def token_endpoint(request: Request):
                 redirect_uri=form_data.get('redirect_uri', [''])[0] or None,
                 client_id=form_data.get('client_id', [''])[0] or None,
                 client_secret=form_data.get('client_secret', [''])[0] or None,
-                code_verifier=form_data.get('code_verifier', [''])[0] or None
+                code_verifier=form_data.get('code_verifier', [''])[0] or None,
+                refresh_token=form_data.get('refresh_token', [''])[0] or None,
+                scope=form_data.get('scope', [''])[0] or None
             )
         else:
             # JSON format
@@ -544,7 +1166,7 @@ async def token_endpoint(request: Request):
     except Exception as e:
         log_oauth("token_request_parse_failed", 
                    error=str(e),
-                   body=body.decode('utf-8', errors='ignore')[:200])
+                   body_length=len(body))
         raise HTTPException(status_code=400, detail=f"Invalid request format: {str(e)}")
     
     log_oauth("token_request_parsed", 
@@ -553,30 +1175,28 @@ async def token_endpoint(request: Request):
                has_code=bool(token_request.code),
                has_verifier=bool(token_request.code_verifier))
     
+    if token_request.grant_type == "refresh_token":
+        return await run_oauth(refresh_access_token, token_request)
+    
     if token_request.grant_type != "authorization_code":
         log_oauth("token_request_failed", 
                    reason="unsupported_grant_type",
                    grant_type=token_request.grant_type)
         raise HTTPException(status_code=400, detail="Unsupported grant_type")
     
-    # Validate authorization code
-    if not token_request.code or token_request.code not in authorization_codes:
+    return await run_oauth(redeem_authorization_code, token_request)
+
+def redeem_authorization_code(token_request: TokenRequest) -> JSONResponse:
+    """authorization_code grant: exchange a code for a new grant's tokens"""
+    # Claim the authorization code; taking it out of the store in one step
+    # means it is redeemed at most once, even with several workers
+    code_data = oauth_store.codes.pop(token_request.code) if token_request.code else None
+    if code_data is None:
         log_oauth("token_request_failed", 
                    reason="invalid_authorization_code",
-                   provided_code=token_request.code[:10] + "..." if token_request.code else None,
-                   available_codes=[code[:10] + "..." for code in authorization_codes.keys()])
+                   provided_code=token_request.code[:10] + "..." if token_request.code else None)
         raise HTTPException(status_code=400, detail="Invalid authorization code")
     
-    code_data = authorization_codes[token_request.code]
-    
-    # Check expiration
-    if time.time() > code_data["expires_at"]:
-        log_oauth("token_request_failed", 
-                   reason="authorization_code_expired",
-                   code=token_request.code[:10] + "...")
-        del authorization_codes[token_request.code]
-        raise HTTPException(status_code=400, detail="Authorization code expired")
-    
     # Validate client
     if token_request.client_id != code_data["client_id"]:
         log_oauth("token_request_failed", 
@@ -585,33 +1205,18 @@ async def token_endpoint(request: Request):
                    code_client=code_data["client_id"])
         raise HTTPException(status_code=400, detail="Client mismatch")
     
-    if token_request.client_id not in registered_clients:
+    client = oauth_store.clients.get(token_request.client_id)
+    if client is None:
         log_oauth("token_request_failed", 
                    reason="client_not_registered",
                    client_id=token_request.client_id)
         raise HTTPException(status_code=400, detail="Invalid client_id")
     
-    client = registered_clients[token_request.client_id]
-    # Complete auto-registration if this was a cached client with dummy secret
-    if client["client_secret"] == "auto_generated_secret" and token_request.client_secret:
-        log_oauth("completing_auto_registration", 
-                   client_id=token_request.client_id,
-                   reason="updating_with_real_secret")
-        
-        # Update the client with the real secret Claude.ai is providing
-        client["client_secret"] = token_request.client_secret
-        registered_clients[token_request.client_id] = client
-        
-        log_oauth("auto_registration_completed", 
-                   client_id=token_request.client_id,
-                   note="secret_updated_from_token_request")
-    
     if token_request.client_secret != client["client_secret"]:
         log_oauth("token_request_failed", 
                    reason="invalid_client_credentials",
                    client_id=token_request.client_id,
-                   provided_secret=token_request.client_secret[:10] + "..." if token_request.client_secret else None,
-                   stored_secret=client["client_secret"][:10] + "...")
+                   has_secret=bool(token_request.client_secret))
         raise HTTPException(status_code=401, detail="Invalid client credentials")
     
     # Validate PKCE if present
@@ -622,31 +1227,134 @@ async def token_endpoint(request: Request):
                        client_id=token_request.client_id)
             raise HTTPException(status_code=400, detail="Invalid PKCE verification")
     
-    # Generate access token
-    access_token = generate_access_token()
-    token_data = {
-        "client_id": token_request.client_id,
-        "scope": code_data["scope"],
-        "expires_at": time.time() + 3600,  # 1 hour expiration
-    }
-    
-    access_tokens[access_token] = token_data
+    # Generate access and refresh tokens under a new grant
+    tokens = issue_tokens(token_request.client_id, code_data["scope"], secrets.token_urlsafe(16))
     
     log_oauth("access_token_generated", 
                client_id=token_request.client_id,
-               token=access_token[:10] + "...",
+               token=tokens["access_token"][:10] + "...",
                scope=code_data["scope"],
-               expires_in=3600)
+               expires_in=ACCESS_TOKEN_LIFETIME)
     
-    # Clean up authorization code (one-time use)
-    del authorization_codes[token_request.code]
+    return JSONResponse(tokens)
+
+def refresh_access_token(token_request: TokenRequest) -> JSONResponse:
+    """refresh_token grant: rotate the refresh token and issue a new access token
     
-    return JSONResponse({
-        "access_token": access_token,
-        "token_type": "Bearer",
-        "expires_in": 3600,
-        "scope": code_data["scope"]
-    })
+    Each refresh token works once. Presenting one that was already rotated
+    means it leaked or was replayed, so the whole grant is revoked and the
+    client has to authorize again.
+    """
+    client = oauth_store.clients.get(token_request.client_id) if token_request.client_id else None
+    if client is None or not secrets.compare_digest(str(token_request.client_secret or ""), client["client_secret"]):
+        log_oauth("token_request_failed", 
+                   reason="invalid_client_credentials",
+                   grant_type="refresh_token",
+                   client_id=token_request.client_id)
+        raise HTTPException(status_code=401, detail="Invalid client credentials")
+    
+    record = oauth_store.refresh_tokens.get(token_request.refresh_token) if token_request.refresh_token else None
+    if record is None or record["client_id"] != token_request.client_id:
+        log_oauth("token_request_failed", 
+                   reason="invalid_refresh_token",
+                   client_id=token_request.client_id)
+        raise HTTPException(status_code=400, detail="Invalid refresh token")
+    
+    if record.get("rotated_at"):
+        revoked = revoke_grant(record["grant_id"])
+        log_oauth("refresh_token_reuse_detected", 
+                   client_id=token_request.client_id,
+                   grant_id=record["grant_id"],
+                   grant_revoked=revoked)
+        raise HTTPException(status_code=400, detail="Invalid refresh token")
+    
+    grant = oauth_store.grants.get(record["grant_id"])
+    if grant is None or grant["refresh_token"] != token_request.refresh_token:
+        log_oauth("token_request_failed", 
+                   reason="grant_revoked",
+                   client_id=token_request.client_id)
+        raise HTTPException(status_code=400, detail="Invalid refresh token")
+    
+    # A refresh may narrow the scope but never widen it. Unlike at authorize,
+    # a request naming no known scope is refused, not widened to the default
+    scope = normalize_scope(record["scope"])
+    if token_request.scope is not None:
+        requested = known_scope(token_request.scope)
+        if not requested or scope_bits(requested) & ~scope_bits(scope):
+            log_oauth("token_request_failed", 
+                       reason="invalid_scope",
+                       client_id=token_request.client_id,
+                       requested_scope=token_request.scope)
+            raise HTTPException(status_code=400, detail="Invalid scope")
+        scope = requested
+    
+    # Claim the refresh token; of two concurrent refreshes only one gets it
+    if oauth_store.refresh_tokens.pop(token_request.refresh_token) is None:
+        raise HTTPException(status_code=400, detail="Invalid refresh token")
+    # Keep a marker until it would have expired, so a replay is recognised
+    oauth_store.refresh_tokens.put(token_request.refresh_token, {
+        "client_id": record["client_id"],
+        "grant_id": record["grant_id"],
+        "rotated_at": time.time(),
+    }, record["expires_at"])
+    
+    tokens = issue_tokens(token_request.client_id, scope, record["grant_id"])
+    
+    log_oauth("access_token_refreshed", 
+               client_id=token_request.client_id,
+               token=tokens["access_token"][:10] + "...",
+               scope=scope,
+               expires_in=ACCESS_TOKEN_LIFETIME)
+    
+    return JSONResponse(tokens)
+
+# Token Revocation Endpoint (RFC 7009)
+@app.post("/oauth/revoke")
+async def revoke_token(request: Request):
+    """RFC 7009 Token Revocation"""
+    body = await request.body()
+    try:
+        if request.headers.get("content-type") == "application/x-www-form-urlencoded":
+            from urllib.parse import parse_qs
+            fields = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+        else:
+            fields = json.loads(body)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request format: {str(e)}")
+    
+    client_id = fields.get("client_id")
+    revoked = await run_oauth(revoke_presented_token, fields)
+    log_oauth("token_revoked" if revoked else "token_revocation_ignored", client_id=client_id)
+    return JSONResponse({})
+
+def revoke_presented_token(fields: Dict[str, Any]) -> bool:
+    """Authenticate the client and revoke the token it presented; False if there was nothing to revoke"""
+    token = fields.get("token")
+    client_id = fields.get("client_id")
+    client = oauth_store.clients.get(client_id) if client_id else None
+    if client is None or not secrets.compare_digest(str(fields.get("client_secret", "")), client["client_secret"]):
+        log_oauth("token_revocation_failed", reason="invalid_client_credentials", client_id=client_id)
+        raise HTTPException(status_code=401, detail="Invalid client credentials")
+    if not token:
+        raise HTTPException(status_code=400, detail="token is required")
+    
+    # Unknown, expired or foreign tokens still get 200, as the RFC requires
+    revoked = False
+    claims = token_signer.verify(token) if token_signer is not None and looks_like_jwt(token) else None
+    if claims is not None:
+        if claims["client_id"] == client_id:
+            revocations.revoke(claims["jti"], claims["exp"])
+            revoked = True
+    else:
+        token_data = oauth_store.tokens.get(token)
+        refresh_data = oauth_store.refresh_tokens.get(token) if token_data is None else None
+        if token_data is not None and token_data["client_id"] == client_id:
+            oauth_store.tokens.delete(token)
+            revoked = True
+        elif refresh_data is not None and refresh_data["client_id"] == client_id:
+            # Revoking a refresh token ends the grant, along with its access token
+            revoked = revoke_grant(refresh_data["grant_id"])
+    return revoked
 
 # Health check endpoints
 @app.get("/health")
@@ -661,118 +1369,147 @@ async def alb_health_check():
     """ALB health check endpoint"""
     return {"status": "ok", "service": "ClodForest MCP + OAuth2 DCR Server", "version": "1.0.0"}
 
+# Prometheus metrics
+if METRICS_ENABLED:
+    @app.get("/metrics")
+    async def metrics_endpoint():
+        """Metrics in the Prometheus text format, for every worker"""
+        loop = asyncio.get_running_loop()
+        others = []
+        if worker_id() is not None:
+            others = await loop.run_in_executor(
+                io_executor, read_snapshots, metrics_dir, metrics_snapshot_path(), 3 * METRICS_PUBLISH_INTERVAL)
+        # Rendering counts OAuth store records, which may mean a round trip
+        body = await loop.run_in_executor(io_executor, metrics.render, others)
+        return Response(body, media_type=METRICS_CONTENT_TYPE)
+
 # Debug endpoints (only in debug mode)
 if DEBUG_MODE:
     @app.get("/debug/clients")
     async def debug_clients():
         """Debug: List registered clients"""
-        return {"clients": list(registered_clients.keys())}
+        return {"clients": await run_oauth(oauth_store.clients.keys)}
 
     @app.get("/debug/tokens")
     async def debug_tokens():
         """Debug: List active tokens"""
-        return {"tokens": list(access_tokens.keys())}
+        return {"tokens": await run_oauth(oauth_store.tokens.keys),
+                "live_tokens": await run_oauth(oauth_store.tokens.count)}
+
+    @app.get("/debug/cache")
+    async def debug_cache():
+        """Debug: Show read cache counters"""
+        return {"read_cache": content_cache.stats()}
 
     @app.get("/debug/config")
     async def debug_config():
         """Debug: Show current configuration"""
         return {"config": OAUTH_CONFIG, "debug_mode": DEBUG_MODE}
 
-# Access logging middleware
-@app.middleware("http")
-async def access_logging_middleware(request: Request, call_next):
-    """Log all HTTP requests in structured format"""
-    start_time = time.time()
-    
-    # Process the request
+# OAuth paths timed in clodforest_oauth_request_duration_seconds, by endpoint label
+OAUTH_ENDPOINTS = {
+    "/.well-known/oauth-authorization-server": "discovery",
+    "/.well-known/oauth-authorization-server/": "discovery",
+    "/.well-known/oauth-authorization-server/mcp": "discovery",
+    "/.well-known/oauth-protected-resource/mcp": "resource_metadata",
+    "/register": "register",
+    "/oauth/authorize": "authorize",
+    "/oauth/token": "token",
+    "/oauth/revoke": "revoke",
+}
+
+# Who may call what, by path prefix; the longest matching prefix applies and
+# paths not listed are public. Compiled once into a trie for the gateway
+ROUTE_POLICIES = {
+    "/.well-known": RoutePolicy(PUBLIC),
+    "/oauth": RoutePolicy(PUBLIC),
+    "/register": RoutePolicy(PUBLIC),
+    "/health": RoutePolicy(PUBLIC),
+    "/api/health": RoutePolicy(PUBLIC),
+    "/metrics": RoutePolicy(BEARER),
+    "/debug": RoutePolicy(PUBLIC),
+    "/mcp": RoutePolicy(SCOPED, scope_bits("mcp:read")),
+}
+route_table = RouteTable(ROUTE_POLICIES)
+
+async def authenticate_request(token: str, info: RequestInfo) -> Optional[Dict[str, Any]]:
+    if METRICS_TOKEN and info.scope["path"] == "/metrics" and secrets.compare_digest(token, METRICS_TOKEN):
+        return {"client_id": "metrics", "scope_bits": 0}
     try:
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        
-        log_access(request, response.status_code, 
-                   process_time=process_time,
-                   content_length=response.headers.get("content-length"))
-        
-        return response
+        claims = token_signer.verify(token) if token_signer is not None and looks_like_jwt(token) else None
+        if claims is not None and not revocations.may_be_revoked(claims["jti"]):
+            token_data = jwt_token_data(claims)  # Checked entirely in memory
+        else:
+            token_data = await run_oauth(validate_token, token)
     except Exception as e:
-        process_time = time.time() - start_time
-        
-        log_access(request, 500, 
-                   process_time=process_time,
-                   error=str(e))
-        
-        raise
+        log_error("authentication_exception", path=info.scope["path"], exception=str(e))
+        return None
+    if token_data:
+        # Logged on every MCP request; sample it with CLODFOREST_LOG_SAMPLE
+        log_mcp("authentication_success", 
+                 client_id=token_data.get('client_id'),
+                 token=lazy(lambda: token[:10] + "..."),
+                 path=info.scope["path"])
+    return token_data or None
 
-# MCP endpoint protection middleware
-@app.middleware("http")
-async def oauth_protection_middleware(request: Request, call_next):
-    """Middleware to protect MCP endpoints with OAuth"""
-    
-    # Allow OAuth endpoints and health checks without authentication
-    if request.url.path.startswith(("/.well-known", "/oauth", "/register", "/health", "/api/health", "/debug")):
-        return await call_next(request)
-    
-    # For MCP endpoints, require OAuth authentication
-    if request.url.path.startswith("/mcp"):
-        try:
-            auth_header = request.headers.get("authorization")
-            
-            if not auth_header or not auth_header.startswith("Bearer "):
-                log_mcp("authentication_failed", 
-                         reason="no_bearer_token",
-                         path=request.url.path)
-                return JSONResponse(
-                    status_code=401,
-                    content={"error": "Authorization header required"}
-                )
-            
-            token = auth_header.split(" ")[1]
-            
-            token_data = validate_token(token)
-            if not token_data:
-                log_mcp("authentication_failed", 
-                         reason="invalid_token",
-                         token=token[:10] + "...",
-                         available_tokens=[t[:10] + "..." for t in access_tokens.keys()])
-                return JSONResponse(
-                    status_code=401,
-                    content={"error": "Invalid or expired token"}
-                )
-            
-            log_mcp("authentication_success", 
-                     client_id=token_data.get('client_id'),
-                     token=token[:10] + "...",
-                     path=request.url.path)
-            
-            # Token is valid, proceed with request
-            return await call_next(request)
-            
-        except Exception as e:
-            logger.error(f"Authentication failed: {e}")
-            return JSONResponse(
-                status_code=401,
-                content={"error": f"Authentication failed: {str(e)}"}
-            )
-    
-    # All other endpoints pass through normally
-    return await call_next(request)
+def reject_request(info: RequestInfo, reason: str):
+    log_mcp("authentication_failed", reason=reason, path=info.scope["path"])
 
-# OAuth endpoint protection middleware now handles /mcp automatically via mounting
+def request_completed(info: RequestInfo):
+    """Access log and OAuth latency metrics, once the response has been sent"""
+    endpoint = OAUTH_ENDPOINTS.get(info.scope["path"])
+    if endpoint is not None:
+        oauth_duration.labels(endpoint, info.status).observe(info.duration)
+    if info.error is None:
+        log_access(info.scope, info.status, info.user_agent,
+                   process_time=info.duration,
+                   content_length=info.content_length)
+    else:
+        log_access(info.scope, 500, info.user_agent,
+                   process_time=info.duration,
+                   error=info.error)
+
+# CORS, bearer checks on /mcp and access logging in one pure-ASGI layer, so
+# requests aren't copied through per-middleware tasks and MCP streams pass
+# straight through
+app.add_middleware(
+    GatewayMiddleware,
+    cors=CorsPolicy(
+        allow_origins=["https://claude.ai", "https://www.claude.ai"],
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["*"],
+    ),
+    classify=route_table.classify,
+    authenticate=authenticate_request,
+    reject=reject_request,
+    on_complete=request_completed,
+)
 
 if __name__ == "__main__":
     # Allow stdio for local testing
     if len(sys.argv) > 1 and sys.argv[1] == "--stdio":
         log_app("server_starting", mode="stdio", transport="Claude Desktop")
+        context_watcher.start()
+        context_index.start()
+        if vector_index is not None:
+            vector_index.start()
         mcp.run(transport="stdio")
     else:
         # Use HTTP with integrated OAuth
-        host = "0.0.0.0"
-        port = 8080
+        host = os.getenv("CLODFOREST_HOST", "0.0.0.0")
+        port = int(os.getenv("CLODFOREST_PORT", "8080"))
+        workers = int(os.getenv("CLODFOREST_WORKERS", "1"))
+        
+        if workers > 1 and oauth_store.name == "memory":
+            print("Error: CLODFOREST_OAUTH_STORE=memory can't be shared between workers")
+            sys.exit(1)
         
         log_app("server_starting", 
                  mode="http",
                  host=host,
                  port=port,
+                 workers=workers,
                  debug_mode=DEBUG_MODE,
                  oauth_issuer=OAUTH_CONFIG["issuer"])
         
@@ -790,5 +1527,11 @@ if __name__ == "__main__":
         print(f"  - {log_dir}/error.log (Errors)")
         print(f"  - {log_dir}/app.log (Application events)")
         
+        if workers > 1:
+            # Each worker imports this module and serves on its own SO_REUSEPORT socket
+            print(f"Workers: {workers}")
+            sys.exit(serve("clodforest:app", Path(__file__).parent, host, port, workers,
+                           graceful_timeout=float(os.getenv("CLODFOREST_GRACEFUL_TIMEOUT", "30"))))
+        
         # Run the FastAPI app directly
         uvicorn.run(app, host=host, port=port)
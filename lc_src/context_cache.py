@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+ClodForest context caches
+In-memory directory tree cache for list_contexts and byte-bounded LRU
+content cache for read_context
+"""
+
+import bisect
+import os
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from context_io import is_temp_name
+
+
+class DirEntry(NamedTuple):
+    mtime_ns: int
+    files: Tuple[str, ...]
+    subdirs: Tuple[str, ...]
+
+
+class ListingCache:
+    """Sorted file listing of a context directory, revalidated per directory
+
+    A directory's mtime changes whenever an entry is added, removed or renamed
+    in it, so one stat per directory is enough to know whether its cached
+    names are still right. While a ContextWatcher is running even those stats
+    are skipped and only directories it reports are rescanned.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._lock = threading.Lock()
+        self._dirs: Dict[str, DirEntry] = {}
+        self._dirty: Set[str] = set()
+        self._flat: Optional[List[str]] = None
+        self._watcher = None
+
+    def follow(self, watcher):
+        """Skip directory stats for as long as a ContextWatcher reports changes"""
+        self._watcher = watcher
+        watcher.subscribe(self.invalidate)
+
+    def invalidate(self, paths: Optional[Set[str]]):
+        """Forget directories touched by changed paths; None forgets everything"""
+        with self._lock:
+            if paths is None:
+                self._dirs.clear()
+                self._flat = None
+                return
+            for rel_path in paths:
+                self._dirty.add(rel_path)
+                self._dirty.add(rel_path.rpartition("/")[0])
+
+    def _scan(self, rel_dir: str) -> Optional[DirEntry]:
+        path = self.root / rel_dir if rel_dir else self.root
+        files = []
+        subdirs = []
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(rel)
+                        elif entry.is_file() and not is_temp_name(entry.name):
+                            files.append(rel)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return DirEntry(mtime_ns, tuple(files), tuple(subdirs))
+
+    def _revalidate(self):
+        trusted = self._watcher is not None and self._watcher.healthy
+        changed = self._flat is None
+        seen = set()
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            seen.add(rel_dir)
+            entry = self._dirs.get(rel_dir)
+            stale = entry is None or rel_dir in self._dirty
+            if not stale and not trusted:
+                path = self.root / rel_dir if rel_dir else self.root
+                try:
+                    stale = path.stat().st_mtime_ns != entry.mtime_ns
+                except OSError:
+                    stale = True
+            if stale:
+                entry = self._scan(rel_dir)
+                changed = True
+                if entry is None:
+                    self._dirs.pop(rel_dir, None)
+                    continue
+                self._dirs[rel_dir] = entry
+            stack.extend(entry.subdirs)
+
+        self._dirty.clear()
+        for rel_dir in self._dirs.keys() - seen:
+            del self._dirs[rel_dir]
+            changed = True
+        if changed:
+            self._flat = sorted(path for entry in self._dirs.values() for path in entry.files)
+
+    def files(self) -> List[str]:
+        """All file paths relative to root, sorted"""
+        with self._lock:
+            self._revalidate()
+            return self._flat
+
+    def page(self, prefix: str = "", max_depth: Optional[int] = None,
+             after: Optional[str] = None, limit: int = 500) -> Tuple[List[str], Optional[str]]:
+        """One page of sorted paths starting with prefix, resuming after a cursor path
+
+        Returns the page and the path to resume after, or None on the last page.
+        max_depth counts path components from root (1 = top-level files only).
+        """
+        paths = self.files()
+        start = bisect.bisect_left(paths, prefix)
+        if after is not None:
+            start = max(start, bisect.bisect_right(paths, after))
+
+        page = []
+        for i in range(start, len(paths)):
+            path = paths[i]
+            if not path.startswith(prefix):
+                break
+            if max_depth is not None and path.count("/") >= max_depth:
+                continue
+            if len(page) == limit:
+                return page, page[-1]
+            page.append(path)
+        return page, None
+
+
+class CachedFile(NamedTuple):
+    signature: Tuple[int, int, int]  # (mtime_ns, size, inode)
+    content: str
+    cost: int
+
+
+def file_signature(st: os.stat_result) -> Tuple[int, int, int]:
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class ContentCache:
+    """LRU cache of decoded context files, bounded by total bytes held
+
+    Entries are keyed by path relative to root and revalidated against the
+    file's (mtime, size, inode) on every hit, so edits and atomic replaces
+    are never served stale. Files costing more than max_entry_bytes are
+    never cached; the least recently used entries are evicted once the
+    total exceeds max_bytes.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 64 * 1024 * 1024,
+                 max_entry_bytes: int = 4 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def follow(self, watcher):
+        """Drop entries as soon as a ContextWatcher reports them changed"""
+        watcher.subscribe(self.invalidate)
+
+    def get(self, rel_path: str) -> Optional[str]:
+        """Cached content if the file on disk is unchanged, else None"""
+        with self._lock:
+            entry = self._entries.get(rel_path)
+            if entry is None:
+                self.misses += 1
+                return None
+
+        try:
+            signature = file_signature(os.stat(self.root / rel_path))
+        except OSError:
+            signature = None
+
+        with self._lock:
+            current = self._entries.get(rel_path) is entry
+            if signature != entry.signature:
+                if current:
+                    self._discard(rel_path)
+                self.misses += 1
+                return None
+            if current:
+                self._entries.move_to_end(rel_path)
+            self.hits += 1
+        return entry.content
+
+    def put(self, rel_path: str, content: str, st: os.stat_result):
+        """Cache content read from a file whose stat was taken before reading"""
+        cost = sys.getsizeof(content)
+        if cost > self.max_entry_bytes or cost > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(rel_path)
+            self._entries[rel_path] = CachedFile(file_signature(st), content, cost)
+            self._bytes += cost
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.cost
+                self.evictions += 1
+
+    def discard(self, rel_path: str):
+        with self._lock:
+            self._discard(rel_path)
+
+    def _discard(self, rel_path: str):
+        entry = self._entries.pop(rel_path, None)
+        if entry is not None:
+            self._bytes -= entry.cost
+
+    def invalidate(self, paths: Optional[Set[str]]):
+        """Forget changed paths (and anything below them); None forgets everything"""
+        with self._lock:
+            if paths is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for rel_path in paths:
+                self._discard(rel_path)
+                below = rel_path + "/"
+                for cached in [p for p in self._entries if p.startswith(below)]:
+                    self._discard(cached)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
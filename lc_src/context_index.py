@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+"""
+ClodForest context search index
+Persistent SQLite inverted index (token -> file/offset postings) over CONTEXT_DIR,
+with BM25-ranked, snippet-annotated search
+"""
+
+import fnmatch
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Pattern, Set, Tuple
+
+from context_io import is_temp_name
+from context_scan import (DEFAULT_MAX_FILE_BYTES, DEFAULT_SCAN_WORKERS, MODE_REGEX, MODE_SUBSTRING,
+                          MODE_WORD, PARALLEL_MIN_FILES, SEARCH_MODES, ScanPool, ScanWorkerError,
+                          compile_query, overlap_for, scan_paths, stream_scan)
+
+log = logging.getLogger("clodforest.app")
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Files larger than this are not tokenized; searches always verify them directly
+DEFAULT_MAX_INDEX_BYTES = 8 * 1024 * 1024
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Scanned files stop counting matches here; BM25 has all but saturated by then
+SCAN_MAX_MATCHES = 16
+
+# documents.indexed states
+INDEXED = 1
+TOO_LARGE = 0
+UNREADABLE = -1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    indexed INTEGER NOT NULL,
+    length INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    term TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    offsets BLOB NOT NULL,
+    PRIMARY KEY (term_id, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_doc ON postings(doc_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def tokenize(text: str) -> Dict[str, array]:
+    """Map each lowercased token to the character offsets where it occurs"""
+    postings: Dict[str, array] = {}
+    for match in TOKEN_RE.finditer(text):
+        offsets = postings.get(match.group())
+        if offsets is None:
+            offsets = postings[match.group()] = array("I")
+        offsets.append(match.start())
+    return postings
+
+
+class SearchHit(NamedTuple):
+    path: str
+    score: float
+    snippets: List[Tuple[int, str]]  # (line number, line excerpt with **highlighted** match)
+
+
+def bm25(tf: float, df: int, doc_len: float, avg_len: float, total_docs: int) -> float:
+    idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+    norm = 1 - BM25_B + BM25_B * (doc_len / avg_len if avg_len else 1)
+    return idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+
+
+def rank_scanned(scanned: Dict[str, Tuple[int, int]], total_docs: int) -> Dict[str, float]:
+    """BM25 over scan results, treating the whole query as one term"""
+    if not scanned:
+        return {}
+    avg_len = sum(length for _, length in scanned.values()) / len(scanned)
+    return {path: bm25(tf, len(scanned), length, avg_len, max(total_docs, len(scanned)))
+            for path, (tf, length) in scanned.items()}
+
+
+class ContextIndex:
+    """Inverted index over a context directory, persisted in SQLite"""
+
+    def __init__(self, root: Path, db_path: Path, max_age: float = 300.0,
+                 max_index_bytes: int = DEFAULT_MAX_INDEX_BYTES,
+                 max_scan_bytes: int = DEFAULT_MAX_FILE_BYTES, scan_workers: Optional[int] = None):
+        self.root = root
+        self.db_path = db_path
+        self.max_age = max_age
+        self.max_index_bytes = max_index_bytes
+        self.max_scan_bytes = max_scan_bytes
+        self.scan_workers = scan_workers if scan_workers is not None else DEFAULT_SCAN_WORKERS
+        self._scan_pool: Optional[ScanPool] = None
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._fresh_at = 0.0
+        self._watcher = None
+        self._leader = None
+        self._heartbeat_thread: Optional[threading.Thread] = None
+
+    # Storage
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            if self._scan_pool is not None:
+                self._scan_pool.close()
+                self._scan_pool = None
+
+    # Scanning
+
+    def _scan(self, paths: List[str], matcher: Pattern, overlap: int,
+              max_matches: int = 1) -> Dict[str, Tuple[int, int]]:
+        """Stream-scan paths, on worker processes when there are enough of them"""
+        pool = None
+        if self.scan_workers > 1 and len(paths) >= PARALLEL_MIN_FILES:
+            with self._lock:
+                if self._scan_pool is None:
+                    self._scan_pool = ScanPool(self.scan_workers)
+                pool = self._scan_pool
+        try:
+            return scan_paths(self.root, paths, matcher, overlap, max_matches, self.max_scan_bytes, pool)
+        except BrokenProcessPool:
+            log.warning("search worker pool failed, scanning in-process")
+            with self._lock:
+                self.scan_workers = 1
+                if self._scan_pool is not None:
+                    self._scan_pool.close()
+                    self._scan_pool = None
+            return scan_paths(self.root, paths, matcher, overlap, max_matches, self.max_scan_bytes)
+        except ScanWorkerError as e:
+            # The workers are still up; only this scan is retried here
+            log.warning("search worker raised, scanning in-process: %s", e)
+            return scan_paths(self.root, paths, matcher, overlap, max_matches, self.max_scan_bytes)
+
+    # Freshness
+
+    def follow(self, watcher):
+        """Trust the index for as long as a ContextWatcher is feeding it changes"""
+        self._watcher = watcher
+        watcher.subscribe(self.apply_changes)
+
+    def follow_leader(self, leader):
+        """Share the index between workers: only the LeaderLock holder refreshes it
+
+        Other workers still index their own writes but trust the leader, whose
+        watcher sees every change, to keep the rest current, for as long as it
+        keeps vouching for the index (see _heartbeat); after max_age without
+        that, they scan instead.
+        """
+        self._leader = leader
+        leader.on_acquire(self.start)
+
+    def _leading(self) -> bool:
+        return self._leader is None or self._leader.held
+
+    def is_fresh(self) -> bool:
+        """True when the index has been reconciled with disk and kept current since"""
+        if not self._leading():
+            return self._leader_refreshed()
+        if self._fresh_at <= 0:
+            return False
+        if self._watcher is not None and self._watcher.healthy:
+            return True
+        return time.time() - self._fresh_at < self.max_age
+
+    def mark_fresh(self):
+        self._fresh_at = time.time()
+
+    def _leader_refreshed(self) -> bool:
+        """True when the leader has vouched for the index within max_age"""
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM meta WHERE key = 'refreshed_at'").fetchone()
+        if row is None or time.time() - float(row[0]) >= self.max_age:
+            return False
+        self._fresh_at = float(row[0])
+        return True
+
+    def _record_refreshed(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('refreshed_at', ?)",
+                         (str(time.time()),))
+            conn.commit()
+        self.mark_fresh()
+
+    def _heartbeat(self):
+        """Leader only: keep refreshed_at recent while the index is current
+
+        With a healthy watcher the leader never needs to rescan, so without
+        this its refreshed_at would age past the followers' max_age. When the
+        watcher has stopped, the index is reconciled with disk instead.
+        """
+        interval = max(1.0, self.max_age / 3)
+        while True:
+            time.sleep(interval)
+            try:
+                if self._watcher is not None and self._watcher.healthy and self._fresh_at > 0:
+                    self._record_refreshed()
+                else:
+                    self.refresh()
+            except Exception:
+                log.exception("search index heartbeat failed")
+
+    def start(self):
+        """Reconcile the index with disk in a background thread"""
+        if not self._leading():
+            return
+        with self._lock:
+            if self._leader is not None and self._heartbeat_thread is None:
+                self._heartbeat_thread = threading.Thread(
+                    target=self._heartbeat, name="context-index-heartbeat", daemon=True)
+                self._heartbeat_thread.start()
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(
+                target=self.refresh, name="context-index-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def refresh(self) -> Dict[str, int]:
+        """Stat every file and reindex only those added, changed or removed"""
+        stats = self._reconcile("")
+        self._record_refreshed()
+        return stats
+
+    def _reconcile(self, prefix: str) -> Dict[str, int]:
+        """Bring documents at or below prefix ("" for everything) in line with disk"""
+        base = self.root / prefix if prefix else self.root
+        on_disk = {}
+        if base.is_dir():
+            for item in base.rglob("*"):
+                try:
+                    if item.is_file() and not is_temp_name(item.name):
+                        st = item.stat()
+                        on_disk[item.relative_to(self.root).as_posix()] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+        elif base.is_file():
+            st = base.stat()
+            on_disk[prefix] = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            conn = self._connect()
+            if prefix:
+                rows = conn.execute(
+                    "SELECT path, mtime_ns, size FROM documents "
+                    "WHERE path = ? OR (path >= ? AND path < ?)",
+                    (prefix, prefix + "/", prefix + "0"))
+            else:
+                rows = conn.execute("SELECT path, mtime_ns, size FROM documents")
+            known = {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+        removed = [path for path in known if path not in on_disk]
+        changed = [path for path, sig in on_disk.items() if known.get(path) != sig]
+
+        for path in removed:
+            self.remove_path(path)
+        for path in changed:
+            self.update_path(path)
+        return {"files": len(on_disk), "changed": len(changed), "removed": len(removed)}
+
+    def apply_changes(self, paths: Optional[Set[str]]):
+        """Reprocess paths reported by a ContextWatcher; None means rescan everything"""
+        if not self._leading():
+            return
+        if paths is None:
+            self.refresh()
+            return
+        for rel_path in paths:
+            full_path = self.root / rel_path
+            if full_path.is_file():
+                self.update_path(rel_path)
+            else:
+                # A directory appeared or vanished, or a file was deleted
+                self._reconcile(rel_path)
+
+    # Incremental updates
+
+    def update_path(self, rel_path: str):
+        """(Re)index one file, identified by its path relative to root"""
+        full_path = self.root / rel_path
+        try:
+            st = full_path.stat()
+        except OSError:
+            self.remove_path(rel_path)
+            return
+
+        with self._lock:
+            known = self._connect().execute(
+                "SELECT mtime_ns, size FROM documents WHERE path = ?", (rel_path,)).fetchone()
+        if known == (st.st_mtime_ns, st.st_size):
+            return  # Already current, e.g. a watcher echo of our own write
+
+        postings: Dict[str, array] = {}
+        indexed = TOO_LARGE
+        if st.st_size <= self.max_index_bytes:
+            try:
+                postings = tokenize(full_path.read_text(encoding="utf-8").lower())
+                indexed = INDEXED
+            except (IOError, OSError, UnicodeDecodeError):
+                indexed = UNREADABLE  # Not retried until the file changes
+        length = sum(len(offsets) for offsets in postings.values())
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO documents (path, mtime_ns, size, indexed, length) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET mtime_ns=excluded.mtime_ns, size=excluded.size, "
+                "indexed=excluded.indexed, length=excluded.length",
+                (rel_path, st.st_mtime_ns, st.st_size, indexed, length))
+            doc_id = conn.execute("SELECT id FROM documents WHERE path = ?", (rel_path,)).fetchone()[0]
+            conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+            if postings:
+                conn.executemany("INSERT OR IGNORE INTO terms (term) VALUES (?)",
+                                 ((term,) for term in postings))
+                term_ids = self._term_ids(conn, list(postings))
+                conn.executemany(
+                    "INSERT INTO postings (term_id, doc_id, offsets) VALUES (?, ?, ?)",
+                    ((term_ids[term], doc_id, offsets.tobytes()) for term, offsets in postings.items()))
+            conn.commit()
+
+    def remove_path(self, rel_path: str):
+        """Drop one file from the index"""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT id FROM documents WHERE path = ?", (rel_path,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM postings WHERE doc_id = ?", (row[0],))
+                conn.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+                conn.commit()
+
+    @staticmethod
+    def _term_ids(conn: sqlite3.Connection, terms: List[str]) -> Dict[str, int]:
+        ids = {}
+        for start in range(0, len(terms), 500):
+            chunk = terms[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            ids.update((term, term_id) for term_id, term in conn.execute(
+                f"SELECT id, term FROM terms WHERE term IN ({placeholders})", chunk))
+        return ids
+
+    # Queries
+
+    def _matching_terms(self, conn: sqlite3.Connection, token: str,
+                        left_open: bool, right_open: bool) -> List[Tuple[int, int]]:
+        """Find (term_id, shift) pairs for a query token
+
+        A token at the start of the query may be the tail of a longer word in
+        the file, and one at the end may be its head; shift is where the query
+        token begins inside the matching term.
+        """
+        if not left_open and not right_open:
+            row = conn.execute("SELECT id FROM terms WHERE term = ?", (token,)).fetchone()
+            return [(row[0], 0)] if row else []
+        if right_open and not left_open:
+            rows = conn.execute("SELECT id FROM terms WHERE term >= ? AND term < ?",
+                                (token, token + "\U0010ffff"))
+            return [(term_id, 0) for (term_id,) in rows]
+        if left_open and not right_open:
+            rows = conn.execute("SELECT id, term FROM terms WHERE substr(term, -?) = ?",
+                                (len(token), token))
+            return [(term_id, len(term) - len(token)) for term_id, term in rows]
+        rows = conn.execute("SELECT id, term FROM terms WHERE instr(term, ?) > 0", (token,))
+        return [(term_id, term.index(token)) for term_id, term in rows]
+
+    def search(self, query: str, mode: str = MODE_SUBSTRING, path_glob: Optional[str] = None,
+               limit: int = 20, max_snippets: int = 3) -> Tuple[List[SearchHit], int]:
+        """Top hits by BM25 with line snippets, plus the total number of matching files
+
+        Uses the index when it is fresh and the mode allows; otherwise scans.
+        """
+        matcher = compile_query(query, mode)
+        overlap = overlap_for(query, mode)
+
+        scores = None
+        if mode != MODE_REGEX:
+            if self.is_fresh():
+                scores = self._indexed_scores(query, matcher, overlap, mode == MODE_WORD, path_glob)
+            else:
+                self.start()
+        if scores is None:
+            paths = [p.relative_to(self.root).as_posix() for p in self.root.rglob("*")
+                     if p.is_file() and not is_temp_name(p.name)]
+            total_docs = len(paths)
+            if path_glob:
+                paths = [path for path in paths if fnmatch.fnmatchcase(path, path_glob)]
+            scores = rank_scanned(self._scan(paths, matcher, overlap, SCAN_MAX_MATCHES), total_docs)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        hits = []
+        for path, score in ranked:
+            # Reads each hit only as far as its last snippet
+            result = stream_scan(self.root / path, matcher, overlap, 1, max_snippets, self.max_scan_bytes)
+            hits.append(SearchHit(path, score, result.snippets if result else []))
+        return hits, len(scores)
+
+    def _indexed_scores(self, query: str, matcher: Pattern, overlap: int, whole_words: bool,
+                        path_glob: Optional[str]) -> Optional[Dict[str, float]]:
+        """BM25 scores of verified matches from the postings, or None if the index can't answer"""
+        needle = query.lower()
+        tokens = [(m.group(), m.start(),
+                   m.start() == 0 and not whole_words,
+                   m.end() == len(needle) and not whole_words)
+                  for m in TOKEN_RE.finditer(needle)]
+        if not tokens:
+            return None  # Pure punctuation/whitespace; only a scan can answer
+
+        # A single word run is answered exactly by the postings
+        exact = len(tokens) == 1 and tokens[0][1] == 0 and len(tokens[0][0]) == len(needle)
+
+        with self._lock:
+            conn = self._connect()
+            term_matches = [self._matching_terms(conn, token, left_open, right_open)
+                            for token, _, left_open, right_open in tokens]
+
+            # Term frequency of each query token per document
+            frequencies: List[Dict[int, int]] = []
+            candidates: Optional[set] = None
+            for matches in term_matches:
+                tf: Dict[int, int] = {}
+                for term_id, _ in matches:
+                    for doc_id, count in conn.execute(
+                            "SELECT doc_id, length(offsets) / 4 FROM postings WHERE term_id = ?",
+                            (term_id,)):
+                        tf[doc_id] = tf.get(doc_id, 0) + count
+                frequencies.append(tf)
+                candidates = set(tf) if candidates is None else candidates & tf.keys()
+                if not candidates:
+                    break
+
+            if candidates and len(tokens) > 1:
+                candidates = self._adjacent(conn, tokens, term_matches, candidates)
+
+            total_docs, avg_len = conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM documents WHERE indexed = ?", (INDEXED,)).fetchone()
+            docs = self._documents(conn, candidates or ())
+            oversized = [path for (path,) in conn.execute(
+                "SELECT path FROM documents WHERE indexed = ?", (TOO_LARGE,))]
+
+        if path_glob:
+            docs = {doc_id: doc for doc_id, doc in docs.items() if fnmatch.fnmatchcase(doc[0], path_glob)}
+            oversized = [path for path in oversized if fnmatch.fnmatchcase(path, path_glob)]
+
+        scores = {}
+        for doc_id, (path, length) in docs.items():
+            scores[path] = sum(bm25(tf[doc_id], len(tf), length, avg_len or 0, total_docs)
+                               for tf in frequencies)
+
+        if not exact:
+            # Verification only needs a yes/no, so each file is read up to its first match
+            verified = self._scan(list(scores), matcher, overlap)
+            scores = {path: score for path, score in scores.items() if path in verified}
+        # Oversized files were never tokenized, so check them directly
+        scores.update(rank_scanned(self._scan(oversized, matcher, overlap, SCAN_MAX_MATCHES), total_docs))
+        return scores
+
+    @staticmethod
+    def _adjacent(conn: sqlite3.Connection, tokens, term_matches, candidates: set) -> set:
+        """Keep documents where every query token occurs at the right relative offset"""
+        anchors: Dict[int, set] = {}
+        for i, ((_, start, _, _), matches) in enumerate(zip(tokens, term_matches)):
+            positions: Dict[int, set] = {}
+            for term_id, shift in matches:
+                for doc_id, blob in conn.execute(
+                        "SELECT doc_id, offsets FROM postings WHERE term_id = ?", (term_id,)):
+                    if doc_id not in candidates:
+                        continue
+                    offsets = array("I")
+                    offsets.frombytes(blob)
+                    positions.setdefault(doc_id, set()).update(
+                        offset + shift - start for offset in offsets)
+            if i == 0:
+                anchors = positions
+            else:
+                anchors = {doc_id: found & positions[doc_id]
+                           for doc_id, found in anchors.items()
+                           if doc_id in positions and found & positions[doc_id]}
+            if not anchors:
+                break
+        return set(anchors)
+
+    @staticmethod
+    def _documents(conn: sqlite3.Connection, doc_ids) -> Dict[int, Tuple[str, int]]:
+        doc_ids = list(doc_ids)
+        docs = {}
+        for start in range(0, len(doc_ids), 500):
+            chunk = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            docs.update((doc_id, (path, length)) for doc_id, path, length in conn.execute(
+                f"SELECT id, path, length FROM documents WHERE id IN ({placeholders})", chunk))
+        return docs
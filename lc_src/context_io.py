@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+ClodForest context file I/O
+mmap-backed ranged reads so large context files are served a window at a time,
+and atomic, optionally coalesced writes with configurable durability
+"""
+
+import mmap
+import os
+import re
+import secrets
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+# Durability modes for atomic writes
+DURABILITY_NONE = "none"  # Rename only; the OS flushes when it likes
+DURABILITY_FDATASYNC = "fdatasync"  # Flush file data before the rename
+DURABILITY_DIRSYNC = "dirsync"  # Also fsync the directory so the rename itself survives a crash
+DURABILITY_MODES = (DURABILITY_NONE, DURABILITY_FDATASYNC, DURABILITY_DIRSYNC)
+
+HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+# atomic_write's temporary files, ".{name}.{8 hex digits}.tmp" beside the target
+TEMP_NAME_RE = re.compile(r"^\..+\.[0-9a-f]{8}\.tmp$")
+
+
+class PreconditionFailed(Exception):
+    """The file's etag no longer matches the one the edit was based on"""
+
+    def __init__(self, etag: Optional[str]):
+        super().__init__(f"file has changed (current etag: {etag or 'none, file missing'})")
+        self.etag = etag
+
+
+class PatchError(ValueError):
+    """A diff or line range does not apply to the current file"""
+
+
+class ReadWindow(NamedTuple):
+    text: str
+    start: int  # First byte served
+    end: int  # One past the last byte served
+    size: int  # Total file size in bytes
+    resume: Optional[str]  # Arguments that continue the read, None when complete
+
+
+def _is_continuation(mm: mmap.mmap, pos: int) -> bool:
+    """True if pos falls inside a multi-byte UTF-8 sequence"""
+    return mm[pos] & 0xC0 == 0x80
+
+
+def _decode(mm: mmap.mmap, start: int, end: int) -> str:
+    # Decode straight from the mapping; only the decoded str is allocated
+    with memoryview(mm) as view, view[start:end] as window:
+        return str(window, "utf-8")
+
+
+def _align(mm: mmap.mmap, start: int, end: int, size: int):
+    """Move a byte range onto UTF-8 character boundaries"""
+    while start < size and _is_continuation(mm, start):
+        start += 1
+    end = max(end, start)
+    while start < end < size and _is_continuation(mm, end):
+        end -= 1
+    if end == start < size:
+        # Window narrower than one character; serve that character whole
+        end += 1
+        while end < size and _is_continuation(mm, end):
+            end += 1
+    return start, end
+
+
+def read_window(path: Path, offset: int, length: int) -> ReadWindow:
+    """Decode length bytes from offset, widened/narrowed to whole characters"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if offset >= size:
+            return ReadWindow("", size, size, size, None)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start, end = _align(mm, max(offset, 0), min(offset + length, size), size)
+            text = _decode(mm, start, end)
+    return ReadWindow(text, start, end, size, f"offset={end}" if end < size else None)
+
+
+def read_lines(path: Path, start_line: int, end_line: Optional[int], max_bytes: int) -> ReadWindow:
+    """Decode lines start_line..end_line (1-based, inclusive), at most max_bytes at a time"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ReadWindow("", 0, 0, 0, None)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            for _ in range(start_line - 1):
+                newline = mm.find(b"\n", start)
+                if newline < 0:
+                    return ReadWindow("", size, size, size, None)
+                start = newline + 1
+
+            end = start
+            line = start_line
+            resume = None
+            while end < size and (end_line is None or line <= end_line):
+                newline = mm.find(b"\n", end)
+                line_end = size if newline < 0 else newline + 1
+                if line_end - start > max_bytes:
+                    if line == start_line:
+                        # A single line longer than the budget; continue it by offset
+                        start, end = _align(mm, start, start + max_bytes, size)
+                        resume = f"offset={end}"
+                    else:
+                        resume = f"start_line={line}"
+                    break
+                end = line_end
+                line += 1
+
+            text = _decode(mm, start, end)
+    return ReadWindow(text, start, end, size, resume)
+
+
+def _sync_data(fd: int):
+    # fdatasync skips metadata-only flushes; macOS only has fsync
+    if hasattr(os, "fdatasync"):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+def etag_for(st: os.stat_result) -> str:
+    """Version tag that changes on every write, including atomic replaces"""
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}-{st.st_ino:x}"
+
+
+def temp_path_for(path: Path) -> Path:
+    return path.with_name(f".{path.name}.{secrets.token_hex(4)}.tmp")
+
+
+def is_temp_name(name: str) -> bool:
+    """True for atomic_write's in-flight temporary files, which listings, indexes and watchers skip"""
+    return TEMP_NAME_RE.match(name) is not None
+
+
+def current_etag(path: Path) -> Optional[str]:
+    try:
+        return etag_for(os.stat(path))
+    except FileNotFoundError:
+        return None
+
+
+def atomic_write(path: Path, data: Union[bytes, List], durability: str = DURABILITY_NONE):
+    """Replace path with data so readers see either the old or the new file, never a mix
+
+    data may be a list of bytes-like parts (e.g. slices of an mmap of the old
+    file) so edits to large files need not assemble the new content in memory.
+    """
+    tmp_path = temp_path_for(path)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        try:
+            try:
+                os.fchmod(fd, os.stat(path).st_mode & 0o7777)  # Keep the replaced file's mode
+            except FileNotFoundError:
+                pass
+            for part in data if isinstance(data, list) else [data]:
+                view = memoryview(part)
+                while view:
+                    view = view[os.write(fd, view):]
+            if durability != DURABILITY_NONE:
+                _sync_data(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    if durability == DURABILITY_DIRSYNC:
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+@contextmanager
+def _mapped(path: Path):
+    """Read-only buffer over a file's bytes (mmap cannot map empty files)"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def _line_offsets(buf, count: int) -> List[int]:
+    """Byte offsets of the starts of lines 1..count+1 (clamped to EOF)"""
+    offsets = [0]
+    size = len(buf)
+    while len(offsets) <= count:
+        pos = offsets[-1]
+        newline = buf.find(b"\n", pos) if pos < size else -1
+        offsets.append(size if newline < 0 else newline + 1)
+    return offsets
+
+
+def _replace_parts(buf, first: int, last: int, new: bytes) -> List:
+    """Parts of the file with lines first..last (1-based, inclusive) replaced
+
+    Every line in the range must exist; the only range past the end is the
+    empty one at line_count + 1 (last = first - 1), which appends.
+    """
+    if first < 1 or last < first - 1:
+        raise PatchError(f"invalid line range {first}-{last}")
+    offsets = _line_offsets(buf, last)
+    # Line n exists when it starts before EOF (offsets clamp to EOF past the
+    # end); last >= first - 1, so this also rules out a first past line_count + 1
+    if last > 0 and offsets[last - 1] >= len(buf):
+        line_count = sum(1 for start in offsets[:-1] if start < len(buf))
+        raise PatchError(f"line range {first}-{last} is past the end of the file ({line_count} lines)")
+    start, end = offsets[first - 1], offsets[last]
+    if first > 1 and start == len(buf) and start > 0 and buf[start - 1:start] != b"\n":
+        new = b"\n" + new  # Appending past a final line that lacks a newline
+    if new and not new.endswith(b"\n") and end < len(buf):
+        new += b"\n"  # Keep the following line on its own line
+    view = memoryview(buf)
+    return [view[:start], new, view[end:]]
+
+
+class Hunk(NamedTuple):
+    old_start: int
+    old_count: int
+    lines: List[Tuple[str, str]]  # (' ', '-' or '+', text without newline)
+    new_eof_newline: bool
+
+
+def parse_unified_diff(diff: str) -> List[Hunk]:
+    """Parse the hunks of a single-file unified diff"""
+    hunks = []
+    # Split on "\n" alone, as files are: splitlines() would also break lines
+    # on \x0c, \x1c-\x1e, \x85, \u2028 and others that can be file content.
+    # A "\r" left on a line is matched like the file's own (see _patch_parts)
+    lines = diff.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    i = 0
+    while i < len(lines):
+        match = HUNK_RE.match(lines[i])
+        i += 1
+        if not match:
+            continue  # ---/+++ headers and other preamble
+        old_count = int(match.group(2)) if match.group(2) is not None else 1
+        new_count = int(match.group(4)) if match.group(4) is not None else 1
+        body = []
+        new_eof_newline = True
+        seen_old = seen_new = 0
+        while i < len(lines) and (seen_old < old_count or seen_new < new_count
+                                  or lines[i].startswith("\\")):
+            line = lines[i]
+            i += 1
+            if line.startswith("\\"):
+                # "\ No newline at end of file" applies to the preceding line
+                if body and body[-1][0] in " +":
+                    new_eof_newline = False
+                continue
+            op, text = (line[0], line[1:]) if line else (" ", "")
+            if op not in " -+":
+                raise PatchError(f"unexpected diff line: {line!r}")
+            body.append((op, text))
+            seen_old += op in " -"
+            seen_new += op in " +"
+        if seen_old != old_count or seen_new != new_count:
+            raise PatchError(f"truncated hunk: {match.group(0)}")
+        hunks.append(Hunk(int(match.group(1)), old_count, body, new_eof_newline))
+    if not hunks:
+        raise PatchError("no hunks found in diff")
+    return hunks
+
+
+def _patch_parts(buf, hunks: List[Hunk]) -> List:
+    """Parts of the patched file, copying untouched regions straight from buf"""
+    last_line = max(h.old_start + h.old_count for h in hunks)
+    offsets = _line_offsets(buf, last_line)
+    segments = []  # (start, end) byte ranges of buf, or new bytes
+    cursor = 0  # Next unconsumed line (0-based)
+    for hunk in hunks:
+        # A pure insertion (-N,0) goes after line N
+        index = hunk.old_start if hunk.old_count == 0 else hunk.old_start - 1
+        if index < cursor:
+            raise PatchError(f"overlapping or out-of-order hunk at line {hunk.old_start}")
+        segments.append((offsets[cursor], offsets[index]))
+
+        line = index
+        new_lines = []
+        for op, text in hunk.lines:
+            if new_lines and not new_lines[-1].endswith(b"\n"):
+                new_lines[-1] += b"\n"  # Old last line gains lines after it
+            if op in " -":
+                raw = buf[offsets[line]:offsets[line + 1]]
+                if not raw or raw.rstrip(b"\n").rstrip(b"\r") != text.rstrip("\r").encode("utf-8"):
+                    raise PatchError(f"hunk does not apply at line {line + 1}")
+                line += 1
+                if op == " ":
+                    new_lines.append(raw)
+            else:
+                new_lines.append(text.encode("utf-8") + b"\n")
+        if not hunk.new_eof_newline and new_lines:
+            new_lines[-1] = new_lines[-1].rstrip(b"\n").rstrip(b"\r")
+        segments.append(b"".join(new_lines))
+        cursor = line
+    segments.append((offsets[cursor], len(buf)))
+
+    # Only slice views once the whole diff is known to apply
+    view = memoryview(buf)
+    return [view[seg[0]:seg[1]] if isinstance(seg, tuple) else seg for seg in segments]
+
+
+class _PendingWrite:
+    def __init__(self):
+        self.data = b""
+        self.writer = 0
+        self.error: Optional[BaseException] = None
+        self.flush = threading.Event()  # Ends the window early
+        self.done = threading.Event()
+
+
+class ContextWriter:
+    """Atomic writer that can coalesce bursts of writes to the same path
+
+    With a coalescing window, the first writer to a path waits out the window
+    while later writers replace the pending data (last writer wins). One
+    atomic write, and one sync, then lands for the whole burst, and every
+    caller returns once it is on disk.
+
+    Waiting callers hold their threads, which the server shares with read
+    tools, so at most max_waiting wait out windows at once. A writer beyond
+    that ends its path's window early, or writes straight away if its path
+    has none open.
+    """
+
+    def __init__(self, durability: str = DURABILITY_NONE, coalesce_window: float = 0.0,
+                 max_waiting: int = 2):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.durability = durability
+        self.coalesce_window = coalesce_window
+        self.max_waiting = max_waiting
+        self._lock = threading.Lock()
+        self._pending: Dict[Path, _PendingWrite] = {}
+        self._writers = 0
+        self._waiting = 0
+        # Striped locks serialize writers and edits of the same path
+        self._path_locks = [threading.Lock() for _ in range(64)]
+        self.writes = 0
+        self.coalesced = 0
+
+    def _wrote(self):
+        with self._lock:
+            self.writes += 1
+
+    def _path_lock(self, path: Path) -> threading.Lock:
+        return self._path_locks[hash(path) % len(self._path_locks)]
+
+    def write(self, path: Path, data: bytes) -> bool:
+        """Write data to path; False if a later write in the same window superseded it"""
+        with self._lock:
+            pending = self._pending.get(path)
+            immediate = self.coalesce_window <= 0 or (pending is None and self._waiting >= self.max_waiting)
+            if not immediate:
+                self._writers += 1
+                writer = self._writers
+                leader = pending is None
+                if leader:
+                    pending = self._pending[path] = _PendingWrite()
+                else:
+                    self.coalesced += 1
+                    if self._waiting >= self.max_waiting:
+                        pending.flush.set()
+                pending.data = data
+                pending.writer = writer
+                self._waiting += 1
+
+        if immediate:
+            with self._path_lock(path):
+                atomic_write(path, data, self.durability)
+            self._wrote()
+            return True
+
+        try:
+            if leader:
+                pending.flush.wait(self.coalesce_window)
+                try:
+                    # Closed under the path lock, so a writer arriving after
+                    # this either joined the burst or writes after it
+                    with self._path_lock(path):
+                        with self._lock:
+                            del self._pending[path]
+                        atomic_write(path, pending.data, self.durability)
+                    self._wrote()
+                except BaseException as e:
+                    pending.error = e
+                finally:
+                    pending.done.set()
+            else:
+                pending.done.wait()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.writer == writer
+
+    # Edits: small changes without shipping the whole file through the client
+
+    def _check(self, path: Path, if_match: Optional[str]):
+        if if_match is not None:
+            etag = current_etag(path)
+            if etag != if_match:
+                raise PreconditionFailed(etag)
+
+    def append(self, path: Path, data: bytes, if_match: Optional[str] = None) -> str:
+        """Append data in place (O_APPEND, no rewrite); returns the new etag"""
+        with self._path_lock(path):
+            self._check(path, if_match)
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                if self.durability != DURABILITY_NONE:
+                    _sync_data(fd)
+                etag = etag_for(os.fstat(fd))
+            finally:
+                os.close(fd)
+        self._wrote()
+        return etag
+
+    def replace_lines(self, path: Path, start_line: int, end_line: int, data: bytes,
+                      if_match: Optional[str] = None) -> str:
+        """Replace lines start_line..end_line (1-based, inclusive); returns the new etag
+
+        end_line = start_line - 1 inserts before start_line without removing anything.
+        """
+        with self._path_lock(path):
+            self._check(path, if_match)
+            with _mapped(path) as buf:
+                atomic_write(path, _replace_parts(buf, start_line, end_line, data), self.durability)
+            etag = current_etag(path)
+        self._wrote()
+        return etag
+
+    def patch(self, path: Path, diff: str, if_match: Optional[str] = None) -> str:
+        """Apply a unified diff (no fuzz); returns the new etag"""
+        hunks = parse_unified_diff(diff)
+        with self._path_lock(path):
+            self._check(path, if_match)
+            with _mapped(path) as buf:
+                atomic_write(path, _patch_parts(buf, hunks), self.durability)
+            etag = current_etag(path)
+        self._wrote()
+        return etag
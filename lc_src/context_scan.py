@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+ClodForest context scanner
+Streaming, early-exit matcher used when the search index can't answer a query
+(regex searches, stale index) and to verify index candidates
+"""
+
+import codecs
+import os
+import pickle
+import queue
+import re
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+# Search modes
+MODE_SUBSTRING = "substring"  # Case-insensitive substring, the original behaviour
+MODE_WORD = "word"  # Query must start and end on word boundaries
+MODE_REGEX = "regex"  # Case-insensitive Python regex; always answered by scanning
+SEARCH_MODES = (MODE_SUBSTRING, MODE_WORD, MODE_REGEX)
+
+CHUNK_BYTES = 64 * 1024
+SNIFF_BYTES = 8192  # A NUL byte in the first SNIFF_BYTES marks a file as binary
+REGEX_OVERLAP = 4096  # Regex matches longer than this may be missed across chunk boundaries
+DEFAULT_MAX_FILE_BYTES = 64 * 1024 * 1024
+SNIPPET_WIDTH = 160
+
+# Below this many files a scan stays in-process; process start-up would dominate
+PARALLEL_MIN_FILES = 64
+# Default scan worker processes; scans are I/O-heavy, so more cores help little
+DEFAULT_SCAN_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class ScanResult(NamedTuple):
+    matches: int  # Matches counted before stopping (capped by max_matches)
+    size: int  # File size in bytes
+    snippets: List[Tuple[int, str]]  # (line number, excerpt with **highlighted** match)
+
+
+def compile_query(query: str, mode: str = MODE_SUBSTRING) -> Pattern:
+    """Regex equivalent of a query in the given mode (raises re.error for bad regexes)"""
+    if mode == MODE_REGEX:
+        return re.compile(query, re.IGNORECASE | re.MULTILINE)
+    pattern = re.escape(query)
+    if mode == MODE_WORD:
+        pattern = rf"(?<!\w){pattern}(?!\w)"
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def overlap_for(query: str, mode: str) -> int:
+    """Characters carried between chunks so no match is split by a boundary"""
+    if mode == MODE_REGEX:
+        return REGEX_OVERLAP
+    return len(query) + 2  # Room for the whole match plus one lookaround character each side
+
+
+def _excerpt(text: str, match: "re.Match", text_is_partial: bool) -> str:
+    line_start = text.rfind("\n", 0, match.start()) + 1
+    line_end = text.find("\n", match.end())
+    line_end = len(text) if line_end < 0 else line_end
+    start = max(line_start, match.start() - SNIPPET_WIDTH // 2)
+    end = min(line_end, max(match.end(), start + SNIPPET_WIDTH))
+    clipped_left = start > line_start or (line_start == 0 and text_is_partial)
+    excerpt = (("..." if clipped_left else "") +
+               text[start:match.start()] + "**" + match.group() + "**" +
+               text[match.end():end] + ("..." if end < line_end else ""))
+    return excerpt.strip()
+
+
+def stream_scan(path: Path, matcher: Pattern, overlap: int, max_matches: int = 1,
+                max_snippets: int = 0, max_bytes: int = DEFAULT_MAX_FILE_BYTES,
+                chunk_bytes: int = CHUNK_BYTES) -> Optional[ScanResult]:
+    """Scan a file in fixed-size chunks, stopping as soon as enough has been found
+
+    Stops once max_matches matches are counted and max_snippets matching lines
+    collected, so a yes/no check reads only up to the first hit. Only one chunk
+    plus overlap is held in memory. Returns None for binary or undecodable files.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    matches = 0
+    found: List[Tuple[int, str]] = []
+    last_line = 0
+    text = ""
+    base = 0  # Absolute character offset of text[0]
+    newlines_before = 0  # Newlines in the characters already dropped from text
+    counted_to = 0  # Matches ending at or before this offset have been considered
+    read = 0
+
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            while True:
+                chunk = f.read(min(chunk_bytes, max_bytes - read))
+                if read == 0 and b"\0" in chunk[:SNIFF_BYTES]:
+                    return None
+                read += len(chunk)
+                final = not chunk or read >= max_bytes
+                # A capped read may end mid-character; drop it rather than fail
+                text += decoder.decode(chunk, final=final and read < max_bytes)
+
+                # Near the end of a chunk a lookahead can't yet see the next character
+                settled = base + len(text) if final else base + len(text) - 1
+                for match in matcher.finditer(text):
+                    start, end = base + match.start(), base + match.end()
+                    if end == start or end <= counted_to or end > settled:
+                        continue
+                    matches += 1
+                    if len(found) < max_snippets:
+                        line_no = newlines_before + text.count("\n", 0, match.start()) + 1
+                        if line_no != last_line:
+                            last_line = line_no
+                            found.append((line_no, _excerpt(text, match, base > 0)))
+                    if matches >= max_matches and len(found) >= max_snippets:
+                        return ScanResult(matches, size, found)
+                counted_to = settled
+
+                if final:
+                    break
+                dropped = text[:-overlap]
+                newlines_before += dropped.count("\n")
+                base += len(dropped)
+                text = text[-overlap:]
+    except (IOError, OSError, UnicodeDecodeError):
+        return None  # Skip unreadable files
+    return ScanResult(matches, size, found)
+
+
+def _scan_batch(root: str, paths: List[str], pattern: str, flags: int, overlap: int,
+                max_matches: int, max_bytes: int) -> Dict[str, Tuple[int, int]]:
+    """Worker-process entry point: scan paths, return (matches, size) for those that match"""
+    matcher = re.compile(pattern, flags)
+    results = {}
+    for rel_path in paths:
+        result = stream_scan(Path(root) / rel_path, matcher, overlap, max_matches, 0, max_bytes)
+        if result and result.matches:
+            results[rel_path] = (result.matches, result.size)
+    return results
+
+
+class ScanWorkerError(RuntimeError):
+    """A scan worker answered with an exception instead of results; the pool itself is fine"""
+
+
+class ScanPool:
+    """Worker processes running only this module, for scans too large for one core
+
+    multiprocessing's spawn and forkserver children re-import the parent's
+    main script, which for the server means a second copy of everything it
+    sets up at import. These workers are plain `python context_scan.py
+    --serve` processes instead, fed pickled batches over their pipes. They
+    start on the first scan that uses them; one that dies breaks the pool
+    (BrokenProcessPool), as with ProcessPoolExecutor. A batch that raises
+    in a worker comes back as ScanWorkerError.
+    """
+
+    def __init__(self, workers: int = DEFAULT_SCAN_WORKERS):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._idle: "queue.Queue[subprocess.Popen]" = queue.Queue()
+        self._processes: List[subprocess.Popen] = []
+        self._dispatch: Optional[ThreadPoolExecutor] = None
+        self._broken = False
+
+    def _start(self):
+        with self._lock:
+            if self._broken:
+                raise BrokenProcessPool("scan worker exited")
+            if self._dispatch is not None:
+                return
+            for _ in range(self.workers):
+                process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve"],
+                                           stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                self._processes.append(process)
+                self._idle.put(process)
+            self._dispatch = ThreadPoolExecutor(self.workers, thread_name_prefix="scan-dispatch")
+
+    def _call(self, args: tuple) -> Dict[str, Tuple[int, int]]:
+        process = self._idle.get()
+        try:
+            pickle.dump(args, process.stdin, pickle.HIGHEST_PROTOCOL)
+            process.stdin.flush()
+            ok, result = pickle.load(process.stdout)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            self._broken = True
+            raise BrokenProcessPool("scan worker exited") from e
+        finally:
+            self._idle.put(process)
+        if not ok:
+            raise ScanWorkerError(f"scan worker failed: {result}")
+        return result
+
+    def map(self, batches: List[tuple]) -> List[Dict[str, Tuple[int, int]]]:
+        """_scan_batch over each argument tuple, spread across the workers"""
+        self._start()
+        return list(self._dispatch.map(self._call, batches))
+
+    def close(self):
+        with self._lock:
+            processes, self._processes = self._processes, []
+            if self._dispatch is not None:
+                self._dispatch.shutdown(wait=False, cancel_futures=True)
+                self._dispatch = None
+        for process in processes:
+            try:
+                process.stdin.close()  # EOF tells the worker to exit
+                process.wait(timeout=1)
+            except (OSError, subprocess.TimeoutExpired):
+                process.kill()
+
+
+def serve(stdin=None, stdout=None):
+    """Worker loop: read _scan_batch argument tuples, answer (ok, result) until EOF"""
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    sys.stdout = sys.stderr  # Stray prints must not corrupt the pipe
+    while True:
+        try:
+            args = pickle.load(stdin)
+        except EOFError:
+            return
+        try:
+            reply = (True, _scan_batch(*args))
+        except Exception as e:
+            reply = (False, repr(e))
+        pickle.dump(reply, stdout, pickle.HIGHEST_PROTOCOL)
+        stdout.flush()
+
+
+def scan_paths(root: Path, paths: List[str], matcher: Pattern, overlap: int, max_matches: int = 1,
+               max_bytes: int = DEFAULT_MAX_FILE_BYTES,
+               pool: Optional[ScanPool] = None) -> Dict[str, Tuple[int, int]]:
+    """Map each matching path to (matches, size), spreading large scans across a ScanPool"""
+    workers = pool.workers if pool else 1
+    if pool is None or len(paths) < PARALLEL_MIN_FILES or workers < 2:
+        return _scan_batch(str(root), paths, matcher.pattern, matcher.flags, overlap, max_matches, max_bytes)
+
+    # Several batches per worker keeps cores busy when file sizes are uneven
+    batch_count = workers * 4
+    batches = [(str(root), paths[i::batch_count], matcher.pattern, matcher.flags, overlap, max_matches, max_bytes)
+               for i in range(batch_count)]
+    results = {}
+    for batch_result in pool.map(batches):
+        results.update(batch_result)
+    return results
+
+
+if __name__ == "__main__" and sys.argv[1:] == ["--serve"]:
+    serve()
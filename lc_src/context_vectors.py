@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+ClodForest context vector index
+Chunked embeddings of CONTEXT_DIR in a memory-mapped float32 matrix, for
+offline, CPU-only semantic search
+"""
+
+import fnmatch
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from context_io import is_temp_name
+
+log = logging.getLogger("clodforest.app")
+
+DEFAULT_DIM = 512
+CHUNK_CHARS = 1200  # Chunks close at the first paragraph or line break past this size
+PREVIEW_CHARS = 200
+DEFAULT_MAX_EMBED_BYTES = 8 * 1024 * 1024
+SEARCH_BLOCK_ROWS = 65536  # Rows scored per matrix product, bounding temporary memory
+
+WORD_RE = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the "
+    "this to was were will with".split())
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    row INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    start_line INTEGER NOT NULL,
+    end_line INTEGER NOT NULL,
+    preview TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_path ON chunks(path);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class HashingEmbedder:
+    """Feature-hashed bag of words and character trigrams
+
+    Needs no model files, so it works offline anywhere. Trigrams let
+    inflections and compounds ("index", "reindexing") share dimensions.
+    """
+
+    def __init__(self, dim: int = DEFAULT_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+        self._features: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _token_features(self, token: str) -> Tuple[np.ndarray, np.ndarray]:
+        features = self._features.get(token)
+        if features is None:
+            padded = f"<{token}>"
+            grams = [(token, 1.0)] + [(padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+            hashes = [zlib.crc32(gram.encode("utf-8")) for gram, _ in grams]
+            indices = np.array([h % self.dim for h in hashes], dtype=np.intp)
+            # The sign bit keeps colliding features from only ever adding up
+            weights = np.array([w if h & 0x80000000 else -w for h, (_, w) in zip(hashes, grams)],
+                               dtype=np.float32)
+            if len(self._features) > 200_000:
+                self._features.clear()
+            features = self._features[token] = (indices, weights)
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(token for token in WORD_RE.findall(text.lower()) if token not in STOPWORDS)
+            for token, count in counts.items():
+                indices, weights = self._token_features(token)
+                np.add.at(vectors[row], indices, weights * (1 + math.log(count)))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class ModelEmbedder:
+    """sentence-transformers model loaded from a local directory, never downloaded"""
+
+    def __init__(self, model_path: str):
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(model_path, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+        self.name = f"model-{Path(model_path).name}-{self.dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self._model.encode(texts, batch_size=32, convert_to_numpy=True,
+                                  normalize_embeddings=True).astype(np.float32)
+
+
+def make_embedder(model_path: Optional[str] = None):
+    """A local model when one is configured and loads, else the hashing embedder"""
+    if model_path:
+        try:
+            return ModelEmbedder(model_path)
+        except Exception as e:
+            log.warning("embedding model %s unavailable, using hashing embedder: %s", model_path, e)
+    return HashingEmbedder()
+
+
+class Chunk(NamedTuple):
+    start_line: int
+    end_line: int
+    text: str
+
+
+def chunk_text(text: str, chunk_chars: int = CHUNK_CHARS) -> List[Chunk]:
+    """Split text into runs of whole lines of about chunk_chars, preferring paragraph breaks"""
+    chunks = []
+    lines: List[str] = []
+    size = 0
+    start_line = 1
+    for line_no, line in enumerate(text.splitlines(), 1):
+        if not lines:
+            start_line = line_no
+        lines.append(line)
+        size += len(line) + 1
+        paragraph_end = not line.strip() and size >= chunk_chars // 2
+        if size >= chunk_chars or paragraph_end:
+            chunks.append(Chunk(start_line, line_no, "\n".join(lines)))
+            lines, size = [], 0
+    if lines:
+        chunks.append(Chunk(start_line, start_line + len(lines) - 1, "\n".join(lines)))
+    return [chunk for chunk in chunks if chunk.text.strip()]
+
+
+class VectorHit(NamedTuple):
+    path: str
+    start_line: int
+    end_line: int
+    score: float  # Cosine similarity
+    preview: str
+
+
+class VectorIndex:
+    """Chunk embeddings for a context directory
+
+    Vectors live in one float32 matrix memory-mapped from disk, one row per
+    chunk; SQLite maps rows to files and line ranges. Rows freed by edits
+    are reused, and the matrix doubles in size when full.
+    """
+
+    def __init__(self, root: Path, directory: Path, embedder,
+                 max_embed_bytes: int = DEFAULT_MAX_EMBED_BYTES):
+        self.root = root
+        self.directory = directory
+        self.embedder = embedder
+        self.max_embed_bytes = max_embed_bytes
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._matrix: Optional[np.memmap] = None
+        self._valid = np.zeros(0, dtype=bool)
+        self._free: List[int] = []
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._refreshed = False
+        self._leader = None
+        self._data_version = None
+
+    # Storage
+
+    @property
+    def _matrix_path(self) -> Path:
+        return self.directory / "vectors.f32"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+        self.directory.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.directory / "vectors.db"), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+
+        writer = self._leading()
+        row = conn.execute("SELECT value FROM meta WHERE key = 'embedder'").fetchone()
+        compatible = row is not None and row[0] == self.embedder.name
+        if not compatible and writer:
+            # Vectors from another embedder aren't comparable; start over
+            conn.execute("DELETE FROM chunks")
+            conn.execute("DELETE FROM documents")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('embedder', ?)",
+                         (self.embedder.name,))
+            conn.commit()
+            self._matrix_path.unlink(missing_ok=True)
+            compatible = True
+        self._conn = conn
+
+        capacity = 0
+        if compatible and self._matrix_path.exists():
+            capacity = self._matrix_path.stat().st_size // (4 * self.embedder.dim)
+        self._map(capacity, writer)
+        self._valid = np.zeros(capacity, dtype=bool)
+        used = [row for (row,) in conn.execute("SELECT row FROM chunks") if row < capacity]
+        self._valid[used] = True
+        if writer:
+            # Rows past the end were written but never flushed before a crash
+            conn.execute("DELETE FROM chunks WHERE row >= ?", (capacity,))
+            conn.commit()
+        self._free = sorted(np.flatnonzero(~self._valid).tolist(), reverse=True)
+        return conn
+
+    def _map(self, capacity: int, writer: bool = True):
+        if self._matrix is not None:
+            if writer:
+                self._matrix.flush()
+            self._matrix = None
+        if writer:
+            with open(self._matrix_path, "ab") as f:
+                f.truncate(capacity * 4 * self.embedder.dim)  # Zero-filled when growing
+        self._matrix = (np.memmap(self._matrix_path, dtype=np.float32, mode="r+" if writer else "r",
+                                  shape=(capacity, self.embedder.dim)) if capacity else None)
+
+    def _allocate(self, count: int) -> List[int]:
+        if len(self._free) < count:
+            capacity = len(self._valid)
+            new_capacity = max(1024, capacity * 2, capacity + count)
+            self._map(new_capacity)
+            self._valid = np.concatenate([self._valid, np.zeros(new_capacity - capacity, dtype=bool)])
+            self._free = list(range(new_capacity - 1, capacity - 1, -1)) + self._free
+        return [self._free.pop() for _ in range(count)]
+
+    def close(self):
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+                self._matrix = None
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # Freshness
+
+    def follow(self, watcher):
+        """Re-embed files a ContextWatcher reports changed"""
+        watcher.subscribe(self.apply_changes)
+
+    def follow_leader(self, leader):
+        """Share the index between workers: only the LeaderLock holder writes it
+
+        Row allocation lives in the writer's memory, so there must be exactly
+        one; other workers reload the matrix when they see it has changed.
+        """
+        self._leader = leader
+        leader.on_acquire(self._take_over)
+
+    def _leading(self) -> bool:
+        return self._leader is None or self._leader.held
+
+    def _take_over(self):
+        with self._lock:
+            self._reload()  # Pick up whatever the previous leader wrote
+        self.start()
+
+    def _reload(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._matrix is not None and self._matrix.mode == "r+":
+            self._matrix.flush()
+        self._matrix = None
+        self._connect()
+
+    def _sync_with_leader(self):
+        """Reload if the leader has committed changes since we last looked"""
+        data_version = self._connect().execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._reload()
+            self._data_version = self._connect().execute("PRAGMA data_version").fetchone()[0]
+
+    @property
+    def building(self) -> bool:
+        return not self._refreshed and self._leading()
+
+    def start(self):
+        """Reconcile with disk in a background thread"""
+        if not self._leading():
+            return
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(
+                target=self.refresh, name="context-vectors-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def refresh(self) -> Dict[str, int]:
+        """Embed files added or changed since the last run and drop removed ones"""
+        stats = self._reconcile("")
+        self._refreshed = True
+        return stats
+
+    def _reconcile(self, prefix: str) -> Dict[str, int]:
+        base = self.root / prefix if prefix else self.root
+        on_disk = {}
+        if base.is_dir():
+            for item in base.rglob("*"):
+                try:
+                    if item.is_file() and not is_temp_name(item.name):
+                        st = item.stat()
+                        on_disk[item.relative_to(self.root).as_posix()] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+        elif base.is_file():
+            st = base.stat()
+            on_disk[prefix] = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            conn = self._connect()
+            if prefix:
+                rows = conn.execute(
+                    "SELECT path, mtime_ns, size FROM documents "
+                    "WHERE path = ? OR (path >= ? AND path < ?)",
+                    (prefix, prefix + "/", prefix + "0"))
+            else:
+                rows = conn.execute("SELECT path, mtime_ns, size FROM documents")
+            known = {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+        removed = [path for path in known if path not in on_disk]
+        changed = [path for path, sig in on_disk.items() if known.get(path) != sig]
+        for path in removed:
+            self.remove_path(path)
+        for path in changed:
+            self.update_path(path)
+        return {"files": len(on_disk), "changed": len(changed), "removed": len(removed)}
+
+    def apply_changes(self, paths: Optional[Set[str]]):
+        """Reprocess paths reported by a ContextWatcher; None means rescan everything"""
+        if not self._leading():
+            return
+        if paths is None:
+            self.refresh()
+            return
+        for rel_path in paths:
+            if (self.root / rel_path).is_file():
+                self.update_path(rel_path)
+            else:
+                self._reconcile(rel_path)
+
+    # Incremental updates
+
+    def update_path(self, rel_path: str):
+        """(Re)embed one file, identified by its path relative to root"""
+        if not self._leading():
+            return  # The leader's watcher will pick the change up
+        full_path = self.root / rel_path
+        try:
+            st = full_path.stat()
+        except OSError:
+            self.remove_path(rel_path)
+            return
+
+        with self._lock:
+            known = self._connect().execute(
+                "SELECT mtime_ns, size FROM documents WHERE path = ?", (rel_path,)).fetchone()
+        if known == (st.st_mtime_ns, st.st_size):
+            return
+
+        chunks: List[Chunk] = []
+        if st.st_size <= self.max_embed_bytes:
+            try:
+                chunks = chunk_text(full_path.read_text(encoding="utf-8"))
+            except (IOError, OSError, UnicodeDecodeError):
+                pass  # Recorded with no chunks; retried when the file changes
+        # Embedding is the slow part, so it runs without holding the lock
+        vectors = self.embedder.embed([chunk.text for chunk in chunks]) if chunks else None
+
+        with self._lock:
+            conn = self._connect()
+            self._release(conn, rel_path)
+            if chunks:
+                rows = self._allocate(len(chunks))
+                self._matrix[rows] = vectors
+                self._matrix.flush()
+                self._valid[rows] = True
+                conn.executemany(
+                    "INSERT INTO chunks (row, path, start_line, end_line, preview) VALUES (?, ?, ?, ?, ?)",
+                    ((row, rel_path, chunk.start_line, chunk.end_line,
+                      " ".join(chunk.text.split())[:PREVIEW_CHARS])
+                     for row, chunk in zip(rows, chunks)))
+            conn.execute("INSERT OR REPLACE INTO documents (path, mtime_ns, size) VALUES (?, ?, ?)",
+                         (rel_path, st.st_mtime_ns, st.st_size))
+            conn.commit()
+
+    def remove_path(self, rel_path: str):
+        with self._lock:
+            conn = self._connect()
+            self._release(conn, rel_path)
+            conn.execute("DELETE FROM documents WHERE path = ?", (rel_path,))
+            conn.commit()
+
+    def _release(self, conn: sqlite3.Connection, rel_path: str):
+        rows = [row for (row,) in conn.execute("SELECT row FROM chunks WHERE path = ?", (rel_path,))]
+        if rows:
+            conn.execute("DELETE FROM chunks WHERE path = ?", (rel_path,))
+            self._valid[rows] = False
+            self._free.extend(rows)
+
+    # Queries
+
+    def search(self, query: str, path_glob: Optional[str] = None, limit: int = 10) -> List[VectorHit]:
+        """Chunks most similar to query by cosine similarity, best first"""
+        if not self._leading():
+            with self._lock:
+                self._sync_with_leader()
+        elif not self._refreshed:
+            self.start()
+        query_vector = self.embedder.embed([query])[0]
+        if not query_vector.any():
+            return []
+
+        with self._lock:
+            conn = self._connect()
+            if self._matrix is None:
+                return []
+            if path_glob:
+                rows = np.array([row for row, path in conn.execute("SELECT row, path FROM chunks")
+                                 if fnmatch.fnmatchcase(path, path_glob)], dtype=np.intp)
+            else:
+                rows = np.flatnonzero(self._valid)
+
+            # Score in blocks and keep only each block's top candidates
+            best_rows: List[np.ndarray] = []
+            best_scores: List[np.ndarray] = []
+            for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+                block = np.sort(rows[start:start + SEARCH_BLOCK_ROWS])
+                scores = self._matrix[block] @ query_vector
+                if len(scores) > limit:
+                    top = np.argpartition(-scores, limit)[:limit]
+                    block, scores = block[top], scores[top]
+                best_rows.append(block)
+                best_scores.append(scores)
+            if not best_rows:
+                return []
+            candidates = np.concatenate(best_rows)
+            scores = np.concatenate(best_scores)
+            order = np.argsort(-scores, kind="stable")[:limit]
+
+            hits = []
+            for i in order:
+                row = conn.execute("SELECT path, start_line, end_line, preview FROM chunks WHERE row = ?",
+                                   (int(candidates[i]),)).fetchone()
+                if row and scores[i] > 0:
+                    hits.append(VectorHit(row[0], row[1], row[2], float(scores[i]), row[3]))
+        return hits
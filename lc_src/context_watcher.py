@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+ClodForest context directory watcher
+Feeds debounced batches of changed paths under CONTEXT_DIR to subscribers
+(search index, listing cache, read cache) using inotify, or polling elsewhere
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from context_io import is_temp_name
+
+# A subscriber receives the changed paths (relative to root), or None when the
+# watcher lost track (queue overflow, huge burst) and everything must be rescanned
+Subscriber = Callable[[Optional[Set[str]]], None]
+
+# inotify(7) constants
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII")
+
+log = logging.getLogger("clodforest.app")
+
+
+class ContextWatcher:
+    """Background watcher that batches filesystem changes under a directory"""
+
+    def __init__(self, root: Path, backend: str = "auto", debounce: float = 0.5,
+                 max_delay: float = 5.0, poll_interval: float = 2.0,
+                 rescan_threshold: int = 2000):
+        self.root = root
+        self.requested_backend = backend
+        self.backend: Optional[str] = None
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.rescan_threshold = rescan_threshold
+        self._subscribers: List[Subscriber] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # Pending batch
+        self._pending: Set[str] = set()
+        self._overflowed = False
+        self._first_event = 0.0
+        self._last_event = 0.0
+
+        # inotify state
+        self._libc = None
+        self._fd = -1
+        self._watches: Dict[int, str] = {}
+
+    def subscribe(self, callback: Subscriber):
+        self._subscribers.append(callback)
+
+    @property
+    def healthy(self) -> bool:
+        """True while changes are being observed, so caches may trust themselves"""
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def start(self):
+        if self.requested_backend == "off" or self.healthy:
+            return
+
+        self.backend = "poll"
+        if self.requested_backend in ("auto", "inotify"):
+            try:
+                self._init_inotify()
+                self.backend = "inotify"
+            except OSError as e:
+                log.warning("inotify unavailable, polling instead: %s", e)
+                self._close_inotify()
+
+        self._stop.clear()
+        target = self._run_inotify if self.backend == "inotify" else self._run_poll
+        self._thread = threading.Thread(target=target, name="context-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._close_inotify()
+
+    # Batching
+
+    def _record(self, rel_path: Optional[str]):
+        """Queue one change; None forces a full rescan"""
+        now = time.monotonic()
+        if not self._pending and not self._overflowed:
+            self._first_event = now
+        self._last_event = now
+        if rel_path is None or len(self._pending) >= self.rescan_threshold:
+            # Bursts like a git checkout are cheaper to reconcile in one walk
+            self._overflowed = True
+            self._pending.clear()
+        elif not self._overflowed:
+            self._pending.add(rel_path)
+
+    def _flush_due(self) -> bool:
+        if not self._pending and not self._overflowed:
+            return False
+        now = time.monotonic()
+        return now - self._last_event >= self.debounce or now - self._first_event >= self.max_delay
+
+    def _flush(self):
+        batch = None if self._overflowed else self._pending
+        self._pending = set()
+        self._overflowed = False
+        for callback in self._subscribers:
+            try:
+                callback(batch)
+            except Exception:
+                log.exception("context watcher subscriber failed")
+
+    # inotify backend (Linux)
+
+    def _init_inotify(self):
+        if not self.root.is_dir():
+            raise OSError(f"{self.root} does not exist")
+        libc_name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not supported on this platform")
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._libc = libc
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._fd = fd
+        self._watches = {}
+        self._add_tree("")
+
+    def _close_inotify(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+        self._fd = -1
+        self._watches = {}
+
+    def _add_tree(self, rel_dir: str) -> List[str]:
+        """Watch a directory and everything below it; return files already inside"""
+        files = []
+        base = self.root / rel_dir if rel_dir else self.root
+        for dirpath, dirnames, filenames in os.walk(base):
+            rel = os.path.relpath(dirpath, self.root)
+            rel = "" if rel == "." else Path(rel).as_posix()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"inotify_add_watch {dirpath}: {os.strerror(errno)}")
+            self._watches[wd] = rel
+            files.extend(f"{rel}/{name}" if rel else name for name in filenames if not is_temp_name(name))
+        return files
+
+    def _read_events(self) -> List[Tuple[int, int, str]]:
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def _handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            self._record(None)
+            return
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+
+        rel_dir = self._watches.get(wd)
+        if rel_dir is None:
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            if rel_dir == "":
+                self._record(None)  # The root itself went away
+            return  # Children are reported by the parent directory's watch
+
+        if not mask & IN_ISDIR and is_temp_name(name):
+            return  # Our own atomic writes; the rename into place is reported for the target
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            try:
+                for file_path in self._add_tree(rel_path):
+                    self._record(file_path)
+            except OSError:
+                self._record(None)  # Watch limit reached or dir vanished mid-walk
+        self._record(rel_path)
+
+    def _run_inotify(self):
+        while not self._stop.is_set():
+            timeout = self.debounce if (self._pending or self._overflowed) else 1.0
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+            if readable:
+                for wd, mask, name in self._read_events():
+                    self._handle_event(wd, mask, name)
+            if self._flush_due():
+                self._flush()
+
+    # Polling backend (portable fallback)
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                if is_temp_name(name):
+                    continue
+                full_path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    continue
+                rel = Path(os.path.relpath(full_path, self.root)).as_posix()
+                snapshot[rel] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def _run_poll(self):
+        previous = self._snapshot()
+        while not self._stop.wait(self.poll_interval):
+            current = self._snapshot()
+            for rel_path, signature in current.items():
+                if previous.get(rel_path) != signature:
+                    self._record(rel_path)
+            for rel_path in previous.keys() - current.keys():
+                self._record(rel_path)
+            previous = current
+            # One poll already spans a burst, so deliver without extra delay
+            if self._pending or self._overflowed:
+                self._flush()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+ClodForest HTTP gateway
+One pure-ASGI middleware that classifies the path, answers CORS preflights,
+checks bearer tokens and times the response in a single pass over the
+request headers, without wrapping the app in per-request tasks or streams
+"""
+
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Kinds of path policy
+PUBLIC = "public"  # No token needed
+BEARER = "bearer"  # Any valid token
+SCOPED = "scoped"  # A valid token granting every one of the policy's scopes
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class RoutePolicy(NamedTuple):
+    kind: str
+    scopes: int = 0  # Bitset of required scopes, as in a token's scope_bits
+
+
+class _RouteNode:
+    __slots__ = ("children", "policy")
+
+    def __init__(self):
+        self.children: Dict[str, "_RouteNode"] = {}
+        self.policy: Optional[RoutePolicy] = None
+
+
+class RouteTable:
+    """Path prefix -> policy, compiled once into a trie of path segments
+
+    A prefix covers itself and everything below it ("/mcp" covers "/mcp/"
+    and "/mcp/x" but not "/mcpx"); the longest matching prefix wins. A walk
+    visits at most as many segments as the deepest prefix in the table,
+    however long the path is. The few paths clients actually use are
+    remembered, so classifying them is one dict lookup; the memo stops
+    growing at memo_size, so random paths can't bloat it.
+    """
+
+    def __init__(self, policies: Dict[str, RoutePolicy], default: RoutePolicy = RoutePolicy(PUBLIC),
+                 memo_size: int = 1024):
+        self.default = default
+        self.memo_size = memo_size
+        self._memo: Dict[str, RoutePolicy] = {}
+        self._root = _RouteNode()
+        for prefix, policy in policies.items():
+            node = self._root
+            for segment in filter(None, prefix.split("/")):
+                node = node.children.setdefault(segment, _RouteNode())
+            node.policy = policy
+
+    def classify(self, path: str) -> RoutePolicy:
+        policy = self._memo.get(path)
+        if policy is None:
+            policy = self._walk(path)
+            if len(self._memo) < self.memo_size:
+                self._memo[path] = policy
+        return policy
+
+    def _walk(self, path: str) -> RoutePolicy:
+        node = self._root
+        policy = node.policy or self.default
+        start = 1
+        while node.children:
+            end = path.find("/", start)
+            node = node.children.get(path[start:] if end < 0 else path[start:end])
+            if node is None:
+                break
+            if node.policy is not None:
+                policy = node.policy
+            if end < 0:
+                break
+            start = end + 1
+        return policy
+
+
+class CorsPolicy:
+    """Which cross-origin callers may use the API; mirrors Starlette's CORSMiddleware
+
+    Header values are encoded once here, so a request only pays for a set
+    lookup on its Origin.
+    """
+
+    def __init__(self, allow_origins: Iterable[str], allow_methods: Iterable[str],
+                 allow_headers: Iterable[str] = ("*",), allow_credentials: bool = False,
+                 max_age: int = 600):
+        self.allow_origins = {origin.encode("latin-1") for origin in allow_origins}
+        self.allow_methods = {method.encode("latin-1") for method in allow_methods}
+        self.allow_all_headers = "*" in allow_headers
+        self.allow_headers = {header.lower().encode("latin-1") for header in allow_headers if header != "*"}
+        self._credentials = [(b"access-control-allow-credentials", b"true")] if allow_credentials else []
+        self._preflight = [
+            (b"access-control-allow-methods", b", ".join(sorted(self.allow_methods))),
+            (b"access-control-max-age", str(max_age).encode("latin-1")),
+        ] + self._credentials
+
+    def allows(self, origin: bytes) -> bool:
+        return origin in self.allow_origins
+
+    def response_headers(self, origin: bytes) -> Headers:
+        """Headers added to an ordinary response for an allowed origin"""
+        return [(b"access-control-allow-origin", origin), (b"vary", b"Origin")] + self._credentials
+
+    def preflight(self, origin: bytes, method: bytes, requested_headers: bytes) -> Tuple[int, Headers, bytes]:
+        if not self.allows(origin):
+            return 400, [(b"vary", b"Origin")], b"Disallowed CORS origin"
+        if method not in self.allow_methods:
+            return 400, [(b"vary", b"Origin")], b"Disallowed CORS method"
+        if requested_headers and not self.allow_all_headers:
+            names = {name.strip().lower() for name in requested_headers.split(b",")}
+            if not names <= self.allow_headers:
+                return 400, [(b"vary", b"Origin")], b"Disallowed CORS headers"
+        headers = [(b"access-control-allow-origin", origin), (b"vary", b"Origin")] + self._preflight
+        if requested_headers:
+            headers.append((b"access-control-allow-headers", requested_headers))
+        return 200, headers, b"OK"
+
+
+# Rejection reason -> (status, message)
+REJECTIONS = {
+    "no_bearer_token": (401, "Authorization header required"),
+    "invalid_token": (401, "Invalid or expired token"),
+    "insufficient_scope": (403, "Insufficient scope"),
+}
+
+
+class RequestInfo:
+    """What the gateway learned about a request, handed to on_complete"""
+
+    __slots__ = ("scope", "policy", "status", "duration", "content_length", "error", "auth",
+                 "user_agent")
+
+    def __init__(self, scope: Dict[str, Any], policy: RoutePolicy):
+        self.scope = scope
+        self.policy = policy
+        self.status = 500
+        self.duration = 0.0
+        self.content_length: Optional[str] = None
+        self.error: Optional[str] = None
+        self.auth: Optional[Dict[str, Any]] = None
+        self.user_agent: Optional[str] = None
+
+
+class GatewayMiddleware:
+    """Auth, CORS and timing for every HTTP request, as one ASGI layer
+
+    classify(path) returns the path's RoutePolicy. authenticate(token, info)
+    is awaited for the token's data (with its "scope_bits") or None, so
+    token lookups can leave the event loop; the data is stored in
+    scope["state"]["auth"] for the app.
+    reject(info, reason) is called before a 401 or 403 goes out and
+    on_complete(info) after the last body chunk, so streamed responses are
+    timed to their end.
+    """
+
+    def __init__(self, app, *, cors: CorsPolicy, classify: Callable[[str], RoutePolicy],
+                 authenticate: Callable[[str, RequestInfo], Awaitable[Optional[Dict[str, Any]]]],
+                 reject: Callable[[RequestInfo, str], None],
+                 on_complete: Callable[[RequestInfo], None]):
+        self.app = app
+        self.cors = cors
+        self.classify = classify
+        self.authenticate = authenticate
+        self.reject = reject
+        self.on_complete = on_complete
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        info = RequestInfo(scope, self.classify(scope["path"]))
+
+        # One pass over the raw headers picks out everything the gateway needs
+        authorization = origin = preflight_method = requested_headers = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                authorization = value
+            elif name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                preflight_method = value
+            elif name == b"access-control-request-headers":
+                requested_headers = value
+            elif name == b"user-agent":
+                info.user_agent = value.decode("latin-1")
+
+        cors_headers = self.cors.response_headers(origin) if origin and self.cors.allows(origin) else None
+
+        try:
+            if scope["method"] == "OPTIONS" and origin is not None and preflight_method is not None:
+                status, headers, body = self.cors.preflight(origin, preflight_method, requested_headers or b"")
+                await self._respond(send, info, status, headers, body, b"text/plain; charset=utf-8")
+                return
+
+            if info.policy.kind != PUBLIC:
+                reason = None
+                if authorization is None or not authorization.startswith(b"Bearer "):
+                    reason = "no_bearer_token"
+                else:
+                    info.auth = await self.authenticate(authorization[7:].decode("latin-1").strip(), info)
+                    if info.auth is None:
+                        reason = "invalid_token"
+                    elif info.policy.kind == SCOPED and info.policy.scopes & ~info.auth.get("scope_bits", 0):
+                        reason = "insufficient_scope"
+                if reason is not None:
+                    self.reject(info, reason)
+                    status, message = REJECTIONS[reason]
+                    await self._respond(send, info, status, cors_headers or [],
+                                        json.dumps({"error": message}).encode("utf-8"), b"application/json")
+                    return
+                scope.setdefault("state", {})["auth"] = info.auth
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    info.status = message["status"]
+                    headers = message.get("headers") or []
+                    for name, value in headers:
+                        if name == b"content-length":
+                            info.content_length = value.decode("latin-1")
+                            break
+                    if cors_headers:
+                        message["headers"] = list(headers) + cors_headers
+                await send(message)
+                if message["type"] == "http.response.body" and not message.get("more_body", False):
+                    info.duration = time.perf_counter() - start
+
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            info.status = 500
+            info.error = str(e)
+            raise
+        finally:
+            if not info.duration:
+                info.duration = time.perf_counter() - start
+            self.on_complete(info)
+
+    async def _respond(self, send, info: RequestInfo, status: int, headers: Headers, body: bytes,
+                       content_type: bytes):
+        info.status = status
+        info.content_length = str(len(body))
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type),
+                        (b"content-length", info.content_length.encode("latin-1"))] + headers,
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+ClodForest logging pipeline
+Log calls only enqueue the record; one writer thread serializes queued records
+to JSON lines, writes each file's batch with a single write() and rotates
+files by size, so no file I/O or serialization happens on the event loop
+"""
+
+import fcntl
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import orjson
+
+    def dumps(entry: Dict[str, Any]) -> bytes:
+        return orjson.dumps(entry, default=str, option=orjson.OPT_APPEND_NEWLINE)
+except ImportError:
+    # Formatted like orjson's output: compact separators, UTF-8 left unescaped,
+    # datetimes in ISO format. It is a few times slower, and NaN and infinity
+    # come out as bare tokens where orjson writes null
+    import json
+
+    def _default(value: Any) -> str:
+        return value.isoformat() if isinstance(value, datetime) else str(value)
+
+    def dumps(entry: Dict[str, Any]) -> bytes:
+        return (json.dumps(entry, default=_default, separators=(",", ":"), ensure_ascii=False)
+                + "\n").encode("utf-8")
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+DEFAULT_QUEUE_SIZE = 10000
+BATCH_MAX_RECORDS = 1024  # Records taken off the queue per write
+
+
+class Lazy:
+    """A log field computed only if the record is actually written"""
+
+    __slots__ = ("compute",)
+
+    def __init__(self, compute: Callable[[], Any]):
+        self.compute = compute
+
+
+lazy = Lazy
+
+
+def resolve_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value.compute() if isinstance(value, Lazy) else value for key, value in fields.items()}
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse e.g. "authentication_success=0.01,http_request=0" into {event: rate}"""
+    rates = {}
+    for setting in filter(None, spec.split(",")):
+        event, _, rate = setting.partition("=")
+        rates[event.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class LogSampler:
+    """Per-event sampling rates: 1 logs every occurrence, 0 none, 0.01 about one in a hundred"""
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None, default: float = 1.0):
+        self.rates = rates or {}
+        self.default = default
+
+    def sample(self, event: str) -> Optional[float]:
+        """The event's rate if this occurrence should be logged, else None"""
+        rate = self.rates.get(event, self.default)
+        if rate >= 1.0:
+            return rate
+        if rate <= 0.0 or random.random() >= rate:
+            return None
+        return rate
+
+
+def utc_timestamp(seconds: float) -> str:
+    """ISO 8601 in UTC with a Z suffix, e.g. 2026-01-02T03:04:05.678000Z"""
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def record_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    """The JSON fields for one record, including any extra_fields passed by the log_* helpers"""
+    entry = {
+        # Stamped when logged, not when written, so queueing doesn't skew times
+        "timestamp": utc_timestamp(record.created),
+        "level": record.levelname,
+        "logger": record.name,
+        "message": record.getMessage(),
+        "module": record.module,
+        "function": record.funcName,
+        "line": record.lineno
+    }
+    if record.exc_text:
+        entry["exception"] = record.exc_text
+    extra = getattr(record, "extra_fields", None)
+    if extra:
+        entry.update(extra)
+    return entry
+
+
+class RotatingFile:
+    """An append-only log file shared by every worker process, rotated by size
+
+    Writes use O_APPEND, so whole batches from different processes never
+    interleave. Rotation happens under an flock on a sibling lock file; the
+    other processes notice the renamed inode before their next batch and
+    reopen the new file.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = DEFAULT_MAX_BYTES, backups: int = DEFAULT_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock_path = path.with_name(path.name + ".lock")
+        self._fd = -1
+        self._inode = None
+
+    def _open(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+
+    def write(self, data: bytes):
+        try:
+            current = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            current = None
+        if self._fd < 0 or current != self._inode:
+            self._open()  # First write, or another process rotated the file
+        os.write(self._fd, data)
+        if self.max_bytes and os.fstat(self._fd).st_size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            # Another process may have rotated while we waited for the lock
+            try:
+                if os.stat(self.path).st_size < self.max_bytes:
+                    return
+            except FileNotFoundError:
+                return
+            for index in range(self.backups - 1, 0, -1):
+                source = self.path.with_name(f"{self.path.name}.{index}")
+                if source.exists():
+                    os.replace(source, self.path.with_name(f"{self.path.name}.{index + 1}"))
+            if self.backups:
+                os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+            else:
+                os.unlink(self.path)
+        finally:
+            os.close(lock_fd)
+        self._open()
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class QueuedFileHandler(logging.Handler):
+    """logging.Handler that hands records to a LogPipeline instead of writing them"""
+
+    def __init__(self, pipeline: "LogPipeline", path: Path):
+        super().__init__()
+        self.pipeline = pipeline
+        self.path = path
+
+    def emit(self, record: logging.LogRecord):
+        if record.exc_info:
+            # Tracebacks hold frames alive; render them now rather than in the writer
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.pipeline.enqueue(self.path, record)
+
+
+class LogPipeline:
+    """One bounded queue and one writer thread for all of the server's log files
+
+    enqueue() never blocks: when the writer falls behind and the queue is
+    full, records are dropped and counted, and the count is logged once the
+    writer catches up.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, backups: int = DEFAULT_BACKUPS,
+                 queue_size: int = DEFAULT_QUEUE_SIZE,
+                 fields: Callable[[logging.LogRecord], Dict[str, Any]] = record_fields):
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.fields = fields
+        self.dropped = 0  # Changed under _dropped_lock: producers and the writer both count
+        self._dropped_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(queue_size)
+        self._files: Dict[Path, RotatingFile] = {}
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def handler(self, path: Path) -> QueuedFileHandler:
+        return QueuedFileHandler(self, path)
+
+    def enqueue(self, path: Path, record: logging.LogRecord):
+        try:
+            self._queue.put_nowait((path, record))
+        except queue.Full:
+            self._count_dropped(1)
+
+    def _count_dropped(self, count: int):
+        with self._dropped_lock:
+            self.dropped += count
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            # Whatever piled up while we waited goes out in the same write
+            while item is not None and len(batch) < BATCH_MAX_RECORDS:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def _write(self, batch: List[Optional[tuple]]):
+        chunks: Dict[Path, List[bytes]] = {}
+        for item in batch:
+            if item is None:
+                continue
+            path, record = item
+            try:
+                chunks.setdefault(path, []).append(dumps(self.fields(record)))
+            except Exception:
+                self._count_dropped(1)  # A record that can't be serialized must not stop the writer
+        if self.dropped and chunks:
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            path = next(iter(chunks))
+            chunks[path].append(dumps({
+                "timestamp": utc_timestamp(time.time()),
+                "level": "WARNING",
+                "logger": "clodforest.logging",
+                "message": "log_records_dropped",
+                "dropped": dropped,
+            }))
+        for path, lines in chunks.items():
+            log_file = self._files.get(path)
+            if log_file is None:
+                log_file = self._files[path] = RotatingFile(path, self.max_bytes, self.backups)
+            try:
+                log_file.write(b"".join(lines))
+            except OSError:
+                self._count_dropped(len(lines))
+
+    def flush(self):
+        """Block until every record queued so far has been written"""
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        for log_file in self._files.values():
+            log_file.close()
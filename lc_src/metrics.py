@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+ClodForest metrics
+A small in-process registry of counters, gauges and histograms rendered in
+the Prometheus text format, with snapshots that let one worker serve the
+metrics of all of them
+"""
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans a cached read (sub-millisecond) to a cold full-tree scan
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (sample name, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class Metric:
+    """One metric family; children are keyed by their label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_dict(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    """Monotonic count; by convention the name ends in _total"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def samples(self):
+        return [(self.name, self._label_dict(key), child.value) for key, child in list(self._children.items())]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def samples(self):
+        return [(self.name, self._label_dict(key), child.value) for key, child in list(self._children.items())]
+
+
+class CallbackMetric(Metric):
+    """A gauge or counter read from elsewhere at scrape time
+
+    callback returns {label values: value}, or a bare number when there are
+    no labels; it is only called when /metrics is requested. A shared metric
+    reads state every worker sees alike (the OAuth store), so it is reported
+    once, without the per-worker labels.
+    """
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], object],
+                 labelnames: Sequence[str] = (), kind: str = "gauge", shared: bool = False):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.callback = callback
+        self.shared = shared
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, self._label_dict(key if isinstance(key, tuple) else (key,)), float(value))
+                for key, value in values.items()]
+
+
+class HistogramChild:
+    __slots__ = ("_bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+class _Timer:
+    """Context manager observing the elapsed wall time"""
+
+    __slots__ = ("_child", "_start")
+
+    def __init__(self, child: HistogramChild):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self):
+        samples = []
+        for key, child in list(self._children.items()):
+            labels = self._label_dict(key)
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((self.name + "_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, cumulative))
+        return samples
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if value != value:
+        return "NaN"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    """All metrics of one process
+
+    const_labels (e.g. the worker number) are added to every sample, so the
+    snapshots of several workers can be merged into one exposition.
+    """
+
+    def __init__(self, const_labels: Optional[Dict[str, str]] = None):
+        self.const_labels = const_labels or {}
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, callback: Callable[[], object],
+                 labelnames: Sequence[str] = (), kind: str = "gauge", shared: bool = False) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, callback, labelnames, kind, shared))
+
+    def snapshot(self, include_shared: bool = True) -> List[dict]:
+        """Every family with its current samples, as JSON-serializable dicts"""
+        families = []
+        for metric in self._metrics.values():
+            shared = getattr(metric, "shared", False)
+            if shared and not include_shared:
+                continue
+            const_labels = {} if shared else self.const_labels
+            try:
+                samples = metric.samples()
+            except Exception:
+                continue  # A failing callback (store unreachable) must not break the scrape
+            families.append({
+                "name": metric.name,
+                "type": metric.kind,
+                "help": metric.documentation,
+                "samples": [(name, {**const_labels, **labels}, value) for name, labels, value in samples],
+            })
+        return families
+
+    def render(self, others: Iterable[List[dict]] = ()) -> str:
+        """Text exposition of this registry, merged with snapshots from other processes"""
+        merged: Dict[str, dict] = {}
+        for families in [self.snapshot(), *others]:
+            for family in families:
+                target = merged.get(family["name"])
+                if target is None:
+                    merged[family["name"]] = target = {**family, "samples": []}
+                target["samples"].extend(family["samples"])
+        lines = []
+        for family in merged.values():
+            lines.append(f"# HELP {family['name']} {family['help']}")
+            lines.append(f"# TYPE {family['name']} {family['type']}")
+            for name, labels, value in family["samples"]:
+                if labels:
+                    rendered = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+                    lines.append(f"{name}{{{rendered}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def publish_snapshot(registry: Registry, path: Path):
+    """Atomically write this process's snapshot where the other workers can read it"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    temp.write_text(json.dumps(registry.snapshot(include_shared=False)), encoding="utf-8")
+    os.replace(temp, path)
+
+
+def read_snapshots(directory: Path, exclude: Path, max_age: float) -> List[List[dict]]:
+    """Snapshots published by other live workers; stale ones belong to exited workers"""
+    snapshots = []
+    now = time.time()
+    try:
+        candidates = list(directory.glob("*.json"))
+    except OSError:
+        return snapshots
+    for path in candidates:
+        if path == exclude:
+            continue
+        try:
+            if now - path.stat().st_mtime > max_age:
+                continue
+            snapshots.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return snapshots
@@ -0,0 +1,642 @@
+#!/usr/bin/env python3
+"""
+ClodForest OAuth store
+Persistent storage for registered clients, authorization codes and access
+tokens, shared by every server process: SQLite (WAL) files, or any server
+speaking the Redis protocol, including the small stand-in started with
+`python oauth_store.py --serve`
+"""
+
+import asyncio
+import heapq
+import json
+import select
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+# Record kinds
+CLIENTS = "clients"
+CODES = "codes"
+TOKENS = "tokens"
+REVOKED = "revoked"  # Ids of revoked self-contained tokens, kept until the token expires
+REFRESH_TOKENS = "refresh_tokens"  # Live and already-rotated refresh tokens
+GRANTS = "grants"  # One per authorization: its current refresh and access token
+KINDS = (CLIENTS, CODES, TOKENS, REVOKED, REFRESH_TOKENS, GRANTS)
+
+DEFAULT_SHARDS = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_expiry ON entries(kind, expires_at);
+"""
+
+
+class StoreError(RuntimeError):
+    """The backing store could not be reached or returned an error"""
+
+
+class StoreTable:
+    """One kind of record in a store, used much like the dict it replaces
+
+    Expired records are never returned, whether or not they have been purged yet.
+    """
+
+    def __init__(self, store: "OAuthStore", kind: str):
+        self._store = store
+        self.kind = kind
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._store.get(self.kind, key)
+
+    def put(self, key: str, value: Dict[str, Any], expires_at: float):
+        self._store.put(self.kind, key, value, expires_at)
+
+    def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        """Remove and return a record in one step, so it can only be claimed once"""
+        return self._store.pop(self.kind, key)
+
+    def delete(self, key: str):
+        self._store.delete(self.kind, key)
+
+    def keys(self) -> List[str]:
+        return self._store.keys(self.kind)
+
+    def count(self) -> int:
+        return self._store.count(self.kind)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+
+class OAuthStore:
+    """Base class for store backends; values are JSON-serializable dicts"""
+
+    name = "base"
+
+    def __init__(self):
+        self.clients = StoreTable(self, CLIENTS)
+        self.codes = StoreTable(self, CODES)
+        self.tokens = StoreTable(self, TOKENS)
+        self.revoked = StoreTable(self, REVOKED)
+        self.refresh_tokens = StoreTable(self, REFRESH_TOKENS)
+        self.grants = StoreTable(self, GRANTS)
+
+    def get(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def put(self, kind: str, key: str, value: Dict[str, Any], expires_at: float):
+        raise NotImplementedError
+
+    def pop(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete(self, kind: str, key: str):
+        raise NotImplementedError
+
+    def keys(self, kind: str) -> List[str]:
+        raise NotImplementedError
+
+    def count(self, kind: str) -> int:
+        raise NotImplementedError
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """Delete every expired record; returns how many were removed"""
+        raise NotImplementedError
+
+    def next_expiry(self) -> Optional[float]:
+        """When the soonest record expires, if the backend can tell cheaply"""
+        return None
+
+    def close(self):
+        pass
+
+
+class MemoryStore(OAuthStore):
+    """Process-local dicts; everything is lost on restart
+
+    A min-heap of (expires_at, kind, key) orders records by expiry, so a
+    purge pops exactly the k expired ones in O(k log n). Heap entries for
+    records deleted or replaced early are skipped when they surface.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, Tuple[Dict[str, Any], float]]] = {kind: {} for kind in KINDS}
+        self._heap: List[Tuple[float, str, str]] = []
+
+    def get(self, kind, key):
+        entry = self._data[kind].get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def put(self, kind, key, value, expires_at):
+        with self._lock:
+            self._data[kind][key] = (value, expires_at)
+            heapq.heappush(self._heap, (expires_at, kind, key))
+            if len(self._heap) > 64 and len(self._heap) > 2 * sum(map(len, self._data.values())):
+                # Mostly stale entries (e.g. codes claimed before expiry); rebuild
+                self._heap = [(expires_at, kind, key) for kind, entries in self._data.items()
+                              for key, (_, expires_at) in entries.items()]
+                heapq.heapify(self._heap)
+
+    def pop(self, kind, key):
+        with self._lock:
+            entry = self._data[kind].pop(key, None)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def delete(self, kind, key):
+        with self._lock:
+            self._data[kind].pop(key, None)
+
+    def keys(self, kind):
+        now = time.time()
+        return [key for key, (_, expires_at) in list(self._data[kind].items()) if expires_at > now]
+
+    def count(self, kind):
+        self.purge_expired()
+        return len(self._data[kind])
+
+    def purge_expired(self, now=None):
+        now = time.time() if now is None else now
+        removed = 0
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, kind, key = heapq.heappop(self._heap)
+                entry = self._data[kind].get(key)
+                if entry is not None and entry[1] == expires_at:
+                    del self._data[kind][key]
+                    removed += 1
+        return removed
+
+    def next_expiry(self):
+        with self._lock:
+            while self._heap:
+                expires_at, kind, key = self._heap[0]
+                entry = self._data[kind].get(key)
+                if entry is not None and entry[1] == expires_at:
+                    return expires_at
+                heapq.heappop(self._heap)
+        return None
+
+
+class SQLiteStore(OAuthStore):
+    """Records spread over several SQLite files in WAL mode
+
+    Keys hash to a shard, so writers in different processes rarely wait on
+    the same database lock. Expiry is indexed, so purges touch only expired rows.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, directory: Path, shards: int = DEFAULT_SHARDS):
+        super().__init__()
+        self.directory = directory
+        self.shards = shards
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._conns: List[Optional[sqlite3.Connection]] = [None] * shards
+
+    def _connect(self, shard: int) -> sqlite3.Connection:
+        conn = self._conns[shard]
+        if conn is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.directory / f"oauth-{shard}.db"),
+                                   timeout=5.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conns[shard] = conn
+        return conn
+
+    def _shard(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % self.shards
+
+    def get(self, kind, key):
+        shard = self._shard(key)
+        with self._locks[shard]:
+            row = self._connect(shard).execute(
+                "SELECT value FROM entries WHERE kind = ? AND key = ? AND expires_at > ?",
+                (kind, key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, kind, key, value, expires_at):
+        shard = self._shard(key)
+        with self._locks[shard]:
+            self._connect(shard).execute(
+                "INSERT OR REPLACE INTO entries (kind, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (kind, key, json.dumps(value), expires_at))
+
+    def pop(self, kind, key):
+        shard = self._shard(key)
+        with self._locks[shard]:
+            conn = self._connect(shard)
+            # The write lock is taken up front, so another process can't claim it in between
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT value, expires_at FROM entries WHERE kind = ? AND key = ?",
+                                   (kind, key)).fetchone()
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+    def delete(self, kind, key):
+        shard = self._shard(key)
+        with self._locks[shard]:
+            self._connect(shard).execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+
+    def keys(self, kind):
+        now = time.time()
+        keys = []
+        for shard in range(self.shards):
+            with self._locks[shard]:
+                keys.extend(key for (key,) in self._connect(shard).execute(
+                    "SELECT key FROM entries WHERE kind = ? AND expires_at > ?", (kind, now)))
+        return keys
+
+    def count(self, kind):
+        now = time.time()
+        total = 0
+        for shard in range(self.shards):
+            with self._locks[shard]:
+                total += self._connect(shard).execute(
+                    "SELECT COUNT(*) FROM entries WHERE kind = ? AND expires_at > ?",
+                    (kind, now)).fetchone()[0]
+        return total
+
+    def purge_expired(self, now=None):
+        now = time.time() if now is None else now
+        removed = 0
+        for shard in range(self.shards):
+            with self._locks[shard]:
+                conn = self._connect(shard)
+                for kind in KINDS:
+                    removed += conn.execute(
+                        "DELETE FROM entries WHERE kind = ? AND expires_at <= ?", (kind, now)).rowcount
+        return removed
+
+    def next_expiry(self):
+        soonest = None
+        for shard in range(self.shards):
+            with self._locks[shard]:
+                conn = self._connect(shard)
+                for kind in KINDS:
+                    # Each MIN is a single seek on the (kind, expires_at) index
+                    (expires_at,) = conn.execute(
+                        "SELECT MIN(expires_at) FROM entries WHERE kind = ?", (kind,)).fetchone()
+                    if expires_at is not None and (soonest is None or expires_at < soonest):
+                        soonest = expires_at
+        return soonest
+
+    def close(self):
+        for shard in range(self.shards):
+            with self._locks[shard]:
+                if self._conns[shard] is not None:
+                    self._conns[shard].close()
+                    self._conns[shard] = None
+
+
+# Redis protocol (RESP2)
+
+def encode_command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+class RespConnection:
+    """Minimal blocking Redis-protocol client; one command in flight at a time"""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None,
+                 timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+
+    def _open(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", self.db)
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+        self._sock = None
+        self._file = None
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise StoreError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise StoreError(f"unexpected reply: {line!r}")
+
+    def _call(self, *args):
+        self._sock.sendall(encode_command(*args))
+        return self._read_reply()
+
+    def _stale(self) -> bool:
+        """True if the server has closed (or written to) an idle connection"""
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        return bool(readable)
+
+    def call(self, *args, retry_after_send: bool = True):
+        """Run one command, reconnecting once if the connection went away
+
+        A connection the server closed while idle is replaced before sending.
+        Once the command is sent, a failure (a timeout, or the connection
+        dropping) may come after the server ran it, so it is only retried if
+        retry_after_send; commands that must not run twice, like GETDEL,
+        pass False and raise instead.
+        """
+        for attempt in (1, 2):
+            sent = False
+            try:
+                if self._sock is not None and self._stale():
+                    self.close()
+                if self._sock is None:
+                    self._open()
+                self._sock.sendall(encode_command(*args))
+                sent = True
+                return self._read_reply()
+            except OSError as e:
+                self.close()
+                if attempt == 2 or (sent and not retry_after_send):
+                    raise StoreError(f"{self.host}:{self.port}: {e}") from e
+
+
+class RedisStore(OAuthStore):
+    """Records in a Redis-protocol server, shared by every process that points at it
+
+    Each record is a string key with a native expiry; a sorted set per kind
+    indexes keys by expiry time so counts and purges never scan the keyspace.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "clodforest"):
+        super().__init__()
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self._local = threading.local()
+        self._connection_args = (parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password)
+        self._connections: List[RespConnection] = []
+        self._connections_lock = threading.Lock()
+
+    def _conn(self) -> RespConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = RespConnection(*self._connection_args)
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _key(self, kind: str, key: str) -> str:
+        return f"{self.prefix}:{kind}:{key}"
+
+    def _expiry_index(self, kind: str) -> str:
+        return f"{self.prefix}:{kind}:expiry"
+
+    def get(self, kind, key):
+        data = self._conn().call("GET", self._key(kind, key))
+        return json.loads(data) if data is not None else None
+
+    def put(self, kind, key, value, expires_at):
+        conn = self._conn()
+        conn.call("SET", self._key(kind, key), json.dumps(value), "PXAT", int(expires_at * 1000))
+        conn.call("ZADD", self._expiry_index(kind), repr(expires_at), key)
+
+    def pop(self, kind, key):
+        conn = self._conn()
+        # Not retried once sent: a first attempt that deleted the record would
+        # make the retry return None, and a valid code or refresh token fail
+        data = conn.call("GETDEL", self._key(kind, key), retry_after_send=False)
+        conn.call("ZREM", self._expiry_index(kind), key)
+        return json.loads(data) if data is not None else None
+
+    def delete(self, kind, key):
+        conn = self._conn()
+        conn.call("DEL", self._key(kind, key))
+        conn.call("ZREM", self._expiry_index(kind), key)
+
+    def keys(self, kind):
+        members = self._conn().call("ZRANGEBYSCORE", self._expiry_index(kind), f"({time.time()!r}", "+inf")
+        return [member.decode("utf-8") for member in members]
+
+    def count(self, kind):
+        return self._conn().call("ZCOUNT", self._expiry_index(kind), f"({time.time()!r}", "+inf")
+
+    def purge_expired(self, now=None):
+        # The records expire by themselves; only the index entries need removing
+        now = time.time() if now is None else now
+        conn = self._conn()
+        return sum(conn.call("ZREMRANGEBYSCORE", self._expiry_index(kind), "-inf", repr(now))
+                   for kind in KINDS)
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+def open_store(spec: str, default_directory: Path) -> OAuthStore:
+    """Build a store from CLODFOREST_OAUTH_STORE
+
+    "sqlite" (default) or "sqlite:///path/to/dir", "redis://host:port/db",
+    or "memory" for the old process-local behaviour.
+    """
+    if spec == "memory":
+        return MemoryStore()
+    if spec.startswith(("redis://", "resp://")):
+        return RedisStore(spec)
+    if spec in ("", "sqlite"):
+        return SQLiteStore(default_directory)
+    if spec.startswith("sqlite://"):
+        return SQLiteStore(Path(spec[len("sqlite://"):]))
+    raise ValueError(f"Unknown OAuth store: {spec}")
+
+
+# Local stand-in server
+
+class LocalRespServer:
+    """In-memory server for the subset of the Redis protocol RedisStore uses
+
+    Lets several ClodForest workers on one host share OAuth state without
+    installing Redis. State lives as long as this process does.
+    """
+
+    def __init__(self):
+        self._values: Dict[bytes, bytes] = {}
+        self._expiry: Dict[bytes, float] = {}
+        self._heap: List[Tuple[float, bytes]] = []
+        self._zsets: Dict[bytes, Dict[bytes, float]] = {}
+
+    def _expire(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            if self._expiry.get(key) == expires_at:
+                del self._expiry[key]
+                self._values.pop(key, None)
+
+    @staticmethod
+    def _bound(value: bytes) -> Tuple[float, bool]:
+        text = value.decode("utf-8")
+        if text.startswith("("):
+            return float(text[1:]), True
+        return float(text), False
+
+    def _in_range(self, score: float, low: bytes, high: bytes) -> bool:
+        low_value, low_open = self._bound(low)
+        high_value, high_open = self._bound(high)
+        above = score > low_value if low_open else score >= low_value
+        below = score < high_value if high_open else score <= high_value
+        return above and below
+
+    def execute(self, args: List[bytes]):
+        self._expire()
+        command = args[0].upper()
+        if command == b"PING":
+            return "PONG"
+        if command in (b"SELECT", b"AUTH"):
+            return "OK"
+        if command == b"GET":
+            return self._values.get(args[1])
+        if command == b"SET":
+            key, value = args[1], args[2]
+            self._values[key] = value
+            self._expiry.pop(key, None)
+            if len(args) >= 5 and args[3].upper() == b"PXAT":
+                expires_at = int(args[4]) / 1000
+                self._expiry[key] = expires_at
+                heapq.heappush(self._heap, (expires_at, key))
+            return "OK"
+        if command == b"GETDEL":
+            self._expiry.pop(args[1], None)
+            return self._values.pop(args[1], None)
+        if command == b"DEL":
+            removed = 0
+            for key in args[1:]:
+                self._expiry.pop(key, None)
+                removed += self._values.pop(key, None) is not None
+            return removed
+        if command == b"ZADD":
+            zset = self._zsets.setdefault(args[1], {})
+            added = 0
+            for score, member in zip(args[2::2], args[3::2]):
+                added += member not in zset
+                zset[member] = float(score)
+            return added
+        if command == b"ZREM":
+            zset = self._zsets.get(args[1], {})
+            return sum(zset.pop(member, None) is not None for member in args[2:])
+        if command in (b"ZCOUNT", b"ZRANGEBYSCORE", b"ZREMRANGEBYSCORE"):
+            zset = self._zsets.get(args[1], {})
+            members = [member for member, score in zset.items() if self._in_range(score, args[2], args[3])]
+            if command == b"ZCOUNT":
+                return len(members)
+            if command == b"ZRANGEBYSCORE":
+                return sorted(members, key=zset.get)
+            for member in members:
+                del zset[member]
+            return len(members)
+        raise StoreError(f"ERR unknown command '{command.decode('utf-8', 'replace')}'")
+
+    @staticmethod
+    def encode_reply(reply) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, str):
+            return b"+%s\r\n" % reply.encode("utf-8")
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, bytes):
+            return b"$%d\r\n%s\r\n" % (len(reply), reply)
+        return b"*%d\r\n" % len(reply) + b"".join(LocalRespServer.encode_reply(item) for item in reply)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                args = []
+                for _ in range(int(header[1:-2])):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                try:
+                    reply = self.encode_reply(self.execute(args))
+                except StoreError as e:
+                    reply = b"-%s\r\n" % str(e).encode("utf-8")
+                writer.write(reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local Redis-protocol stand-in for the ClodForest OAuth store")
+    parser.add_argument("--serve", default="127.0.0.1:6379", metavar="HOST:PORT")
+    options = parser.parse_args()
+    serve_host, _, serve_port = options.serve.rpartition(":")
+    print(f"OAuth store listening on {serve_host}:{serve_port}")
+    asyncio.run(LocalRespServer().serve(serve_host or "127.0.0.1", int(serve_port)))
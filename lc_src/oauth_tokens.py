@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+ClodForest self-contained access tokens
+HS256-signed JWTs that any worker holding the signing key can verify without
+a store lookup, plus a bloom filter of revoked token ids
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import math
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from oauth_store import OAuthStore
+
+JWT_HEADER = {"alg": "HS256", "typ": "JWT"}
+
+# Scope i is bit i of a token's scope_bits; append only, issued tokens keep their bits
+SCOPES = ("mcp:read", "mcp:write")
+SCOPE_BIT = {name: 1 << index for index, name in enumerate(SCOPES)}
+ALL_SCOPE_BITS = (1 << len(SCOPES)) - 1
+DEFAULT_SCOPE = " ".join(SCOPES)
+
+
+def scope_bits(scope: str) -> int:
+    """A space-separated scope string as a bitset; unknown scopes grant nothing"""
+    bits = 0
+    for name in scope.split():
+        bits |= SCOPE_BIT.get(name, 0)
+    return bits
+
+
+def known_scope(scope: Optional[str]) -> str:
+    """The known scopes of a requested scope string, in order and without repeats; may be empty"""
+    return " ".join(name for name in dict.fromkeys((scope or "").split()) if name in SCOPE_BIT)
+
+
+def normalize_scope(scope: Optional[str]) -> str:
+    """The known scopes of a requested scope string, in order; when none are left, DEFAULT_SCOPE
+
+    Clients may ask for scopes of their own (Claude.ai sends "claudeai"); those
+    are dropped rather than issued, so they can't yield a token that grants nothing.
+    """
+    return known_scope(scope) or DEFAULT_SCOPE
+
+
+def b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def b64url_decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def load_secret(path: Path) -> bytes:
+    """Read the signing key, creating a random one (mode 0600) on first use
+
+    Every worker on the host reads the same file, so tokens verify anywhere.
+    """
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return path.read_bytes()  # Another worker won the race
+    with os.fdopen(fd, "wb") as f:
+        f.write(secrets.token_bytes(32))
+    return path.read_bytes()
+
+
+def looks_like_jwt(token: str) -> bool:
+    return token.count(".") == 2
+
+
+class TokenSigner:
+    """Issues and verifies HS256 JWT access tokens"""
+
+    def __init__(self, secret: bytes, issuer: str):
+        self.secret = secret
+        self.issuer = issuer
+        self._header = b64url_encode(json.dumps(JWT_HEADER, separators=(",", ":")).encode("utf-8"))
+
+    def _sign(self, signing_input: str) -> str:
+        return b64url_encode(hmac.new(self.secret, signing_input.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, client_id: str, scope: str, expires_at: float, jti: Optional[str] = None) -> str:
+        claims = {
+            "iss": self.issuer,
+            "sub": client_id,
+            "client_id": client_id,
+            "scope": scope,
+            "scope_bits": scope_bits(scope),
+            "iat": int(time.time()),
+            "exp": int(expires_at),
+            "jti": jti or secrets.token_urlsafe(12),
+        }
+        payload = b64url_encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        signing_input = f"{self._header}.{payload}"
+        return f"{signing_input}.{self._sign(signing_input)}"
+
+    def verify(self, token: str) -> Optional[Dict[str, Any]]:
+        """Claims of a valid, unexpired token from this issuer, else None"""
+        try:
+            header, payload, signature = token.split(".")
+        except ValueError:
+            return None
+        # Only our own header is accepted, which rules out alg=none and key confusion
+        if header != self._header:
+            return None
+        expected = self._sign(f"{header}.{payload}")
+        if not hmac.compare_digest(signature.encode("utf-8"), expected.encode("ascii")):
+            return None
+        try:
+            claims = json.loads(b64url_decode(payload))
+        except ValueError:
+            return None
+        if not isinstance(claims, dict) or claims.get("iss") != self.issuer or claims.get("exp", 0) <= time.time():
+            return None
+        return claims
+
+
+class BloomFilter:
+    """Fixed-size bloom filter; no false negatives, false positives near error_rate"""
+
+    def __init__(self, capacity: int = 10000, error_rate: float = 0.001):
+        bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size = bits
+        self.hashes = max(1, round(bits / capacity * math.log(2)))
+        self._bits = bytearray((bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    """Revoked token ids: a local bloom filter in front of the shared store
+
+    Checking a token that was never revoked is a few bit tests with no I/O.
+    Only bloom hits (real or false positive) are confirmed against the
+    store. sync() rebuilds the filter from the store so revocations made
+    by other workers arrive within one sync interval.
+    """
+
+    def __init__(self, store: OAuthStore, capacity: int = 10000, error_rate: float = 0.001):
+        self.store = store
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(capacity, error_rate)
+
+    def revoke(self, jti: str, expires_at: float):
+        with self._lock:
+            self.store.revoked.put(jti, {"revoked_at": time.time()}, expires_at)
+            self._bloom.add(jti)
+
+    def may_be_revoked(self, jti: str) -> bool:
+        """False means certainly not revoked, with no I/O; True needs is_revoked to confirm"""
+        return jti in self._bloom
+
+    def is_revoked(self, jti: str) -> bool:
+        if jti not in self._bloom:
+            return False
+        return self.store.revoked.get(jti) is not None
+
+    def sync(self):
+        with self._lock:  # Keeps a concurrent local revoke from missing the new filter
+            revoked = self.store.revoked.keys()
+            # Expired revocations drop out here, so the filter stays sized to live ones
+            bloom = BloomFilter(max(self.capacity, 2 * len(revoked)), self.error_rate)
+            for jti in revoked:
+                bloom.add(jti)
+            self._bloom = bloom
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+ClodForest multi-worker serving
+A supervisor that runs several uvicorn worker processes on one port, each
+with its own SO_REUSEPORT listening socket, and the lock that picks which
+worker maintains the shared search indexes
+"""
+
+import fcntl
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+log = logging.getLogger("clodforest.app")
+
+WORKER_ID_ENV = "CLODFOREST_WORKER_ID"
+# A worker that exits within STABLE_AFTER seconds of starting has failed fast.
+# Each fast failure in a row doubles the wait before its restart, from
+# RESTART_DELAY up to MAX_RESTART_DELAY; after MAX_FAST_FAILURES the supervisor
+# gives up, since the worker is crashing on startup rather than under load
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+STABLE_AFTER = 10.0
+MAX_FAST_FAILURES = 5
+
+
+class LeaderLock:
+    """An exclusive flock that exactly one worker holds at a time
+
+    start() waits for the lock in a background thread; whoever gets it runs
+    the on_acquire callbacks. The kernel releases the lock when its holder
+    exits, however it exits, so a waiting worker takes over.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.held = False
+        self._callbacks: List[Callable[[], None]] = []
+        self._fd = -1
+        self._thread: Optional[threading.Thread] = None
+
+    def on_acquire(self, callback: Callable[[], None]):
+        self._callbacks.append(callback)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._wait, name="leader-lock", daemon=True)
+        self._thread.start()
+
+    def _wait(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)  # Blocks until the current holder exits
+        self.held = True
+        log.info("worker %s now maintains the search indexes", os.getenv(WORKER_ID_ENV, "?"))
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception:
+                log.exception("leader callback failed")
+
+
+def worker_id() -> Optional[int]:
+    """This process's worker number under the supervisor, or None when serving alone"""
+    value = os.getenv(WORKER_ID_ENV)
+    return int(value) if value is not None else None
+
+
+def reuseport_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Each worker gets its own accept queue and the kernel spreads connections
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app: str, app_dir: str, host: str, port: int, graceful_timeout: float):
+    """Body of one worker process: serve app on a SO_REUSEPORT socket until signalled"""
+    import uvicorn
+
+    sys.path.insert(0, app_dir)
+    sock = reuseport_socket(host, port)
+    config = uvicorn.Config(app, timeout_graceful_shutdown=graceful_timeout, log_level="info")
+    # uvicorn handles SIGTERM/SIGINT: stop accepting, finish in-flight requests, run lifespan shutdown
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Keeps `workers` processes serving, restarts crashed ones, and stops them gracefully
+
+    Restarts back off exponentially while a worker keeps failing fast, and
+    run() returns 1 once one has failed fast MAX_FAST_FAILURES times in a row.
+    """
+
+    def __init__(self, app: str, app_dir: Path, host: str, port: int, workers: int,
+                 graceful_timeout: float = 30.0):
+        self.app = app
+        self.app_dir = app_dir
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self._processes: Dict[int, subprocess.Popen] = {}
+        self._started_at: Dict[int, float] = {}
+        self._fast_failures: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        env = dict(os.environ, **{WORKER_ID_ENV: str(index)})
+        # A fresh interpreter, not a fork: the supervisor's imports and threads stay behind
+        self._processes[index] = subprocess.Popen(
+            [sys.executable, __file__, self.app, str(self.app_dir), self.host, str(self.port),
+             str(self.graceful_timeout)],
+            env=env,
+        )
+        self._started_at[index] = time.monotonic()
+        self._restart_at.pop(index, None)
+
+    def _signal(self, signum, _frame):
+        self._stopping = True
+
+    def run(self) -> int:
+        # Fail in the supervisor, not N times over, if the port can't be bound
+        reuseport_socket(self.host, self.port).close()
+
+        signal.signal(signal.SIGTERM, self._signal)
+        signal.signal(signal.SIGINT, self._signal)
+        for index in range(self.workers):
+            self._spawn(index)
+
+        while not self._stopping:
+            time.sleep(0.5)
+            for index, process in list(self._processes.items()):
+                if process.poll() is None or self._stopping:
+                    continue
+                if index not in self._restart_at and not self._schedule_restart(index, process.returncode):
+                    self.stop()
+                    return 1
+                if time.monotonic() >= self._restart_at[index]:
+                    self._spawn(index)
+        return self.stop()
+
+    def _schedule_restart(self, index: int, returncode: int) -> bool:
+        """Pick when to restart a worker that just exited; False to give up"""
+        now = time.monotonic()
+        if now - self._started_at[index] < STABLE_AFTER:
+            failures = self._fast_failures[index] = self._fast_failures.get(index, 0) + 1
+        else:
+            failures = self._fast_failures[index] = 0
+        if failures >= MAX_FAST_FAILURES:
+            log.error("worker %d exited with %s %d times in a row within %.0fs of starting, giving up",
+                      index, returncode, failures, STABLE_AFTER)
+            return False
+        delay = min(MAX_RESTART_DELAY, RESTART_DELAY * 2 ** failures)
+        log.warning("worker %d exited with %s, restarting in %.0fs", index, returncode, delay)
+        self._restart_at[index] = now + delay
+        return True
+
+    def stop(self) -> int:
+        for process in self._processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        for process in self._processes.values():
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        return 0
+
+
+def serve(app: str, app_dir: Path, host: str, port: int, workers: int,
+          graceful_timeout: float = 30.0) -> int:
+    """Serve app ("module:attribute") from `workers` processes sharing host:port"""
+    if not hasattr(socket, "SO_REUSEPORT"):
+        # No per-worker sockets here; uvicorn's own supervisor shares one listening socket
+        import uvicorn
+
+        uvicorn.run(app, host=host, port=port, workers=workers, app_dir=str(app_dir),
+                    timeout_graceful_shutdown=graceful_timeout)
+        return 0
+    return Supervisor(app, app_dir, host, port, workers, graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    worker_app, worker_app_dir, worker_host, worker_port, worker_timeout = sys.argv[1:6]
+    run_worker(worker_app, worker_app_dir, worker_host, int(worker_port), float(worker_timeout))
@@ -0,0 +1,128 @@
+"""
+Shared fixtures: clodforest.app served in-process over a scratch state tree
+
+The environment is set before clodforest is imported, since the module reads
+its configuration once; nothing touches the real contexts, logs or OAuth data.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import secrets
+import sys
+import tempfile
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+SCRATCH = Path(tempfile.mkdtemp(prefix="clodforest-tests-"))
+os.environ.update({
+    "CLODFOREST_CONTEXT_DIR": str(SCRATCH / "contexts"),
+    "CLODFOREST_CACHE_DIR": str(SCRATCH / "cache"),
+    "CLODFOREST_LOG_DIR": str(SCRATCH / "logs"),
+    "CLODFOREST_OAUTH_STORE": f"sqlite://{SCRATCH / 'oauth2'}",
+    "CLODFOREST_SCAN_WORKERS": "1",
+    "CLODFOREST_METRICS": "true",
+    "CLODFOREST_METRICS_TOKEN": "metrics-secret",
+})
+(SCRATCH / "contexts").mkdir(parents=True, exist_ok=True)
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+REDIRECT_URI = "https://client.invalid/callback"
+
+
+@pytest.fixture(scope="session")
+def clodforest():
+    import clodforest
+    return clodforest
+
+
+@pytest.fixture(scope="session")
+def client(clodforest):
+    from fastapi.testclient import TestClient
+    with TestClient(clodforest.app) as client:
+        yield client
+
+
+@pytest.fixture
+def context_dir(clodforest) -> Path:
+    return clodforest.CONTEXT_DIR
+
+
+def authorize(client, scope=None):
+    """Register a client and run authorize -> token; returns (client_id, client_secret, token response)"""
+    registration = {"client_name": "tests", "redirect_uris": [REDIRECT_URI]}
+    if scope is not None:
+        registration["scope"] = scope
+    response = client.post("/register", json=registration)
+    assert response.status_code == 201, response.text
+    client_id, client_secret = response.json()["client_id"], response.json()["client_secret"]
+    verifier = secrets.token_urlsafe(48)
+    challenge = base64.urlsafe_b64encode(hashlib.sha256(verifier.encode()).digest()).decode().rstrip("=")
+    params = {"response_type": "code", "client_id": client_id, "redirect_uri": REDIRECT_URI,
+              "state": "s", "code_challenge": challenge, "code_challenge_method": "S256"}
+    if scope is not None:
+        params["scope"] = scope
+    response = client.get("/oauth/authorize", params=params, follow_redirects=False)
+    assert response.status_code in (302, 307), response.text
+    code = parse_qs(urlparse(response.headers["location"]).query)["code"][0]
+    response = client.post("/oauth/token", data={
+        "grant_type": "authorization_code", "code": code, "redirect_uri": REDIRECT_URI,
+        "client_id": client_id, "client_secret": client_secret, "code_verifier": verifier})
+    assert response.status_code == 200, response.text
+    return client_id, client_secret, response.json()
+
+
+@pytest.fixture
+def oauth():
+    return authorize
+
+
+class McpSession:
+    """An initialized MCP session over the in-process client"""
+
+    def __init__(self, client, access_token):
+        self.client = client
+        self.headers = {"Accept": "application/json, text/event-stream",
+                        "Authorization": f"Bearer {access_token}"}
+        self.next_id = 0
+        self.request("initialize", {"protocolVersion": "2025-03-26", "capabilities": {},
+                                               "clientInfo": {"name": "tests", "version": "1"}})
+        self.client.post("/mcp/", headers=self.headers,
+                         json={"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+    def request(self, method, params):
+        self.next_id += 1
+        response = self.client.post("/mcp/", headers=self.headers,
+                                    json={"jsonrpc": "2.0", "id": self.next_id, "method": method, "params": params})
+        assert response.status_code == 200, response.text
+        if "mcp-session-id" in response.headers:
+            self.headers["mcp-session-id"] = response.headers["mcp-session-id"]
+        for line in response.text.splitlines():
+            if line.startswith("data:"):
+                return json.loads(line[5:])
+        return response.json()
+
+    def call(self, tool, **arguments):
+        """A tool's text result; raises AssertionError if the tool failed"""
+        reply = self.request("tools/call", {"name": tool, "arguments": arguments})
+        assert "error" not in reply, reply
+        result = reply["result"]
+        text = "".join(item.get("text", "") for item in result["content"])
+        assert not result.get("isError"), text
+        return text
+
+    def call_error(self, tool, **arguments):
+        """A failing tool's error text"""
+        reply = self.request("tools/call", {"name": tool, "arguments": arguments})
+        result = reply["result"]
+        assert result.get("isError"), result
+        return "".join(item.get("text", "") for item in result["content"])
+
+
+@pytest.fixture(scope="session")
+def mcp(client):
+    _, _, tokens = authorize(client)
+    return McpSession(client, tokens["access_token"])
@@ -0,0 +1,31 @@
+"""read_contexts and write_contexts keep results and errors apart, by path"""
+
+import json
+
+import pytest
+
+
+def test_write_then_read_batch(mcp):
+    written = json.loads(mcp.call("write_contexts", files={
+        "batches/a.md": "alpha\n", "batches/error": "a file named error\n", "../outside.md": "no"}))
+    assert set(written["files"]) == {"batches/a.md", "batches/error"}
+    assert written["errors"] == {"../outside.md": "Invalid path: outside context directory"}
+
+    read = json.loads(mcp.call("read_contexts", file_paths=[
+        "batches/a.md", "batches/error", "batches/missing.md", "batches/a.md"]))
+    assert read["files"] == {"batches/a.md": "alpha\n", "batches/error": "a file named error\n"}
+    assert read["errors"] == {"batches/missing.md": "File not found: batches/missing.md"}
+
+
+def test_content_that_looks_like_an_error_is_content(mcp):
+    mcp.call("write_context", file_path="batches/notes.md", content="File not found: just a note")
+    read = json.loads(mcp.call("read_contexts", file_paths=["batches/notes.md"]))
+    assert read == {"files": {"batches/notes.md": "File not found: just a note"}, "errors": {}}
+
+
+@pytest.mark.parametrize("tool, arguments", [
+    ("read_contexts", lambda n: {"file_paths": [f"batches/{i}.md" for i in range(n)]}),
+    ("write_contexts", lambda n: {"files": {f"batches/{i}.md": "x" for i in range(n)}}),
+])
+def test_oversized_batch_is_a_tool_error(mcp, clodforest, tool, arguments):
+    assert "Too many files" in mcp.call_error(tool, **arguments(clodforest.BATCH_MAX_ITEMS + 1))
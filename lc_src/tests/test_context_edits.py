@@ -0,0 +1,170 @@
+"""Line edits and patches: replace_context_lines, patch_context and the diff parser"""
+
+import threading
+import time
+
+import pytest
+
+from context_io import ContextWriter, PatchError, PreconditionFailed, current_etag, parse_unified_diff
+
+
+@pytest.fixture
+def writer():
+    return ContextWriter()
+
+
+@pytest.mark.parametrize("content, first, last, expected", [
+    (b"a\nb\nc\n", 2, 2, b"a\nB\nc\n"),
+    (b"a\nb\nc\n", 3, 3, b"a\nb\nB\n"),
+    (b"a\nb\nc\n", 4, 3, b"a\nb\nc\nB\n"),  # Append at line_count + 1
+    (b"a\nb\nc", 4, 3, b"a\nb\nc\nB\n"),  # Append after a final line without a newline
+    (b"a\nb\nc\n", 1, 0, b"B\na\nb\nc\n"),
+    (b"", 1, 0, b"B\n"),
+])
+def test_ranges_inside_the_file(writer, tmp_path, content, first, last, expected):
+    path = tmp_path / "note.md"
+    path.write_bytes(content)
+    writer.replace_lines(path, first, last, b"B\n")
+    assert path.read_bytes() == expected
+
+
+@pytest.mark.parametrize("content, first, last", [
+    (b"a\nb\nc\n", 3, 4),  # Ends past the last line
+    (b"a\nb\nc\n", 4, 4),  # Replaces a line that doesn't exist
+    (b"a\nb\nc\n", 5, 4),  # Inserts after a gap
+    (b"a\nb\nc\n", 10, 12),
+    (b"a\nb\nc", 4, 4),
+    (b"", 1, 1),
+])
+def test_ranges_past_the_end(writer, tmp_path, content, first, last):
+    path = tmp_path / "note.md"
+    path.write_bytes(content)
+    with pytest.raises(PatchError, match="past the end"):
+        writer.replace_lines(path, first, last, b"B\n")
+    assert path.read_bytes() == content
+
+
+def test_tool_reports_range_past_the_end(mcp):
+    mcp.call("write_context", file_path="edits/short.md", content="one\ntwo\n")
+    result = mcp.call("replace_context_lines", file_path="edits/short.md", start_line=5, end_line=6,
+                      content="five\n")
+    assert result.startswith("Failed to edit file:")
+    assert mcp.call("read_context", file_path="edits/short.md") == "one\ntwo\n"
+
+
+MULTI_HUNK = """--- a/note.md
++++ b/note.md
+@@ -1,3 +1,3 @@
+ one
+-two
++TWO
+ three
+@@ -7,3 +7,4 @@
+ seven
+ eight
++eight and a half
+ nine
+"""
+
+
+def numbered(count):
+    names = "one two three four five six seven eight nine ten".split()
+    return "".join(f"{name}\n" for name in names[:count]).encode()
+
+
+def test_multi_hunk_patch(writer, tmp_path):
+    path = tmp_path / "note.md"
+    path.write_bytes(numbered(10))
+    writer.patch(path, MULTI_HUNK)
+    assert path.read_bytes() == (b"one\nTWO\nthree\nfour\nfive\nsix\nseven\neight\neight and a half\n"
+                                 b"nine\nten\n")
+
+
+def test_patch_context_mismatch_leaves_the_file(writer, tmp_path):
+    path = tmp_path / "note.md"
+    original = numbered(10).replace(b"seven", b"SEVEN")
+    path.write_bytes(original)
+    with pytest.raises(PatchError, match="does not apply at line 7"):
+        writer.patch(path, MULTI_HUNK)
+    assert path.read_bytes() == original  # The first hunk, which did apply, isn't written either
+
+
+def test_patch_etag_precondition(writer, tmp_path):
+    path = tmp_path / "note.md"
+    path.write_bytes(numbered(10))
+    stale = current_etag(path)
+    writer.replace_lines(path, 10, 10, b"TEN\n")
+    with pytest.raises(PreconditionFailed):
+        writer.patch(path, MULTI_HUNK, if_match=stale)
+    writer.patch(path, MULTI_HUNK, if_match=current_etag(path))
+    assert path.read_bytes().endswith(b"nine\nTEN\n")
+
+
+@pytest.mark.parametrize("separator", ["\x0b", "\x0c", "\x1c", "\x1e", "\x85", "\u2028", "\u2029"])
+def test_patch_line_containing_a_unicode_line_break(writer, tmp_path, separator):
+    path = tmp_path / "note.md"
+    path.write_text(f"first\na{separator}b\nlast\n", encoding="utf-8")
+    writer.patch(path, f"@@ -1,3 +1,3 @@\n first\n-a{separator}b\n+a{separator}B\n last\n")
+    assert path.read_text(encoding="utf-8") == f"first\na{separator}B\nlast\n"
+
+
+def test_patch_crlf_file_and_diff(writer, tmp_path):
+    path = tmp_path / "note.md"
+    path.write_bytes(b"one\r\ntwo\r\nthree\r\n")
+    writer.patch(path, "@@ -1,3 +1,3 @@\r\n one\r\n-two\r\n+TWO\r\n three\r\n")
+    assert path.read_bytes() == b"one\r\nTWO\r\nthree\r\n"
+
+
+def test_parse_no_newline_marker():
+    hunks = parse_unified_diff("@@ -1 +1 @@\n-old\n+new\n\\ No newline at end of file\n")
+    assert hunks[0].lines == [("-", "old"), ("+", "new")]
+    assert not hunks[0].new_eof_newline
+
+
+def test_patch_context_tool(mcp):
+    mcp.call("write_context", file_path="edits/patched.md", content=numbered(10).decode())
+    etag = mcp.call("stat_context", file_path="edits/patched.md").split("etag=")[1]
+    assert mcp.call("patch_context", file_path="edits/patched.md", diff=MULTI_HUNK, if_match=etag).startswith(
+        "Patched edits/patched.md")
+    assert "TWO\n" in mcp.call("read_context", file_path="edits/patched.md")
+    assert mcp.call("patch_context", file_path="edits/patched.md", diff=MULTI_HUNK, if_match=etag).startswith(
+        "Precondition failed")
+    assert mcp.call("patch_context", file_path="edits/patched.md", diff=MULTI_HUNK).startswith(
+        "Failed to apply patch")
+
+
+def test_concurrent_writes_coalesce_and_the_last_wins(tmp_path):
+    writer = ContextWriter(coalesce_window=0.3, max_waiting=8)
+    path = tmp_path / "burst.md"
+    results = {}
+
+    def write(index):
+        results[index] = writer.write(path, f"write {index}\n".encode())
+
+    threads = []
+    for index in range(5):
+        threads.append(threading.Thread(target=write, args=(index,)))
+        threads[-1].start()
+        time.sleep(0.02)  # Arrive in order, all within the window
+    for thread in threads:
+        thread.join()
+
+    assert path.read_bytes() == b"write 4\n"
+    assert results == {0: False, 1: False, 2: False, 3: False, 4: True}
+    assert (writer.writes, writer.coalesced) == (1, 4)
+
+
+def test_writers_past_max_waiting_flush_early(tmp_path):
+    writer = ContextWriter(coalesce_window=5.0, max_waiting=1)
+    path = tmp_path / "busy.md"
+    start = time.monotonic()
+    leader = threading.Thread(target=writer.write, args=(path, b"first\n"))
+    leader.start()
+    time.sleep(0.05)
+    assert writer.write(tmp_path / "other.md", b"other\n")  # No window of its own: written at once
+    assert writer.write(path, b"second\n")  # Ends the open window instead of waiting it out
+    leader.join()
+    assert time.monotonic() - start < 2
+    assert path.read_bytes() == b"second\n"
+    assert (tmp_path / "other.md").read_bytes() == b"other\n"
+    assert writer.writes == 2
@@ -0,0 +1,20 @@
+"""list_contexts reflects the server's own writes at once, without waiting for the watcher"""
+
+
+def test_write_then_list(mcp):
+    mcp.call("write_context", file_path="listing/first.md", content="hello\n")
+    assert "listing/first.md" in mcp.call("list_contexts", prefix="listing")
+    mcp.call("write_context", file_path="listing/second.md", content="hello\n")
+    assert "listing/second.md" in mcp.call("list_contexts", prefix="listing")
+
+
+def test_write_into_new_directories_then_list(mcp):
+    mcp.call("list_contexts")  # Cache the tree before the new directories exist
+    mcp.call("write_context", file_path="listing/new/deeper/note.md", content="hello\n")
+    assert "listing/new/deeper/note.md" in mcp.call("list_contexts", prefix="listing/new")
+
+
+def test_append_creates_and_lists(mcp):
+    mcp.call("list_contexts", prefix="listing")
+    mcp.call("append_context", file_path="listing/appended.md", content="first\n")
+    assert "listing/appended.md" in mcp.call("list_contexts", prefix="listing")
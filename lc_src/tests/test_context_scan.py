@@ -0,0 +1,71 @@
+"""Scans spread over ScanPool workers"""
+
+import logging
+import re
+
+from context_index import ContextIndex
+from context_scan import PARALLEL_MIN_FILES, ScanPool, ScanWorkerError, scan_paths
+
+
+def make_tree(root, count):
+    paths = []
+    for index in range(count):
+        rel_path = f"d{index % 7}/f{index}.md"
+        (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel_path).write_text(f"line {index}\n" + ("needle\n" if index % 3 == 0 else "hay\n"))
+        paths.append(rel_path)
+    return paths
+
+
+def test_pool_matches_in_process_scan(tmp_path):
+    paths = make_tree(tmp_path, PARALLEL_MIN_FILES * 2)
+    matcher = re.compile("needle", re.IGNORECASE)
+    pool = ScanPool(2)
+    try:
+        assert scan_paths(tmp_path, paths, matcher, 6, 4, pool=pool) == scan_paths(tmp_path, paths, matcher, 6, 4)
+        workers = list(pool._processes)
+        assert len(workers) == 2
+    finally:
+        pool.close()
+    assert all(process.poll() is not None for process in workers)
+
+
+def test_small_scans_start_no_workers(tmp_path):
+    paths = make_tree(tmp_path, PARALLEL_MIN_FILES - 1)
+    pool = ScanPool(2)
+    try:
+        scan_paths(tmp_path, paths, re.compile("needle"), 6, pool=pool)
+        assert pool._processes == []
+    finally:
+        pool.close()
+
+
+def test_workers_do_not_import_the_server(tmp_path):
+    paths = make_tree(tmp_path, PARALLEL_MIN_FILES)
+    pool = ScanPool(2)
+    try:
+        scan_paths(tmp_path, paths, re.compile("needle"), 6, pool=pool)
+        for process in pool._processes:
+            rss_kb = next(int(line.split()[1]) for line in open(f"/proc/{process.pid}/status")
+                          if line.startswith("VmRSS:"))
+            assert rss_kb < 40 * 1024
+    finally:
+        pool.close()
+
+
+def test_worker_error_falls_back_to_in_process_scan(tmp_path, monkeypatch, caplog):
+    root = tmp_path / "contexts"
+    make_tree(root, PARALLEL_MIN_FILES * 2)
+
+    def failing_map(self, batches):
+        raise ScanWorkerError("scan worker failed: MemoryError()")
+    monkeypatch.setattr(ScanPool, "map", failing_map)
+    index = ContextIndex(root, tmp_path / "index.db", scan_workers=2)
+    try:
+        with caplog.at_level(logging.WARNING, logger="clodforest.app"):
+            hits, total = index.search("need+le", mode="regex")
+        assert total == len([i for i in range(PARALLEL_MIN_FILES * 2) if i % 3 == 0])
+        assert "MemoryError" in caplog.text
+        assert index._scan_pool is not None  # Kept: the workers themselves are fine
+    finally:
+        index.close()
@@ -0,0 +1,48 @@
+"""Writes return before the file is reindexed; the index catches up in the background"""
+
+import threading
+import time
+
+
+def test_write_does_not_wait_for_reindexing(mcp, clodforest, monkeypatch):
+    release = threading.Event()
+    updated = []
+    update_path = clodforest.context_index.update_path
+
+    def slow_update(rel_path):
+        release.wait(5)  # Stands in for a slow tokenizer or embedding model
+        update_path(rel_path)
+        updated.append(rel_path)
+    monkeypatch.setattr(clodforest.context_index, "update_path", slow_update)
+
+    start = time.perf_counter()
+    mcp.call("write_context", file_path="indexing/fresh.md", content="zebracorn\n")
+    assert time.perf_counter() - start < 2
+    assert updated == []
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while not updated and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert updated == ["indexing/fresh.md"]
+    assert "indexing/fresh.md" in mcp.call("search_contexts", query="zebracorn")
+
+
+def test_repeated_writes_are_reindexed_once(mcp, clodforest, monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def blocking_update(rel_path):
+        calls.append(rel_path)
+        release.wait(5)
+    monkeypatch.setattr(clodforest.context_index, "update_path", blocking_update)
+
+    mcp.call("write_context", file_path="indexing/first.md", content="one\n")
+    deadline = time.monotonic() + 5
+    while not calls and time.monotonic() < deadline:
+        time.sleep(0.01)  # The update thread is now busy with first.md
+    for round in range(5):
+        mcp.call("write_context", file_path="indexing/busy.md", content=f"round {round}\n")
+    release.set()
+    clodforest.index_executor.submit(lambda: None).result(5)  # Runs after everything queued before it
+    assert calls == ["indexing/first.md", "indexing/busy.md"]
@@ -0,0 +1,71 @@
+"""Log records: serialization, timestamps and drop counting"""
+
+import importlib
+import logging
+import sys
+import threading
+import warnings
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from log_pipeline import LogPipeline, record_fields
+
+ENTRY = {"event": "héllo ✓", "count": 3, "ratio": 0.5, "ok": True, "none": None,
+         "nested": {"items": [1, "two"]}, "at": datetime(2026, 1, 2, 3, 4, 5, 678000), "path": Path("a/b")}
+
+
+def test_fallback_matches_orjson(monkeypatch):
+    pytest.importorskip("orjson")
+    import log_pipeline
+    fast = log_pipeline.dumps(ENTRY)
+    monkeypatch.setitem(sys.modules, "orjson", None)  # Makes "import orjson" raise ImportError
+    try:
+        fallback = importlib.reload(log_pipeline).dumps(ENTRY)
+    finally:
+        monkeypatch.undo()
+        importlib.reload(log_pipeline)
+    assert fallback == fast
+
+
+def make_record(message="hello", created=1767323045.678):
+    record = logging.LogRecord("clodforest.app", logging.INFO, __file__, 1, message, None, None)
+    record.created = created
+    return record
+
+
+def test_timestamp_is_utc_without_deprecation_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        fields = record_fields(make_record())
+    assert fields["timestamp"] == "2026-01-02T03:04:05.678000Z"
+    assert datetime.fromisoformat(fields["timestamp"].replace("Z", "+00:00")).tzinfo == timezone.utc
+
+
+def test_concurrent_drops_are_all_counted(tmp_path):
+    writing = threading.Event()
+    release = threading.Event()
+
+    def slow_fields(record):
+        writing.set()
+        release.wait(5)
+        return record_fields(record)
+
+    pipeline = LogPipeline(queue_size=1, fields=slow_fields)
+    path = tmp_path / "app.log"
+    pipeline.enqueue(path, make_record("first"))
+    assert writing.wait(5)  # The writer holds the first record; the queue is empty
+
+    producers, per_producer = 8, 2000
+    threads = [threading.Thread(target=lambda: [pipeline.enqueue(path, make_record()) for _ in range(per_producer)])
+               for _ in range(producers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pipeline.dropped == producers * per_producer - 1  # One more fitted in the queue
+
+    release.set()
+    pipeline.close()
+    assert f'"dropped":{producers * per_producer - 1}' in path.read_text()
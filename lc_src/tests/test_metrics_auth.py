@@ -0,0 +1,38 @@
+"""Who may scrape /metrics"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_metrics_needs_a_token(client):
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers=bearer("wrong")).status_code == 401
+
+
+def test_metrics_token_scrapes(client):
+    response = client.get("/metrics", headers=bearer("metrics-secret"))
+    assert response.status_code == 200
+    assert "clodforest_tool_duration_seconds" in response.text
+
+
+def test_oauth_token_scrapes(client, oauth):
+    _, _, tokens = oauth(client)
+    assert client.get("/metrics", headers=bearer(tokens["access_token"])).status_code == 200
+
+
+def test_metrics_token_is_not_an_mcp_token(client):
+    response = client.post("/mcp/", json={}, headers=bearer("metrics-secret"))
+    assert response.status_code == 401
+
+
+def test_metrics_off_by_default():
+    env = {key: value for key, value in os.environ.items() if key != "CLODFOREST_METRICS"}
+    result = subprocess.run([sys.executable, "-c", "import clodforest; print(clodforest.METRICS_ENABLED)"],
+                            cwd=Path(__file__).parent.parent, env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip().splitlines()[-1] == "False"
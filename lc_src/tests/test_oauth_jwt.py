@@ -0,0 +1,145 @@
+"""JWT access tokens: signature and expiry checks, revocation and the bloom filter in front of it"""
+
+import hashlib
+import hmac
+import json
+import secrets
+import time
+
+import pytest
+
+from oauth_store import MemoryStore
+from oauth_tokens import BloomFilter, RevocationList, TokenSigner, b64url_encode
+from test_oauth_scopes import mcp_status
+
+ISSUER = "https://clodforest.test"
+
+
+def signed(header, claims, secret):
+    """A JWT with any header and claims, signed HS256 with secret"""
+    encode = lambda part: b64url_encode(json.dumps(part, separators=(",", ":")).encode())
+    signing_input = f"{encode(header)}.{encode(claims)}"
+    signature = b64url_encode(hmac.new(secret, signing_input.encode(), hashlib.sha256).digest())
+    return f"{signing_input}.{signature}"
+
+
+@pytest.fixture
+def signer():
+    return TokenSigner(secrets.token_bytes(32), ISSUER)
+
+
+def test_own_token_verifies(signer):
+    claims = signer.verify(signer.issue("client", "mcp:read", time.time() + 60, "jti-1"))
+    assert claims["client_id"] == "client" and claims["jti"] == "jti-1" and claims["scope_bits"] == 1
+
+
+def test_token_signed_with_another_key_is_rejected(signer):
+    other = TokenSigner(secrets.token_bytes(32), ISSUER)
+    assert signer.verify(other.issue("client", "mcp:read", time.time() + 60)) is None
+
+
+@pytest.mark.parametrize("header", [
+    {"alg": "none", "typ": "JWT"},
+    {"alg": "HS512", "typ": "JWT"},
+    {"alg": "RS256", "typ": "JWT"},
+    {"typ": "JWT", "alg": "HS256"},  # Same algorithm, but not the header this issuer writes
+])
+def test_token_with_another_header_is_rejected(signer, header):
+    claims = {"iss": ISSUER, "client_id": "client", "scope": "mcp:read", "exp": int(time.time()) + 60, "jti": "j"}
+    assert signer.verify(signed(header, claims, signer.secret)) is None
+    if header["alg"] == "none":
+        unsigned = signed(header, claims, signer.secret).rsplit(".", 1)[0] + "."
+        assert signer.verify(unsigned) is None
+
+
+def test_expired_token_is_rejected(signer):
+    assert signer.verify(signer.issue("client", "mcp:read", time.time() - 1)) is None
+
+
+def test_tampered_claims_are_rejected(signer):
+    header, _, signature = signer.issue("client", "mcp:read", time.time() + 60).split(".")
+    forged = {"iss": ISSUER, "client_id": "client", "scope": "mcp:read mcp:write", "scope_bits": 3,
+              "exp": int(time.time()) + 60, "jti": "j"}
+    payload = b64url_encode(json.dumps(forged, separators=(",", ":")).encode())
+    assert signer.verify(f"{header}.{payload}.{signature}") is None
+
+
+def test_token_from_another_issuer_is_rejected(signer):
+    other = TokenSigner(signer.secret, "https://elsewhere.test")
+    assert signer.verify(other.issue("client", "mcp:read", time.time() + 60)) is None
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    members = [f"member-{i}" for i in range(1000)]
+    for member in members:
+        bloom.add(member)
+    assert all(member in bloom for member in members)
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300  # About 1% expected
+
+
+class AlwaysHit:
+    """A bloom filter that claims to contain everything: every check is a false positive"""
+
+    def __contains__(self, item):
+        return True
+
+
+def test_false_positive_falls_back_to_the_store():
+    revocations = RevocationList(MemoryStore())
+    revocations.revoke("revoked", time.time() + 60)
+    revocations._bloom = AlwaysHit()
+    assert revocations.may_be_revoked("never-revoked")
+    assert not revocations.is_revoked("never-revoked")
+    assert revocations.is_revoked("revoked")
+
+
+@pytest.fixture
+def jwt_app(clodforest, monkeypatch):
+    """The app issuing JWT access tokens, with a revocation list of its own"""
+    signer = TokenSigner(secrets.token_bytes(32), clodforest.OAUTH_CONFIG["issuer"])
+    monkeypatch.setattr(clodforest, "token_signer", signer)
+    monkeypatch.setattr(clodforest, "revocations", RevocationList(clodforest.oauth_store))
+    return clodforest
+
+
+def revoke(client, client_id, client_secret, token):
+    response = client.post("/oauth/revoke", data={"token": token, "client_id": client_id,
+                                                  "client_secret": client_secret})
+    assert response.status_code == 200, response.text
+
+
+def test_revoked_jwt_stops_authenticating(jwt_app, client, oauth):
+    client_id, client_secret, tokens = oauth(client)
+    assert tokens["access_token"].count(".") == 2
+    assert mcp_status(client, tokens["access_token"]) == 200
+
+    revoke(client, client_id, client_secret, tokens["access_token"])
+    assert mcp_status(client, tokens["access_token"]) == 401
+    jwt_app.revocations.sync()  # Rebuilt from the store, the revocation is still there
+    assert mcp_status(client, tokens["access_token"]) == 401
+
+
+def test_revocation_by_another_worker_arrives_on_sync(jwt_app, client, oauth):
+    _, _, tokens = oauth(client)
+    claims = jwt_app.token_signer.verify(tokens["access_token"])
+    other_worker = RevocationList(jwt_app.oauth_store)
+    other_worker.revoke(claims["jti"], claims["exp"])
+
+    assert mcp_status(client, tokens["access_token"]) == 200  # This worker's filter hasn't seen it yet
+    jwt_app.revocations.sync()
+    assert mcp_status(client, tokens["access_token"]) == 401
+
+
+def test_bloom_false_positive_still_authenticates(jwt_app, client, oauth):
+    _, _, tokens = oauth(client)
+    jwt_app.revocations._bloom = AlwaysHit()
+    assert mcp_status(client, tokens["access_token"]) == 200
+
+
+def test_revoking_another_clients_jwt_does_nothing(jwt_app, client, oauth):
+    _, _, tokens = oauth(client)
+    other_id, other_secret, _ = oauth(client)
+    revoke(client, other_id, other_secret, tokens["access_token"])
+    assert mcp_status(client, tokens["access_token"]) == 200
@@ -0,0 +1,52 @@
+"""refresh_token grant: rotation, replay detection and scope narrowing"""
+
+import pytest
+
+from test_oauth_scopes import mcp_status
+
+
+def refresh(client, client_id, client_secret, refresh_token, scope=None):
+    form = {"grant_type": "refresh_token", "client_id": client_id, "client_secret": client_secret,
+            "refresh_token": refresh_token}
+    if scope is not None:
+        form["scope"] = scope
+    return client.post("/oauth/token", data=form)
+
+
+def test_rotation_issues_a_new_refresh_token(client, oauth):
+    client_id, client_secret, tokens = oauth(client)
+    response = refresh(client, client_id, client_secret, tokens["refresh_token"])
+    assert response.status_code == 200, response.text
+    rotated = response.json()
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+    assert rotated["access_token"] != tokens["access_token"]
+    assert rotated["scope"] == tokens["scope"]
+    assert mcp_status(client, rotated["access_token"]) == 200
+
+
+def test_replaying_a_rotated_refresh_token_revokes_the_grant(client, oauth):
+    client_id, client_secret, tokens = oauth(client)
+    rotated = refresh(client, client_id, client_secret, tokens["refresh_token"]).json()
+
+    assert refresh(client, client_id, client_secret, tokens["refresh_token"]).status_code == 400
+    # The whole grant is gone: the rotated tokens stop working too
+    assert refresh(client, client_id, client_secret, rotated["refresh_token"]).status_code == 400
+    assert mcp_status(client, rotated["access_token"]) == 401
+
+
+def test_refresh_may_narrow_the_scope(client, oauth):
+    client_id, client_secret, tokens = oauth(client)
+    response = refresh(client, client_id, client_secret, tokens["refresh_token"], scope="mcp:read")
+    assert response.status_code == 200, response.text
+    assert response.json()["scope"] == "mcp:read"
+
+
+@pytest.mark.parametrize("scope", ["mcp:read mcp:write", "mcp:write", " ", "claudeai"])
+def test_refresh_may_not_widen_or_blank_the_scope(client, oauth, scope):
+    client_id, client_secret, tokens = oauth(client, scope="mcp:read")
+    response = refresh(client, client_id, client_secret, tokens["refresh_token"], scope=scope)
+    assert response.status_code == 400
+    # A refused request leaves the refresh token usable
+    response = refresh(client, client_id, client_secret, tokens["refresh_token"])
+    assert response.status_code == 200, response.text
+    assert response.json()["scope"] == "mcp:read"
@@ -0,0 +1,61 @@
+"""Scopes requested at registration and authorization, and enforced per tool"""
+
+import pytest
+
+from conftest import McpSession
+
+MCP_HEADERS = {"Accept": "application/json, text/event-stream"}
+INITIALIZE = {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {
+    "protocolVersion": "2025-03-26", "capabilities": {}, "clientInfo": {"name": "tests", "version": "1"}}}
+
+
+def mcp_status(client, access_token):
+    response = client.post("/mcp/", json=INITIALIZE,
+                           headers={**MCP_HEADERS, "Authorization": f"Bearer {access_token}"})
+    return response.status_code
+
+
+def test_unknown_scope_falls_back_to_default(client, oauth):
+    _, _, tokens = oauth(client, scope="claudeai")
+    assert tokens["scope"] == "mcp:read mcp:write"
+    assert mcp_status(client, tokens["access_token"]) == 200
+
+
+def test_unknown_scopes_are_dropped(client, oauth):
+    _, _, tokens = oauth(client, scope="claudeai mcp:read")
+    assert tokens["scope"] == "mcp:read"
+    assert mcp_status(client, tokens["access_token"]) == 200
+
+
+def test_default_scope(client, oauth):
+    _, _, tokens = oauth(client)
+    assert tokens["scope"] == "mcp:read mcp:write"
+
+
+def test_write_only_scope_is_refused_on_mcp(client, oauth):
+    _, _, tokens = oauth(client, scope="mcp:write")
+    assert mcp_status(client, tokens["access_token"]) == 403
+
+
+@pytest.fixture
+def read_only_mcp(client, oauth):
+    _, _, tokens = oauth(client, scope="mcp:read")
+    assert tokens["scope"] == "mcp:read"
+    return McpSession(client, tokens["access_token"])
+
+
+@pytest.mark.parametrize("tool, arguments", [
+    ("write_context", {"content": "overwritten\n"}),
+    ("write_contexts", None),
+    ("append_context", {"content": "appended\n"}),
+    ("replace_context_lines", {"start_line": 1, "end_line": 1, "content": "replaced\n"}),
+    ("patch_context", {"diff": "@@ -1 +1 @@\n-original\n+patched\n"}),
+])
+def test_read_only_token_cannot_write(mcp, read_only_mcp, context_dir, tool, arguments):
+    path = f"scopes/{tool}.md"
+    mcp.call("write_context", file_path=path, content="original\n")
+    arguments = {"files": {path: "overwritten\n"}} if arguments is None else {"file_path": path, **arguments}
+
+    assert "requires the mcp:write scope" in read_only_mcp.call_error(tool, **arguments)
+    assert (context_dir / path).read_text() == "original\n"
+    assert read_only_mcp.call("read_context", file_path=path) == "original\n"
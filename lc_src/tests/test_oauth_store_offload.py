@@ -0,0 +1,60 @@
+"""A slow OAuth store must not hold up the event loop"""
+
+import asyncio
+import time
+
+import httpx
+
+
+def test_slow_store_does_not_block_other_requests(clodforest, client, oauth, monkeypatch):
+    client_id, _, _ = oauth(client)  # Starts the app's lifespan, and the executors with it
+    original_get = clodforest.oauth_store.clients.get
+
+    def slow_get(key):
+        time.sleep(1.0)  # A Redis timeout or a SQLite lock held by another worker
+        return original_get(key)
+
+    monkeypatch.setattr(clodforest.oauth_store.clients, "get", slow_get)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=clodforest.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            start = time.perf_counter()
+            authorize = asyncio.create_task(http.get("/oauth/authorize", params={
+                "response_type": "code", "client_id": client_id}))
+            await asyncio.sleep(0.1)  # Returns late if the store call holds the loop
+            health = await http.get("/api/health")
+            health_time = time.perf_counter() - start
+            await authorize
+            return health.status_code, health_time
+
+    status, health_time = asyncio.run(scenario())
+    assert status == 200
+    assert health_time < 0.6
+
+
+def test_opaque_token_lookup_is_awaited(clodforest, client, oauth, monkeypatch):
+    _, _, tokens = oauth(client)
+    original_get = clodforest.oauth_store.tokens.get
+
+    def slow_get(key):
+        time.sleep(1.0)
+        return original_get(key)
+
+    monkeypatch.setattr(clodforest.oauth_store.tokens, "get", slow_get)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=clodforest.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            start = time.perf_counter()
+            mcp = asyncio.create_task(http.post("/mcp/", json={}, headers={
+                "Authorization": f"Bearer {tokens['access_token']}"}))
+            await asyncio.sleep(0.1)
+            health = await http.get("/api/health")
+            health_time = time.perf_counter() - start
+            await mcp
+            return health.status_code, health_time
+
+    status, health_time = asyncio.run(scenario())
+    assert status == 200
+    assert health_time < 0.6
@@ -0,0 +1,99 @@
+"""RespConnection retries: never run GETDEL twice, but survive connections the server closed"""
+
+import socket
+import threading
+import time
+
+import pytest
+
+from oauth_store import RespConnection, StoreError
+
+
+class FakeRedis:
+    """Answers RESP commands with reply(connection number, command)
+
+    A None reply drops the connection without answering; connections
+    numbered in close_after are closed once they have answered one command.
+    """
+
+    def __init__(self, reply, close_after=()):
+        self.reply = reply
+        self.close_after = set(close_after)
+        self.commands = []
+        self.connections = 0
+        self._listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(sock, self.connections), daemon=True).start()
+
+    def _serve(self, sock, number):
+        with sock, sock.makefile("rb") as stream:
+            while True:
+                header = stream.readline()
+                if not header:
+                    return
+                command = []
+                for _ in range(int(header[1:])):
+                    length = int(stream.readline()[1:])
+                    command.append(stream.read(length + 2)[:-2].decode())
+                self.commands.append(command)
+                reply = self.reply(number, command)
+                if reply is None:
+                    return
+                sock.sendall(reply)
+                if number in self.close_after:
+                    return
+
+    def close(self):
+        self._listener.close()
+
+
+@pytest.fixture
+def fake_redis():
+    servers = []
+
+    def start(reply, close_after=()):
+        servers.append(FakeRedis(reply, close_after))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_getdel_is_not_retried_after_the_reply_is_lost(fake_redis):
+    # The first connection runs the command, then drops before answering
+    server = fake_redis(lambda number, command: None if number == 1 else b"$-1\r\n")
+    conn = RespConnection("127.0.0.1", server.port)
+    with pytest.raises(StoreError):
+        conn.call("GETDEL", "code", retry_after_send=False)
+    assert server.commands == [["GETDEL", "code"]]
+
+
+def test_idempotent_command_is_retried_after_the_reply_is_lost(fake_redis):
+    server = fake_redis(lambda number, command: None if number == 1 else b"$5\r\nvalue\r\n")
+    conn = RespConnection("127.0.0.1", server.port)
+    assert conn.call("GET", "key") == b"value"
+    assert server.commands == [["GET", "key"], ["GET", "key"]]
+
+
+def test_getdel_reconnects_when_the_server_closed_the_idle_connection(fake_redis):
+    # Like a Redis idle timeout: the first connection is closed once it has answered
+    server = fake_redis(lambda number, command: b"+OK\r\n" if command[0] == "SET" else b"$5\r\nvalue\r\n",
+                        close_after={1})
+    conn = RespConnection("127.0.0.1", server.port)
+    assert conn.call("SET", "code", "value") == "OK"
+    deadline = time.monotonic() + 2
+    while not conn._stale() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert conn.call("GETDEL", "code", retry_after_send=False) == b"value"
+    assert server.commands == [["SET", "code", "value"], ["GETDEL", "code"]]
+    assert server.connections == 2
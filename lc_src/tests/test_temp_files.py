@@ -0,0 +1,64 @@
+"""atomic_write's temporary files never show up in listings, the search index or watcher events"""
+
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from context_cache import ListingCache
+from context_index import ContextIndex
+from context_io import atomic_write, is_temp_name, temp_path_for
+from context_watcher import ContextWatcher
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "contexts"
+    (root / "notes").mkdir(parents=True)
+    (root / "notes" / "kept.md").write_text("kept words\n")
+    # As if a write were in flight: the temporary file beside its target
+    temp_path_for(root / "notes" / "kept.md").write_text("in flight words\n")
+    return root
+
+
+def test_temp_names():
+    assert is_temp_name(temp_path_for(Path("a.md")).name)
+    for name in ("a.md", ".hidden.md", "notes.tmp", ".a.md.tmp", ".a.md.XYZ12345.tmp"):
+        assert not is_temp_name(name)
+
+
+def test_listing_skips_temp_files(tree):
+    assert ListingCache(tree).files() == ["notes/kept.md"]
+
+
+def test_index_skips_temp_files(tree, tmp_path):
+    index = ContextIndex(tree, tmp_path / "index.db", scan_workers=1)
+    index.refresh()
+    rows = index._connect().execute("SELECT path FROM documents").fetchall()
+    assert rows == [("notes/kept.md",)]
+    hits, total = index.search("words")
+    assert [hit.path for hit in hits] == ["notes/kept.md"] and total == 1
+    index.close()
+
+
+@pytest.mark.parametrize("backend", ["inotify", "poll"])
+def test_watcher_reports_the_target_not_the_temp_file(tree, backend):
+    watcher = ContextWatcher(tree, backend=backend, debounce=0.05, poll_interval=0.05)
+    batches = []
+    delivered = threading.Event()
+    watcher.subscribe(lambda paths: (batches.append(paths), delivered.set()))
+    watcher.start()
+    if backend == "inotify" and watcher.backend != "inotify":
+        watcher.stop()
+        pytest.skip("inotify unavailable")
+    try:
+        time.sleep(0.1)
+        atomic_write(tree / "notes" / "new.md", b"new\n")
+        assert delivered.wait(2)
+        time.sleep(0.2)  # Let any straggling events arrive
+    finally:
+        watcher.stop()
+    reported = set().union(*(paths or set() for paths in batches))
+    assert "notes/new.md" in reported
+    assert not [path for path in reported if is_temp_name(path.rpartition("/")[2])]
@@ -0,0 +1,73 @@
+"""Supervisor restart backoff and follower trust in the shared search index"""
+
+import subprocess
+import sys
+import time
+
+import server_workers
+from context_index import ContextIndex
+from server_workers import Supervisor
+
+
+def crashing_supervisor(monkeypatch):
+    """A one-worker Supervisor whose worker exits with status 3 as soon as it starts"""
+    sup = Supervisor("app:app", ".", "127.0.0.1", 0, 1)
+
+    def spawn(index):
+        sup._processes[index] = subprocess.Popen([sys.executable, "-c", "raise SystemExit(3)"])
+        sup._started_at[index] = time.monotonic()
+        sup._restart_at.pop(index, None)
+    monkeypatch.setattr(sup, "_spawn", spawn)
+    return sup
+
+
+def test_fast_failures_back_off_then_give_up(monkeypatch):
+    sup = crashing_supervisor(monkeypatch)
+    sup._started_at[0] = time.monotonic()
+    delays = []
+    for _ in range(server_workers.MAX_FAST_FAILURES - 1):
+        assert sup._schedule_restart(0, 3)
+        delays.append(sup._restart_at.pop(0) - time.monotonic())
+    assert [round(delay) for delay in delays] == [2, 4, 8, 16]
+    assert not sup._schedule_restart(0, 3)
+
+
+def test_stable_run_resets_backoff(monkeypatch):
+    sup = crashing_supervisor(monkeypatch)
+    sup._fast_failures[0] = 3
+    sup._started_at[0] = time.monotonic() - server_workers.STABLE_AFTER - 1
+    assert sup._schedule_restart(0, 3)
+    assert round(sup._restart_at[0] - time.monotonic()) == server_workers.RESTART_DELAY
+
+
+def test_run_exits_when_a_worker_keeps_crashing(monkeypatch):
+    monkeypatch.setattr(server_workers, "RESTART_DELAY", 0.0)
+    monkeypatch.setattr(server_workers.signal, "signal", lambda signum, handler: None)  # Leave pytest's alone
+    sup = crashing_supervisor(monkeypatch)
+    spawned = []
+    spawn = sup._spawn
+    monkeypatch.setattr(sup, "_spawn", lambda index: (spawned.append(index), spawn(index)))
+    assert sup.run() == 1
+    assert len(spawned) == server_workers.MAX_FAST_FAILURES
+
+
+class Follower:
+    held = False
+
+    def on_acquire(self, callback):
+        pass
+
+
+def test_follower_stops_trusting_a_silent_leader(tmp_path):
+    (tmp_path / "docs").mkdir()
+    leader = ContextIndex(tmp_path / "docs", tmp_path / "index.db", max_age=60)
+    leader.refresh()
+    follower = ContextIndex(tmp_path / "docs", tmp_path / "index.db", max_age=60)
+    follower.follow_leader(Follower())
+    assert follower.is_fresh()
+
+    with leader._connect() as conn:
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'refreshed_at'", (str(time.time() - 61),))
+    assert not follower.is_fresh()
+    leader.close()
+    follower.close()
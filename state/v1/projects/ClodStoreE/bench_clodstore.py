@@ -0,0 +1,247 @@
+"""
+ClodStoreE benchmark - StoryStateManager operations at growing story sizes
+
+Fills a scratch database with a synthetic story for each scale (scenes,
+characters, events, witnesses), then times the calls a LangFlow turn makes:
+record_event, get_character_knowledge, get_current_state and
+format_state_for_prompt. Results go to stdout as JSON, with SQLite's query
+plans, so slow operations can be traced to the table scans behind them.
+
+    python bench_clodstore.py                        # small, medium, large
+    python bench_clodstore.py --scales small,medium --output result.json
+    python bench_clodstore.py --scales custom --scenes 20000 --characters 800 --events 5000000
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from clodstore import CHARACTER_KNOWLEDGE_SQL, CURRENT_STATE_SQL, StoryStateManager
+
+# scenes, characters, events; witnesses follow from who is in each scene
+SCALES = {
+    "small": {"scenes": 100, "characters": 20, "events": 10_000},
+    "medium": {"scenes": 1_000, "characters": 100, "events": 200_000},
+    "large": {"scenes": 5_000, "characters": 500, "events": 2_000_000},
+}
+
+# Calls made per operation even when they overrun the time budget
+MIN_CALLS = 5
+
+EVENT_TYPES = ['dialogue', 'action', 'arrival', 'departure', 'discovery']
+WORDS = ("the dragon sword ancient library crystal city tavern secret map door shadow "
+         "king river storm lantern whisper gold oath traveler sage bridge tower night").split()
+
+
+def character_name(index):
+    return f"Character{index:05d}"
+
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def populate(db_path, scenes, characters, events, seed):
+    """Bulk-load a story straight into the schema; the same seed gives the same story
+
+    Each scene has 3 to 12 participants, drawn with a skew so a few main
+    characters turn up in most scenes, as in a real story. Every event in
+    a scene is witnessed by all of its participants, as the LangFlow
+    "Record Event" node does. The last scene is the current one.
+    """
+    rng = random.Random(seed)
+    StoryStateManager(db_path)  # Creates the schema
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    weights = [1.0 / (rank + 1) for rank in range(characters)]
+    start = datetime(2025, 1, 1)
+    conn.executemany("INSERT INTO characters (id, name, description) VALUES (?, ?, ?)",
+                     ((index + 1, character_name(index), sentence(rng, 8)) for index in range(characters)))
+
+    participants = []
+    scene_rows = []
+    for scene in range(1, scenes + 1):
+        cast = set()
+        size = min(characters, rng.randint(3, 12))
+        while len(cast) < size:
+            cast.add(rng.choices(range(1, characters + 1), weights)[0])
+        participants.append(sorted(cast))
+        scene_rows.append((scene, f"Scene {scene}", f"Location {rng.randrange(200)}", sentence(rng, 10),
+                           scene == scenes))
+    conn.executemany("INSERT INTO scenes (id, scene_name, location, description, is_current) VALUES (?, ?, ?, ?, ?)",
+                     scene_rows)
+    conn.executemany("INSERT INTO scene_participants (scene_id, character_id) VALUES (?, ?)",
+                     ((scene, member) for scene, cast in enumerate(participants, 1) for member in cast))
+
+    witnesses = 0
+    per_scene = events / scenes
+
+    def event_rows():
+        nonlocal witnesses
+        event_id = 0
+        for scene, cast in enumerate(participants, 1):
+            for _ in range(int(per_scene * scene) - int(per_scene * (scene - 1))):
+                event_id += 1
+                witnesses += len(cast)
+                data = {'speaker': character_name(rng.choice(cast) - 1), 'content': sentence(rng)}
+                occurred_at = (start + timedelta(seconds=event_id)).strftime("%Y-%m-%d %H:%M:%S")
+                yield event_id, scene, rng.choice(EVENT_TYPES), json.dumps(data), occurred_at
+
+    def witness_rows():
+        event_id = 0
+        for scene, cast in enumerate(participants, 1):
+            for _ in range(int(per_scene * scene) - int(per_scene * (scene - 1))):
+                event_id += 1
+                for member in cast:
+                    yield event_id, member
+
+    conn.executemany("INSERT INTO events (id, scene_id, event_type, event_data, occurred_at) VALUES (?, ?, ?, ?, ?)",
+                     event_rows())
+    conn.executemany("INSERT INTO event_witnesses (event_id, character_id) VALUES (?, ?)", witness_rows())
+    conn.commit()
+    conn.close()
+    return {
+        "scenes": scenes,
+        "characters": characters,
+        "events": events,
+        "witnesses": witnesses,
+        "current_scene_cast": len(participants[-1]),
+    }
+
+
+def summarize(latencies):
+    """Latencies in seconds -> milliseconds summary"""
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def timed(calls, operation, budget):
+    """Run operation once per argument tuple, stopping early once budget seconds are spent"""
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        operation(*args)
+        latencies.append(time.perf_counter() - start)
+        if len(latencies) >= MIN_CALLS and sum(latencies) > budget:
+            break
+    return summarize(latencies)
+
+
+def query_plan(db_path, query, params=()):
+    with sqlite3.connect(db_path) as conn:
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+
+def bench_scale(db_path, story, iterations, budget, seed):
+    """Time each operation against a populated story"""
+    rng = random.Random(seed + 1)
+    manager = StoryStateManager(db_path)
+    present = manager.get_current_state()['characters']
+    # Speakers are drawn from the current scene, as in a turn; the main
+    # characters there have witnessed the most events
+    speakers = [(rng.choice(present),) for _ in range(iterations)]
+    everyone = [(character_name(rng.randrange(story["characters"])),) for _ in range(iterations)]
+
+    results = {
+        "get_current_state": timed([()] * iterations, manager.get_current_state, budget),
+        "get_character_knowledge": timed(speakers, manager.get_character_knowledge, budget),
+        "get_character_knowledge_any": timed(everyone, manager.get_character_knowledge, budget),
+        "format_state_for_prompt": timed(speakers, manager.format_state_for_prompt, budget),
+    }
+    # Last, since it grows the story; committed per call like the real node
+    records = [('dialogue', {'speaker': rng.choice(present), 'content': sentence(rng)}, present)
+               for _ in range(iterations)]
+    results["record_event"] = timed(records, manager.record_event, budget)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark StoryStateManager operations")
+    parser.add_argument("--scales", default="small,medium,large",
+                        help=f"comma-separated from {', '.join(SCALES)} or custom")
+    parser.add_argument("--scenes", type=int, default=10_000, help="custom scale: scenes")
+    parser.add_argument("--characters", type=int, default=300, help="custom scale: characters")
+    parser.add_argument("--events", type=int, default=1_000_000, help="custom scale: events")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per operation")
+    parser.add_argument("--budget", type=float, default=30.0,
+                        help="seconds per operation after which fewer calls are made")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="keep the generated databases here (default: a temporary directory)")
+    parser.add_argument("--output", help="write the JSON result here as well as to stdout")
+    args = parser.parse_args()
+
+    scales = {}
+    for name in filter(None, args.scales.split(",")):
+        if name == "custom":
+            scales[name] = {"scenes": args.scenes, "characters": args.characters, "events": args.events}
+        elif name in SCALES:
+            scales[name] = SCALES[name]
+        else:
+            parser.error(f"unknown scale {name}")
+
+    temporary = None
+    if args.workdir:
+        workdir = Path(args.workdir)
+        workdir.mkdir(parents=True, exist_ok=True)
+    else:
+        temporary = tempfile.TemporaryDirectory(prefix="clodstore-bench-")
+        workdir = Path(temporary.name)
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {"iterations": args.iterations, "budget": args.budget, "seed": args.seed},
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "scales": {},
+    }
+    try:
+        for name, size in scales.items():
+            db_path = str(workdir / f"{name}.db")
+            if os.path.exists(db_path):
+                os.remove(db_path)
+            print(f"populating {name}: {size}", file=sys.stderr)
+            start = time.perf_counter()
+            story = populate(db_path, size["scenes"], size["characters"], size["events"], args.seed)
+            story["populate_s"] = round(time.perf_counter() - start, 2)
+            story["db_mb"] = round(os.path.getsize(db_path) / 2**20, 1)
+            print(f"timing {name}", file=sys.stderr)
+            result["scales"][name] = {
+                "story": story,
+                "operations": bench_scale(db_path, story, args.iterations, args.budget, args.seed),
+                "query_plans": {
+                    "get_character_knowledge": query_plan(db_path, CHARACTER_KNOWLEDGE_SQL, (character_name(0),)),
+                    "get_current_state": query_plan(db_path, CURRENT_STATE_SQL),
+                },
+            }
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    rendered = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(rendered + "\n")
+    print(rendered)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,29 @@ from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Optional, Any
 
+# The two read queries a LangFlow turn runs; bench_clodstore.py explains their
+# plans, so they live here rather than inline
+CHARACTER_KNOWLEDGE_SQL = """
+    SELECT e.event_type, e.event_data, s.scene_name, e.occurred_at
+    FROM characters c
+    JOIN event_witnesses ew ON c.id = ew.character_id
+    JOIN events e ON ew.event_id = e.id
+    JOIN scenes s ON e.scene_id = s.id
+    WHERE c.name = ?
+    ORDER BY e.occurred_at DESC
+    LIMIT 20
+"""
+
+CURRENT_STATE_SQL = """
+    SELECT s.id, s.scene_name, s.location, s.description,
+           GROUP_CONCAT(c.name) as present_characters
+    FROM scenes s
+    LEFT JOIN scene_participants sp ON s.id = sp.scene_id AND sp.left_at IS NULL
+    LEFT JOIN characters c ON sp.character_id = c.id
+    WHERE s.is_current = TRUE
+    GROUP BY s.id
+"""
+
 class StoryStateManager:
     def __init__(self, db_path: str = None):
         if db_path is None:
@@ -113,16 +136,7 @@ class StoryStateManager:
         with sqlite3.connect(self.db_path) as conn:
             c = conn.cursor()
             
-            c.execute("""
-                SELECT e.event_type, e.event_data, s.scene_name, e.occurred_at
-                FROM characters c
-                JOIN event_witnesses ew ON c.id = ew.character_id
-                JOIN events e ON ew.event_id = e.id
-                JOIN scenes s ON e.scene_id = s.id
-                WHERE c.name = ?
-                ORDER BY e.occurred_at DESC
-                LIMIT 20
-            """, (character_name,))
+            c.execute(CHARACTER_KNOWLEDGE_SQL, (character_name,))
             
             events = []
             for row in c.fetchall():
@@ -140,15 +154,7 @@ class StoryStateManager:
         with sqlite3.connect(self.db_path) as conn:
             c = conn.cursor()
             
-            c.execute("""
-                SELECT s.id, s.scene_name, s.location, s.description,
-                       GROUP_CONCAT(c.name) as present_characters
-                FROM scenes s
-                LEFT JOIN scene_participants sp ON s.id = sp.scene_id AND sp.left_at IS NULL
-                LEFT JOIN characters c ON sp.character_id = c.id
-                WHERE s.is_current = TRUE
-                GROUP BY s.id
-            """)
+            c.execute(CURRENT_STATE_SQL)
             
             result = c.fetchone()
             